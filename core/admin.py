@@ -1,12 +1,21 @@
 from django.contrib import admin
-from .models import Project, PresetParameters, Experiment, Result
+from django.db.models import Count
+from .models import Project, PresetParameters, ParameterSweep, Experiment, Result
 
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('name', 'creation_date')
+    list_display = ('name', 'experiment_count', 'share', 'max_concurrent', 'creation_date')
     search_fields = ('name', 'description')
     list_filter = ('creation_date',)
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(experiment_count=Count('experiments'))
+    
+    @admin.display(description='Experiments', ordering='experiment_count')
+    def experiment_count(self, project):
+        return project.experiment_count
 
 
 @admin.register(PresetParameters)
@@ -16,13 +25,27 @@ class PresetParametersAdmin(admin.ModelAdmin):
     list_filter = ('creation_date',)
 
 
+@admin.register(ParameterSweep)
+class ParameterSweepAdmin(admin.ModelAdmin):
+    list_display = ('name', 'project', 'mode', 'priority', 'max_concurrent', 'creation_date')
+    list_filter = ('mode', 'creation_date', 'project')
+    search_fields = ('name',)
+    list_select_related = ('project',)
+    readonly_fields = ('celery_group_id', 'creation_date')
+
+
 @admin.register(Experiment)
 class ExperimentAdmin(admin.ModelAdmin):
-    list_display = ('name', 'project', 'state', 'creation_date')
+    list_display = ('name', 'project', 'state', 'priority', 'creation_date')
     list_filter = ('state', 'creation_date', 'project')
     search_fields = ('name', 'notes')
+    list_select_related = ('project',)
+    show_full_result_count = False
     readonly_fields = (
         'celery_task_id',
+        'chunk_task_ids',
+        'queued_at',
+        'polled_at',
         'creation_date',
         'processing_start_time',
         'processing_end_time'
@@ -33,4 +56,6 @@ class ExperimentAdmin(admin.ModelAdmin):
 class ResultAdmin(admin.ModelAdmin):
     list_display = ('experiment', 'generation_date')
     search_fields = ('experiment__name',)
+    list_select_related = ('experiment__project',)
+    show_full_result_count = False
     readonly_fields = ('generation_date',)
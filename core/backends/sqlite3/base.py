@@ -0,0 +1,35 @@
+"""
+SQLite backend for single-node installs with concurrent workers.
+
+- Write-ahead logging (WAL), opt-in with PTV_SQLITE_JOURNAL_MODE=WAL:
+  readers (the web views) no longer block on, or block, the workers writing
+  experiment state, and commits only append to the log. With WAL,
+  synchronous=NORMAL stays safe against corruption and avoids a sync per
+  commit. WAL is a property of the database file and keeps -wal and -shm
+  files next to it, so it isn't switched on by default.
+- Transactions start with BEGIN IMMEDIATE, taking the write lock up front.
+  A deferred transaction that reads and then writes (select_for_update is a
+  no-op on SQLite) fails at once with "database is locked" when another one
+  writes meanwhile, without waiting for the timeout; an immediate one waits
+  its turn.
+
+Writes are still serialized, so installs with many workers should use a
+server database (see PTV_DATABASE_URL in settings).
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        journal_mode = settings.PTV_SQLITE_JOURNAL_MODE
+        if journal_mode:
+            conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+            if journal_mode.upper() == 'WAL':
+                conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,433 @@
+"""
+Camera models of a calibration (.cal) file.
+
+A .cal file holds one block per camera, in the layout of MyPTV camera files:
+
+    cam1
+    <O: x y z>           camera position (world units)
+    <theta: rx ry rz>    rotation angles (radians)
+    <xh yh>              principal point (px)
+    <f>                  focal length (px)
+    <E row 1>            optional 2x5 correction terms, one row per image
+    <E row 2>            axis, for (a, b, a^2, b^2, a*b)
+
+Blank lines and '#' comments are ignored; values may be separated by spaces
+or commas.
+
+A world point X is seen by a camera at the normalized coordinates
+(a, b) = (Xc[0] / Xc[2], Xc[1] / Xc[2]) with Xc = R(theta) @ (X - O). The
+correction E is added to (a, b) and the result scaled by f around (xh, yh).
+Projection is a direct array expression. Back-projection has to invert the
+correction, so each corrected camera precomputes the ray of every node of a
+pixel grid once per image size and back-projects any pixel by bilinear
+interpolation of that grid.
+
+Parsed files are kept per worker process keyed by the hash of their content,
+so every chunk of every experiment using a calibration shares one set of
+models and grids.
+"""
+from pathlib import Path
+import re
+
+import numpy as np
+
+from . import fingerprints
+
+
+# Spacing (px) of the nodes of the back-projection grids
+GRID_STEP = 4
+
+# Fixed-point iterations used to invert the correction
+CORRECTION_ITERATIONS = 20
+
+# Candidate ray pairs tested at once by `ray_candidates`
+MAX_CANDIDATE_PAIRS = 4 * 1024 ** 2
+
+# Parsed calibrations, keyed by file digest, per process
+_systems = {}
+
+
+class CalibrationError(ValueError):
+    """A calibration file that can't be parsed"""
+
+
+def rotation_matrix(theta):
+    """Returns R = Rz @ Ry @ Rx for the angles (rx, ry, rz)"""
+    rx, ry, rz = theta
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+    Rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    Ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    Rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return Rz @ Ry @ Rx
+
+
+def _correction_terms(a, b):
+    return np.stack([a, b, a * a, b * b, a * b], axis=-1)
+
+
+class Camera:
+    """
+    Model of one calibrated camera.
+
+    Args:
+        name (str): Camera name, also the name of its frames subfolder
+        O (array): Position (x, y, z)
+        theta (array): Rotation angles (rx, ry, rz)
+        xh, yh (float): Principal point (px)
+        f (float): Focal length (px)
+        E (array): (2, 5) correction terms, zero if omitted
+    """
+
+    def __init__(self, name, O, theta, xh, yh, f, E=None):
+        self.name = name
+        self.O = np.asarray(O, dtype=np.float64)
+        self.theta = np.asarray(theta, dtype=np.float64)
+        self.xh = float(xh)
+        self.yh = float(yh)
+        self.f = float(f)
+        self.E = np.zeros((2, 5)) if E is None else np.asarray(E, dtype=np.float64).reshape(2, 5)
+        self.R = rotation_matrix(self.theta)
+        # {(height, width): (rows, cols, 3) ray directions at the grid nodes}
+        self._grids = {}
+
+    def __repr__(self):
+        return f'<Camera {self.name}>'
+
+    def project(self, points):
+        """
+        Projects world points into the image.
+
+        Args:
+            points (ndarray): (N, 3) world coordinates
+
+        Returns:
+            ndarray: (N, 2) pixel coordinates (x, y); NaN behind the camera
+        """
+        camera = (np.asarray(points, dtype=np.float64) - self.O) @ self.R.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            depth = np.where(camera[:, 2] > 0, camera[:, 2], np.nan)
+            a, b = camera[:, 0] / depth, camera[:, 1] / depth
+        terms = _correction_terms(a, b)
+        a = a + terms @ self.E[0]
+        b = b + terms @ self.E[1]
+        return np.column_stack([self.xh + self.f * a, self.yh + self.f * b])
+
+    def _undistort(self, xy):
+        """Returns the normalized coordinates (a, b) of pixels by fixed-point iteration"""
+        a_d = (xy[..., 0] - self.xh) / self.f
+        b_d = (xy[..., 1] - self.yh) / self.f
+        a, b = a_d, b_d
+        if self.E.any():
+            for _ in range(CORRECTION_ITERATIONS):
+                terms = _correction_terms(a, b)
+                a = a_d - terms @ self.E[0]
+                b = b_d - terms @ self.E[1]
+        return a, b
+
+    def _rays(self, a, b):
+        directions = np.stack([a, b, np.ones_like(a)], axis=-1) @ self.R
+        return directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+    def ray_grid(self, shape):
+        """
+        Returns the ray directions at the nodes of a GRID_STEP pixel grid
+        covering an image of `shape`, computed once per image size.
+        """
+        shape = tuple(shape[:2])
+        if shape not in self._grids:
+            rows = np.arange(0, shape[0] - 1 + GRID_STEP, GRID_STEP, dtype=np.float64)
+            cols = np.arange(0, shape[1] - 1 + GRID_STEP, GRID_STEP, dtype=np.float64)
+            nodes = np.stack(np.meshgrid(cols, rows), axis=-1)
+            self._grids[shape] = self._rays(*self._undistort(nodes))
+        return self._grids[shape]
+
+    def back_project(self, xy, shape=None):
+        """
+        Returns the viewing rays of pixels.
+
+        Args:
+            xy (ndarray): (N, 2) pixel coordinates (x, y)
+            shape (tuple): Image (height, width); when given, rays of a
+                camera with a correction are interpolated from its grid
+                instead of inverting the correction for every pixel
+
+        Returns:
+            ndarray: (N, 3) unit directions of the rays, which start at O
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if shape is None or not self.E.any():
+            return self._rays(*self._undistort(xy))
+
+        grid = self.ray_grid(shape)
+        gx, gy = xy[:, 0] / GRID_STEP, xy[:, 1] / GRID_STEP
+        # Pixels outside the image extrapolate the border cells
+        col = np.clip(np.floor(gx).astype(np.int64), 0, grid.shape[1] - 2)
+        row = np.clip(np.floor(gy).astype(np.int64), 0, grid.shape[0] - 2)
+        fx = (gx - col)[:, None]
+        fy = (gy - row)[:, None]
+        directions = (
+            grid[row, col] * (1 - fx) * (1 - fy)
+            + grid[row, col + 1] * fx * (1 - fy)
+            + grid[row + 1, col] * (1 - fx) * fy
+            + grid[row + 1, col + 1] * fx * fy
+        )
+        return directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+class CameraSystem:
+    """
+    The cameras of a calibration file.
+
+    Args:
+        cameras (list): Camera objects in file order
+        digest (str): SHA-256 of the file
+    """
+
+    def __init__(self, cameras, digest):
+        self.cameras = list(cameras)
+        self.digest = digest
+        self._by_name = {camera.name: camera for camera in self.cameras}
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __iter__(self):
+        return iter(self.cameras)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    @property
+    def names(self):
+        return [camera.name for camera in self.cameras]
+
+
+def _parse_numbers(line):
+    try:
+        return [float(token) for token in re.split(r'[\s,]+', line.strip()) if token]
+    except ValueError:
+        return None
+
+
+def parse(text):
+    """
+    Parses the content of a .cal file.
+
+    Returns:
+        list: Camera objects
+
+    Raises:
+        CalibrationError: If a camera block is malformed
+    """
+    blocks = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        numbers = _parse_numbers(line)
+        if numbers is None:
+            blocks.append((line.rstrip(':'), []))
+        elif not blocks:
+            raise CalibrationError("Calibration values found before a camera name")
+        else:
+            blocks[-1][1].append(numbers)
+
+    if not blocks:
+        raise CalibrationError("No camera found in the calibration file")
+
+    expected = (3, 3, 2, 1)
+    cameras = []
+    for name, rows in blocks:
+        if len(rows) not in (4, 6) or any(len(row) != size for row, size in zip(rows, expected + (5, 5))):
+            raise CalibrationError(
+                f"Camera '{name}' needs rows of 3 (O), 3 (theta), 2 (xh yh), 1 (f) "
+                f"and optionally 2 x 5 (E) values"
+            )
+        O, theta, (xh, yh), (f,) = rows[:4]
+        if f <= 0:
+            raise CalibrationError(f"Camera '{name}' has a non-positive focal length")
+        cameras.append(Camera(name, O, theta, xh, yh, f, rows[4:] or None))
+
+    names = [camera.name for camera in cameras]
+    if len(set(names)) != len(names):
+        raise CalibrationError("Camera names must be unique")
+    return cameras
+
+
+def dumps(cameras):
+    """Returns the .cal text of cameras (the inverse of `parse`)"""
+    blocks = []
+    for camera in cameras:
+        rows = [camera.O, camera.theta, [camera.xh, camera.yh], [camera.f]]
+        if camera.E.any():
+            rows += list(camera.E)
+        blocks.append('\n'.join([camera.name] + [' '.join(repr(float(v)) for v in row) for row in rows]))
+    return '\n\n'.join(blocks) + '\n'
+
+
+def load_cameras(calibration_file):
+    """
+    Returns the CameraSystem of a .cal file, parsed once per process and
+    file content.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        CalibrationError: If it can't be parsed
+    """
+    path = Path(calibration_file)
+    if not path.is_file():
+        raise FileNotFoundError(f"Calibration file not found: {calibration_file}")
+
+    digest = fingerprints.file_digest(path)
+    if digest not in _systems:
+        _systems[digest] = CameraSystem(parse(path.read_text()), digest)
+    return _systems[digest]
+
+
+def ray_distances(origin_a, directions_a, origin_b, directions_b):
+    """
+    Returns the distances between rays of camera A and rays of camera B.
+
+    Args:
+        origin_a, origin_b (ndarray): (3,) camera positions
+        directions_a, directions_b (ndarray): (..., 3) unit directions,
+            broadcast against each other
+
+    Returns:
+        ndarray: Distances; infinite for parallel rays and for rays that
+        only meet behind a camera
+    """
+    baseline = origin_b - origin_a
+    normals = np.cross(directions_a, directions_b)
+    norms = np.linalg.norm(normals, axis=-1)
+
+    # Parameters of the closest points along each ray
+    cos = (directions_a * directions_b).sum(axis=-1)
+    along_a = directions_a @ baseline
+    along_b = directions_b @ baseline
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = 1 - cos ** 2
+        t_a = (along_a - cos * along_b) / denominator
+        t_b = (cos * along_a - along_b) / denominator
+        distances = np.abs(normals @ baseline) / norms
+
+    return np.where((norms > 1e-12) & (t_a > 0) & (t_b > 0), distances, np.inf)
+
+
+def _epipolar_angles(directions, e1, e2):
+    """
+    Returns the angles of the rays' planes around the baseline, and the sines
+    of the rays' angles to the baseline.
+    """
+    p1, p2 = directions @ e1, directions @ e2
+    return np.arctan2(p2, p1), np.hypot(p1, p2)
+
+
+def ray_candidates(origin_a, directions_a, origin_b, directions_b, tolerance):
+    """
+    Returns the pairs of rays of cameras A and B that pass within
+    `tolerance` of each other.
+
+    Two rays that meet lie in the same plane through the baseline of the
+    cameras. The rays of B are sorted by the angle of that plane, and each
+    ray of A only tests the rays of B in a window of angles around its own:
+    a ray at angle difference dpsi, with angles alpha_a and alpha_b to the
+    baseline, is at least |baseline| sin(alpha_a) sin(alpha_b) |sin(dpsi)|
+    away, so rays outside the window can't match. Candidates are tested in
+    blocks of at most MAX_CANDIDATE_PAIRS to bound memory.
+
+    Args:
+        origin_a, origin_b (ndarray): (3,) camera positions
+        directions_a (ndarray): (N, 3) unit directions
+        directions_b (ndarray): (M, 3) unit directions
+        tolerance (float): Maximum distance between matching rays
+
+    Returns:
+        tuple: (index_a, index_b, distance) arrays of the pairs
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    baseline = origin_b - origin_a
+    length = np.linalg.norm(baseline)
+    if len(directions_a) == 0 or len(directions_b) == 0 or length == 0:
+        return empty
+
+    axis = baseline / length
+    helper = np.eye(3)[np.argmin(np.abs(axis))]
+    e1 = np.cross(axis, helper)
+    e1 /= np.linalg.norm(e1)
+    e2 = np.cross(axis, e1)
+    psi_a, sin_a = _epipolar_angles(directions_a, e1, e2)
+    psi_b, sin_b = _epipolar_angles(directions_b, e1, e2)
+
+    # Half-width of each window; |sin(dpsi)| is also small around dpsi = pi
+    with np.errstate(divide='ignore'):
+        bound = tolerance / (length * sin_a * sin_b.min())
+    full = bound >= 1
+    width = np.where(full, np.pi, np.arcsin(np.minimum(bound, 1)))
+    opposite = np.nonzero(~full)[0]
+    owners = np.concatenate([np.arange(len(psi_a)), opposite])
+    centers = np.concatenate([psi_a, psi_a[opposite] + np.pi])
+    centers = np.mod(centers + np.pi, 2 * np.pi) - np.pi
+    width = np.concatenate([width, width[opposite]])
+
+    # Sorted angles of B, repeated one turn before and after for wrapping windows
+    order = np.argsort(psi_b, kind='stable')
+    angles = np.concatenate([psi_b[order] - 2 * np.pi, psi_b[order], psi_b[order] + 2 * np.pi])
+    indices = np.tile(order, 3)
+    low = np.searchsorted(angles, centers - width, side='left')
+    high = np.searchsorted(angles, centers + width, side='right')
+    counts = high - low
+
+    pairs_a, pairs_b, pairs_distance = [empty[0]], [empty[1]], [empty[2]]
+    ends = np.cumsum(counts)
+    block_start = 0
+    while block_start < len(counts):
+        limit = (ends[block_start - 1] if block_start else 0) + MAX_CANDIDATE_PAIRS
+        block_end = max(int(np.searchsorted(ends, limit, side='right')), block_start + 1)
+        block = slice(block_start, block_end)
+        block_counts = counts[block]
+        total = int(block_counts.sum())
+        if total:
+            first = np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+            a = np.repeat(owners[block], block_counts)
+            b = indices[np.repeat(low[block], block_counts) + np.arange(total) - first]
+            distances = ray_distances(origin_a, directions_a[a], origin_b, directions_b[b])
+            close = distances <= tolerance
+            pairs_a.append(a[close])
+            pairs_b.append(b[close])
+            pairs_distance.append(distances[close])
+        block_start = block_end
+
+    a, b, distances = (np.concatenate(values) for values in (pairs_a, pairs_b, pairs_distance))
+    # Full-turn windows can reach the same ray at both ends
+    _, unique = np.unique(a * len(directions_b) + b, return_index=True)
+    return a[unique], b[unique], distances[unique]
+
+
+def triangulate(origins, directions, weights):
+    """
+    Returns the points closest to sets of rays in the least-squares sense.
+
+    Args:
+        origins (ndarray): (C, 3) camera positions
+        directions (ndarray): (K, C, 3) ray directions of K points in C cameras
+        weights (ndarray): (K, C) 1 where the camera sees the point, else 0
+
+    Returns:
+        tuple: ((K, 3) points, (K,) RMS distance from the points to their rays)
+    """
+    # Projectors onto the plane normal to each ray
+    projectors = np.eye(3) - directions[..., :, None] * directions[..., None, :]
+    projectors *= weights[..., None, None]
+    A = projectors.sum(axis=1)
+    b = np.einsum('kcij,cj->ki', projectors, origins)
+    points = np.linalg.solve(A, b[..., None])[..., 0]
+
+    offsets = np.einsum('kcij,kcj->kci', projectors, points[:, None, :] - origins[None])
+    residuals = np.sqrt((offsets ** 2).sum(axis=(1, 2)) / weights.sum(axis=1))
+    return points, residuals
@@ -0,0 +1,81 @@
+"""
+Cancellation of running experiments.
+
+Cancelling an experiment revokes its Celery tasks, which drops the ones still
+waiting in a queue, and raises an abort flag in Redis. Tasks already running
+check the flag between batches of frames and between stages, so they stop
+within seconds instead of holding their worker until the chunk is done.
+
+Work done before the abort is kept as a checkpoint (see core.checkpoints):
+completed chunks and the partial segmentation of interrupted chunks are
+reused when the experiment is resumed.
+"""
+from celery import current_app
+from django.conf import settings
+import redis
+
+from . import events
+from .models import Experiment
+
+
+class ExperimentCancelled(Exception):
+    """Raised in a task whose experiment was cancelled"""
+
+
+def abort_key(experiment_id):
+    return f'ptv:experiment:{experiment_id}:abort'
+
+
+def request_abort(experiment_id):
+    """
+    Raises the abort flag of an experiment, read by its running tasks.
+    Without Redis, running tasks still stop at their next stage, where the
+    experiment state is checked.
+    """
+    try:
+        events.get_redis().set(abort_key(experiment_id), 1, ex=settings.PTV_ABORT_FLAG_TTL)
+    except redis.RedisError as e:
+        print(f"[EVENTS] Could not set abort flag of experiment {experiment_id}: {e}")
+
+
+def clear_abort(experiment_id):
+    """Lowers the abort flag, so a resumed experiment runs again"""
+    try:
+        events.get_redis().delete(abort_key(experiment_id))
+    except redis.RedisError as e:
+        print(f"[EVENTS] Could not clear abort flag of experiment {experiment_id}: {e}")
+
+
+def is_aborted(experiment_id):
+    """
+    Returns whether the experiment was cancelled. A single EXISTS, cheap
+    enough to call between batches; an unreachable Redis never stops
+    processing.
+    """
+    try:
+        return bool(events.get_redis().exists(abort_key(experiment_id)))
+    except redis.RedisError as e:
+        print(f"[EVENTS] Could not read abort flag of experiment {experiment_id}: {e}")
+        return False
+
+
+def check_abort(experiment_id):
+    """
+    Raises ExperimentCancelled if the experiment was cancelled. Called
+    between stages, where the experiment state is also read.
+    """
+    if is_aborted(experiment_id) or Experiment.objects.filter(id=experiment_id, state='CANCELLED').exists():
+        raise ExperimentCancelled(f"Experiment {experiment_id} was cancelled")
+
+
+def revoke_tasks(experiment):
+    """
+    Revokes the orchestrator (which resolves to the merge once the chunks are
+    fanned out) and chunk tasks of an experiment. Queued tasks are discarded
+    by the workers; running ones stop at their next abort check.
+    """
+    task_ids = [experiment.celery_task_id] + list(experiment.chunk_task_ids)
+    task_ids = [task_id for task_id in task_ids if task_id]
+    if task_ids:
+        current_app.control.revoke(task_ids)
+    return task_ids
@@ -0,0 +1,174 @@
+"""
+Checkpoints of long runs, so an interrupted experiment resumes where it stopped.
+
+Two levels of progress survive a worker dying or a run failing:
+
+- Completed chunks: every chunk records the stage key of its trajectories in
+  Experiment.checkpoint once they are stored (see core.stage_cache). A new
+  run of the experiment only fans out the chunks without a valid entry, and
+  merges the recorded ones with them.
+- Partial segmentations: while segmenting a chunk, the detections of the
+  frames done so far are saved every PTV_CHECKPOINT_SECONDS as a 'partial'
+  stage output under the chunk's segmentation key, and segmentation picks
+  up after the last saved frame. Tracking is not checkpointed: it is
+  recomputed from the detections in a fraction of the segmentation time.
+  Cancelled chunks (see core.cancellation) save their partial segmentation
+  before stopping.
+
+The checkpoint also keeps the frames each chunk counted in frames_processed
+(see count_chunk_frames): chunk tasks are acknowledged late, so a chunk
+whose worker died is delivered again and must not count its frames twice.
+
+Checkpoints belong to one run key (see core.fingerprints): when the images,
+calibration or parameters change, the recorded chunks are discarded.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import pipeline, stage_cache
+from .cancellation import ExperimentCancelled
+from .models import Experiment
+
+
+def _chunk_name(start, end):
+    return f'{start}-{end}'
+
+
+def start_run(experiment):
+    """
+    Returns the checkpoint of a run that is (re)starting, cleared if it was
+    recorded for other inputs.
+
+    The run is identified by the experiment's cache_key, which must be up to
+    date (see result_cache.assign_cache_key).
+    """
+    run = experiment.cache_key
+    checkpoint = experiment.checkpoint or {}
+    if not run or checkpoint.get('run') != run:
+        checkpoint = {'run': run, 'chunks': {}}
+        experiment.checkpoint = checkpoint
+        experiment.save(update_fields=['checkpoint'])
+    return checkpoint
+
+
+def completed_chunks(checkpoint, chunks):
+    """
+    Returns the chunks of a run whose trajectories are recorded and still
+    stored.
+
+    Args:
+        checkpoint (dict): Experiment.checkpoint
+        chunks (list): (start, end) chunks of the run
+
+    Returns:
+        dict: {(start, end): tracking stage key}
+    """
+    recorded = checkpoint.get('chunks', {})
+    completed = {}
+    for start, end in chunks:
+        key = recorded.get(_chunk_name(start, end))
+        if key and stage_cache.output_path('tracking', key).is_file():
+            completed[(start, end)] = key
+    return completed
+
+
+def reset_progress(checkpoint, completed, chunk_frames):
+    """
+    Counts only the completed chunks in the checkpoint of a (re)starting
+    run, whose frames_processed starts from them.
+
+    Args:
+        checkpoint (dict): Experiment.checkpoint, updated in place
+        completed (iterable): (start, end) chunks completed by an earlier run
+        chunk_frames (callable): Frames a (start, end) chunk adds to frames_processed
+
+    Returns:
+        int: Frames of the completed chunks
+    """
+    checkpoint['counted'] = {_chunk_name(start, end): chunk_frames(start, end) for start, end in completed}
+    return sum(checkpoint['counted'].values())
+
+
+def count_chunk_frames(experiment_id, start, end, frames, **changes):
+    """
+    Counts `frames` frames of a chunk in frames_processed, along with
+    `changes` to other columns.
+
+    Only the frames beyond those the chunk already counted, in this or an
+    earlier delivery of its task, are added, so a redelivered chunk never
+    counts twice and frames_processed never exceeds total_frames.
+
+    Returns:
+        int: Frames added to frames_processed
+    """
+    name = _chunk_name(start, end)
+    with transaction.atomic():
+        experiment = Experiment.objects.select_for_update().only('checkpoint').filter(id=experiment_id).first()
+        if experiment is None:
+            return 0
+        checkpoint = experiment.checkpoint or {}
+        counted = checkpoint.setdefault('counted', {})
+        increment = max(frames - counted.get(name, 0), 0)
+        if increment:
+            counted[name] = frames
+            changes.update(checkpoint=checkpoint, frames_processed=F('frames_processed') + increment)
+        if changes:
+            Experiment.objects.filter(id=experiment_id).update(**changes)
+    return increment
+
+
+def record_chunk(experiment_id, start, end, key):
+    """Records a completed chunk; concurrent chunks lock the experiment row in turn"""
+    with transaction.atomic():
+        experiment = Experiment.objects.select_for_update().only('checkpoint').get(id=experiment_id)
+        checkpoint = experiment.checkpoint or {}
+        checkpoint.setdefault('chunks', {})[_chunk_name(start, end)] = key
+        experiment.checkpoint = checkpoint
+        experiment.save(update_fields=['checkpoint'])
+
+
+def segment_chunk(sequence, start, end, parameters, key, aborted=None, progress=None, profile=None):
+    """
+    `pipeline.segment_chunk` that resumes from and periodically saves the
+    partial segmentation stored under the segmentation key `key`.
+
+    `aborted` is called between batches; when it returns True the frames
+    segmented so far are saved and ExperimentCancelled is raised.
+    `progress` is called with the number of frames of every batch done
+    (see core.progress). The stages are timed in `profile` (see
+    core.profiling).
+    """
+    partial = stage_cache.load_output('partial', key)
+    parts = []
+    resume_from = start
+    if partial is not None:
+        resume_from = int(partial.pop('next_frame'))
+        parts.append(partial)
+        print(f"[CELERY] Resuming segmentation of frames {start}-{end} at frame {resume_from}")
+        if progress is not None:
+            progress(resume_from - start)
+
+    last_save = time.monotonic()
+    batch_start = resume_from
+    for next_frame, detections in pipeline.iter_segmentation(sequence, resume_from, end, parameters, profile):
+        parts.append(detections)
+        if progress is not None:
+            progress(next_frame - batch_start)
+        batch_start = next_frame
+        if next_frame >= end:
+            continue
+        stop = aborted is not None and aborted()
+        if stop or time.monotonic() - last_save >= settings.PTV_CHECKPOINT_SECONDS:
+            # Merged so the saved checkpoint and the parts held in memory stay one array each
+            parts = [pipeline.concatenate_detections(parts)]
+            stage_cache.save_output('partial', key, dict(parts[0], next_frame=next_frame))
+            last_save = time.monotonic()
+        if stop:
+            raise ExperimentCancelled(f"Segmentation of frames {start}-{end} stopped at frame {next_frame}")
+
+    detections = pipeline.concatenate_detections(parts)
+    stage_cache.output_path('partial', key).unlink(missing_ok=True)
+    return detections
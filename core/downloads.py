@@ -0,0 +1,366 @@
+"""
+Downloads of result files and project archives.
+
+Files are streamed from disk block by block, never read whole into the
+Django process:
+
+- Plain downloads are FileResponses, which WSGI servers with a file wrapper
+  (gunicorn, ...) send with sendfile(). A single byte range (Range:
+  bytes=first-last, validated by If-Range) is answered with 206 Partial
+  Content, so interrupted downloads resume where they stopped. With
+  PTV_ACCEL_REDIRECT_LOCATION set the view only answers with an
+  X-Accel-Redirect header and nginx sends the file, ranges included.
+- ?compress=gzip|zstd streams the file compressed on the fly (zstd needs the
+  optional zstandard package). Compressed streams have no known length and
+  cannot be resumed.
+- trajectories.csv is served from the file written by Result.export_text
+  when there is one, and otherwise streamed from the trajectory store as it
+  is formatted (compressed too with ?compress=), without writing it first.
+- Project archives are zip files written to the response as the member
+  files are read: zipfile writes to an unseekable stream with data
+  descriptors instead of seeking back to the local headers.
+
+Under ASGI, Django reads a synchronous streaming iterator to the end before
+sending anything, so there the blocks are read in a worker thread and
+handed to an async iterator instead (see `aiterate`).
+"""
+from email.utils import formatdate
+from pathlib import Path
+import json
+import mimetypes
+import re
+import zipfile
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from django.utils.text import slugify
+
+from .storage import STREAM_BLOCK_ROWS
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for ?compress=zstd
+    zstandard = None
+
+
+# Bytes read from disk per block
+DOWNLOAD_BLOCK_SIZE = 1 << 20
+
+CSV_NAME = 'trajectories.csv'
+
+# Suffix and content type of the on-the-fly compressions
+COMPRESSIONS = {
+    'gzip': ('.gz', 'application/gzip'),
+    'zstd': ('.zst', 'application/zstd'),
+}
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def available_compressions():
+    return [name for name in COMPRESSIONS if name != 'zstd' or zstandard is not None]
+
+
+def result_files(result):
+    """
+    Returns the downloadable files of a result as {name: path}: the columns
+    and indexes of the trajectory store (store/...), the CSV export if it
+    was generated and the additional files (files/...).
+    """
+    files = {}
+    store = Path(result.data_path) if result.data_path else None
+    if store is not None and store.is_dir():
+        for path in sorted(store.rglob('*')):
+            if path.is_file():
+                files[f'store/{path.relative_to(store).as_posix()}'] = path
+    if result.txt_file_path and Path(result.txt_file_path).is_file():
+        files[CSV_NAME] = Path(result.txt_file_path)
+    for name in result.additional_files:
+        path = Path(name)
+        if path.is_file():
+            files[f'files/{path.name}'] = path
+    return files
+
+
+def parse_range(header, size):
+    """
+    Reads a Range header against a file of `size` bytes.
+
+    Only single ranges are served; missing, malformed and multi-range
+    headers give None, and the whole file is sent.
+
+    Returns:
+        tuple or None: (first, end) byte positions, end excluded
+
+    Raises:
+        ValueError: If the range does not overlap the file (416)
+    """
+    match = RANGE_PATTERN.match((header or '').replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last `last` bytes
+        if not size or not int(last):
+            raise ValueError(f'Range not satisfiable for {size} bytes')
+        return max(size - int(last), 0), size
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError(f'Range not satisfiable for {size} bytes')
+    return first, min(int(last) + 1, size) if last else size
+
+
+class FileRange:
+    """
+    File object reading at most `length` bytes from the current position.
+
+    It has no fileno(): WSGI file wrappers then fall back to read() instead
+    of sending the file to its end.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def read_blocks(file, length=None, block_size=DOWNLOAD_BLOCK_SIZE):
+    """Yields up to `length` bytes (all if None) of an open file, closing it at the end"""
+    try:
+        while length is None or length > 0:
+            block = file.read(block_size if length is None else min(block_size, length))
+            if not block:
+                break
+            if length is not None:
+                length -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+async def aiterate(iterator):
+    """Yields the items of a blocking iterator, each one produced in a worker thread"""
+    done = object()
+    next_item = sync_to_async(next, thread_sensitive=False)
+    try:
+        while (item := await next_item(iterator, done)) is not done:
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+def streaming_response(request, iterator, **kwargs):
+    """StreamingHttpResponse that streams `iterator` without buffering under WSGI and ASGI"""
+    if isinstance(request, ASGIRequest):
+        iterator = aiterate(iterator)
+    return StreamingHttpResponse(iterator, **kwargs)
+
+
+def _content_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _entity_tag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _accel_location(path):
+    """Internal nginx location of `path` if it's under PTV_DATA_DIR and X-Accel-Redirect is set up"""
+    if not settings.PTV_ACCEL_REDIRECT_LOCATION:
+        return None
+    try:
+        relative = Path(path).resolve().relative_to(Path(settings.PTV_DATA_DIR).resolve())
+    except ValueError:
+        return None
+    return settings.PTV_ACCEL_REDIRECT_LOCATION.rstrip('/') + '/' + relative.as_posix()
+
+
+def file_response(request, path, filename):
+    """
+    Response sending the file at `path` as the attachment `filename`,
+    honouring a single Range (see parse_range).
+    """
+    path = Path(path)
+    stat = path.stat()
+    headers = {
+        'Content-Disposition': content_disposition_header(True, filename),
+        'Accept-Ranges': 'bytes',
+        'ETag': _entity_tag(stat),
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+    }
+    content_type = _content_type(filename)
+
+    location = _accel_location(path)
+    if location is not None:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = location
+        return response
+
+    # Ranges of a file that changed since the client got its first part are ignored
+    if_range = request.headers.get('If-Range')
+    byte_range = None
+    if not if_range or if_range in (headers['ETag'], headers['Last-Modified']):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{stat.st_size}'})
+    first, end = byte_range or (0, stat.st_size)
+
+    file = open(path, 'rb')
+    file.seek(first)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(aiterate(read_blocks(file, end - first)), content_type=content_type)
+    else:
+        response = FileResponse(file if byte_range is None else FileRange(file, end - first), content_type=content_type)
+        response.block_size = DOWNLOAD_BLOCK_SIZE
+    for header, value in headers.items():
+        response[header] = value
+    response['Content-Length'] = end - first
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {first}-{end - 1}/{stat.st_size}'
+    return response
+
+
+def compress_blocks(blocks, compression):
+    """Yields the byte blocks of `blocks` compressed with `compression` ('gzip' or 'zstd')"""
+    if compression == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_compressed(path, compression, block_size=DOWNLOAD_BLOCK_SIZE):
+    """Yields the file at `path` compressed with `compression` ('gzip' or 'zstd')"""
+    return compress_blocks(read_blocks(open(path, 'rb'), block_size=block_size), compression)
+
+
+def compressed_response(request, path, filename, compression):
+    """Response streaming the file at `path` compressed, as the attachment `filename` + suffix"""
+    suffix, content_type = COMPRESSIONS[compression]
+    response = streaming_response(request, iter_compressed(path, compression), content_type=content_type)
+    response['Content-Disposition'] = content_disposition_header(True, filename + suffix)
+    response['Accept-Ranges'] = 'none'
+    return response
+
+
+def csv_response(request, store, filename, compression=None):
+    """
+    Response streaming a TrajectoryStore as CSV, formatted block by block,
+    as the attachment `filename` (+ suffix when compressed).
+    """
+    blocks = (text.encode() for text in store.iter_text(STREAM_BLOCK_ROWS))
+    if compression:
+        suffix, content_type = COMPRESSIONS[compression]
+        blocks = compress_blocks(blocks, compression)
+        filename += suffix
+    else:
+        content_type = 'text/csv'
+    response = streaming_response(request, blocks, content_type=content_type)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'none'
+    return response
+
+
+class _ZipOutput:
+    """Write-only stream keeping what zipfile writes until it is taken"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_zip(entries, compress=False, block_size=DOWNLOAD_BLOCK_SIZE):
+    """
+    Yields a zip archive of `entries`, written as the files are read.
+
+    Args:
+        entries (iterable): (name in the archive, path of a file or bytes)
+        compress (bool): Deflate the members (stored as is otherwise)
+    """
+    output = _ZipOutput()
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(output, 'w', compression=compression) as archive:
+        for name, source in entries:
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+            else:
+                info = zipfile.ZipInfo.from_file(source, name)
+                info.compress_type = compression
+                with archive.open(info, 'w') as member:
+                    for block in read_blocks(open(source, 'rb'), block_size=block_size):
+                        member.write(block)
+                        if output.parts:
+                            yield output.take()
+            if output.parts:
+                yield output.take()
+    yield output.take()
+
+
+def project_entries(project):
+    """
+    Members of the archive of a project: per completed experiment a folder
+    with an experiment.json (parameters and metrics) and its result files.
+
+    Returns:
+        list: (name in the archive, path or bytes) pairs
+    """
+    experiments = project.experiments.filter(
+        state='COMPLETED', result__isnull=False
+    ).select_related('result').order_by('id')
+    entries = []
+    for experiment in experiments:
+        result = experiment.result
+        folder = f'{experiment.id}_{slugify(experiment.name) or "experiment"}'
+        description = {
+            'id': experiment.id,
+            'name': experiment.name,
+            'parameters': experiment.used_parameters,
+            'key_metrics': result.key_metrics,
+            'statistics': result.statistics,
+        }
+        entries.append((f'{folder}/experiment.json', json.dumps(description, indent=2).encode()))
+        entries += [(f'{folder}/{name}', path) for name, path in result_files(result).items()]
+    return entries
+
+
+def zip_response(request, entries, filename, compress=False):
+    """Response streaming a zip archive of `entries` (see iter_zip) as the attachment `filename`"""
+    response = streaming_response(request, iter_zip(entries, compress), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'none'
+    return response
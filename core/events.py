@@ -0,0 +1,160 @@
+"""
+Experiment progress events pushed over Redis pub/sub.
+
+Workers publish a status snapshot on every state change and processed chunk
+to the experiment's channel. The ASGI event stream view subscribes to it and
+forwards the snapshots to the browser as Server-Sent Events, so watchers
+don't need to poll the database and the result backend.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+import redis
+import redis.asyncio
+
+
+# States after which no more events are published
+TERMINAL_STATES = ('COMPLETED', 'ERROR', 'CANCELLED')
+
+_client = None
+
+
+def experiment_channel(experiment_id):
+    return f'ptv:experiment:{experiment_id}:events'
+
+
+def get_redis():
+    """Returns the (per process) Redis client used to publish events"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.PTV_REDIS_URL)
+    return _client
+
+
+# Fields read by experiment_snapshot, for workers loading only those
+SNAPSHOT_FIELDS = (
+    'name', 'state', 'error_message', 'total_frames', 'frames_processed',
+    'frames_at_start', 'progress_stage', 'processing_start_time',
+)
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h {minutes:02d}m' if hours else f'{minutes}m {seconds:02d}s'
+
+
+def experiment_snapshot(experiment):
+    """
+    Returns the status fields of an experiment, as sent to the monitoring page.
+    """
+    data = {
+        'experiment_id': experiment.id,
+        'name': experiment.name,
+        'status': experiment.state,
+        'status_display': experiment.get_state_display(),
+        'error_message': experiment.error_message,
+    }
+
+    # Chunk tasks report the processed frames and stage on the experiment itself
+    if experiment.state == 'PROCESSING' and experiment.total_frames:
+        progress = {
+            'current': experiment.frames_processed,
+            'total': experiment.total_frames,
+            'stage': experiment.progress_stage,
+            'fps': None,
+            'eta_seconds': None,
+        }
+        status = f'Processed {experiment.frames_processed}/{experiment.total_frames} frames'
+
+        # Rate of this run only: frames completed by an interrupted run are left out
+        done = experiment.frames_processed - experiment.frames_at_start
+        if experiment.processing_start_time and done > 0:
+            elapsed = (timezone.now() - experiment.processing_start_time).total_seconds()
+            if elapsed > 0:
+                progress['fps'] = round(done / elapsed, 2)
+                progress['eta_seconds'] = round((experiment.total_frames - experiment.frames_processed) * elapsed / done)
+                status += f', {progress["fps"]:g} frames/s, ETA {_format_duration(progress["eta_seconds"])}'
+        if experiment.progress_stage:
+            status = f'{experiment.progress_stage.capitalize()}: {status}'
+
+        progress['status'] = status
+        data['progress'] = progress
+    return data
+
+
+def notify_experiment_changed(experiment):
+    """
+    Signals a change of an experiment's state or progress.
+
+    Drops its cached status (see core.status) and publishes its current
+    snapshot. Both are best effort: a cache or Redis failure never
+    interrupts processing, watchers fall back to polling.
+    """
+    from .status import invalidate_status
+
+    try:
+        invalidate_status(experiment.id)
+    except Exception as e:
+        print(f"[EVENTS] Could not invalidate status of experiment {experiment.id}: {e}")
+
+    try:
+        get_redis().publish(
+            experiment_channel(experiment.id),
+            json.dumps(experiment_snapshot(experiment))
+        )
+    except redis.RedisError as e:
+        print(f"[EVENTS] Could not publish event for experiment {experiment.id}: {e}")
+
+
+def _format_event(data):
+    return f'data: {json.dumps(data)}\n\n'
+
+
+async def stream_experiment_events(experiment_id):
+    """
+    Yields the events of an experiment formatted as Server-Sent Events.
+
+    The current snapshot is sent first, then every published event until the
+    experiment reaches a terminal state. After PTV_EVENTS_HEARTBEAT seconds
+    without events the snapshot is read again and sent, which keeps the
+    connection open and ends the stream even if the terminal event was never
+    published (publishing is best effort, see notify_experiment_changed).
+    """
+    from .models import Experiment
+
+    async def read_snapshot():
+        experiment = await Experiment.objects.aget(id=experiment_id)
+        return await sync_to_async(experiment_snapshot)(experiment)
+
+    client = redis.asyncio.Redis.from_url(settings.PTV_REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(experiment_channel(experiment_id))
+    try:
+        # Taken after subscribing so no event is lost in between
+        snapshot = await read_snapshot()
+        yield _format_event(snapshot)
+        if snapshot['status'] in TERMINAL_STATES:
+            return
+
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=settings.PTV_EVENTS_HEARTBEAT
+            )
+            if message is None:
+                try:
+                    event = await read_snapshot()
+                except Experiment.DoesNotExist:
+                    return
+            else:
+                event = json.loads(message['data'])
+            yield _format_event(event)
+            if event['status'] in TERMINAL_STATES:
+                return
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
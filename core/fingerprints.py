@@ -0,0 +1,136 @@
+"""
+Content fingerprints of the inputs of a run.
+
+A run is identified by the image set, the calibration file and the
+parameters that affect its output. Two experiments with the same run key
+produce the same trajectories, so the result of one can be reused for the
+other (see core.result_cache).
+"""
+from pathlib import Path
+import hashlib
+import json
+
+from . import pipeline
+from .readers import camera_folders, list_frames
+
+
+# Block size used to hash files
+HASH_BLOCK_BYTES = 1024 ** 2
+
+
+def digest(*parts):
+    """Returns the SHA-256 of a sequence of values (as strings)"""
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(str(part).encode())
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 of a file's content, or of its path if it doesn't exist
+    (so a missing file still gives a stable key).
+    """
+    path = Path(path)
+    if not path.is_file():
+        return digest('missing', str(path))
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def frames_fingerprint(paths):
+    """
+    Returns a fingerprint of a list of frame files.
+
+    Frames are not read: their names, sizes and modification times identify
+    them, so fingerprinting a long sequence only costs one stat per frame.
+    """
+    sha = hashlib.sha256()
+    for path in paths:
+        stat = path.stat()
+        sha.update(f'{path.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return sha.hexdigest()
+
+
+def image_set_fingerprint(images_path):
+    """
+    Returns a fingerprint of the frames of an image folder, or of its camera
+    subfolders (see pipeline.open_sequences), or None when it has no frames
+    or can't be read (missing, not a folder, no permission...).
+    """
+    try:
+        frames = list_frames(images_path)
+        if frames:
+            return frames_fingerprint(frames)
+        folders = camera_folders(images_path)
+        if not folders:
+            return None
+        return digest(*(
+            f'{name}:{frames_fingerprint(list_frames(folder))}' for name, folder in folders.items()
+        ))
+    except OSError:
+        return None
+
+
+def _canonical_value(value):
+    # 100 and 100.0 are the same parameter value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _canonical_value(item) for key, item in value.items()}
+    return value
+
+
+def canonical_parameters(parameters, keys=None):
+    """
+    Returns the parameters as a canonical JSON string.
+
+    Defaults are applied, parameters that only affect performance
+    (pipeline.PERFORMANCE_PARAMETERS) are left out and numbers are normalized.
+
+    Args:
+        parameters (dict): Experiment parameters
+        keys (iterable): Only include these parameters (default: all)
+    """
+    parameters = pipeline.get_parameters(parameters)
+    selected = {
+        key: _canonical_value(value)
+        for key, value in parameters.items()
+        if key not in pipeline.PERFORMANCE_PARAMETERS and (keys is None or key in keys)
+    }
+    return json.dumps(selected, sort_keys=True, separators=(',', ':'))
+
+
+def combine_run_key(images, calibration, parameters):
+    """
+    Returns the key of a run from the fingerprint of its image set and the
+    digest of its calibration file, to key many runs on the same inputs.
+    """
+    return digest(
+        f'pipeline:{pipeline.PIPELINE_VERSION}',
+        images,
+        calibration,
+        canonical_parameters(parameters)
+    )
+
+
+def run_key(images_path, calibration_file, parameters):
+    """
+    Returns the key of a run, or None if the image set can't be fingerprinted.
+
+    Args:
+        images_path (str): Folder containing one image per frame
+        calibration_file (str): Path to the .cal calibration file
+        parameters (dict): Experiment parameters
+    """
+    images = image_set_fingerprint(images_path)
+    if images is None:
+        return None
+    return combine_run_key(images, file_digest(calibration_file), parameters)
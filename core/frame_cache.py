@@ -0,0 +1,120 @@
+"""
+Shared cache of decoded frames.
+
+Compressed frames (PNG, JPEG, compressed TIFF...) are decoded again by every
+run that reads them. When several runs use the same image set, e.g. the
+experiments of a parameter sweep, the sequence is decoded once into a single
+.npy stack under PTV_DATA_DIR/frames. Runs then read that stack
+memory-mapped, so all the worker processes share its pages through the OS
+page cache instead of each decoding the frames again.
+
+Formats that are already memory-mapped (.npy, .raw, uncompressed TIFF) are
+never copied.
+"""
+from pathlib import Path
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from . import fingerprints
+
+
+# Frames decoded per batch when building a stack
+BUILD_BATCH_FRAMES = 64
+
+# {(folder, folder mtime, raw_shape, raw_dtype): stack key}, per process
+_keys = {}
+
+
+def cache_dir():
+    return Path(settings.PTV_DATA_DIR) / 'frames'
+
+
+def needs_decoding(sequence):
+    """Whether the frames of a sequence are decoded on read (not memory-mapped)"""
+    return len(sequence) > 0 and not isinstance(sequence.read(0), np.memmap)
+
+
+def stack_key(sequence):
+    """
+    Returns the key of the decoded stack of a sequence.
+
+    The frames are fingerprinted once per process until their folder is
+    modified, like the frame listing itself.
+    """
+    folder = Path(sequence.images_path).resolve()
+    memo_key = (str(folder), folder.stat().st_mtime_ns, sequence.raw_shape, sequence.raw_dtype)
+    if memo_key not in _keys:
+        _keys[memo_key] = fingerprints.digest(
+            fingerprints.frames_fingerprint(sequence.paths),
+            sequence.raw_shape,
+            sequence.raw_dtype
+        )
+    return _keys[memo_key]
+
+
+def stack_path(sequence):
+    return cache_dir() / f'{stack_key(sequence)}.npy'
+
+
+def build(sequence):
+    """
+    Decodes a whole sequence into its shared stack, unless it exists already
+    or its frames don't need decoding.
+
+    Returns:
+        Path: The stack, or None if not built (see PTV_FRAME_CACHE_MAX_GB)
+    """
+    if not needs_decoding(sequence):
+        return None
+
+    path = stack_path(sequence)
+    if path.exists():
+        return path
+
+    first = sequence.read(0)
+    if len(sequence) * first.nbytes > settings.PTV_FRAME_CACHE_MAX_GB * 1024 ** 3:
+        print(f"[FRAMES] {sequence.images_path} is too large to cache decoded")
+        return None
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        stack = np.lib.format.open_memmap(
+            temp_path, mode='w+', dtype=first.dtype, shape=(len(sequence),) + first.shape
+        )
+        for batch_start, batch in sequence.iter_batches(0, len(sequence), BUILD_BATCH_FRAMES):
+            stack[batch_start:batch_start + len(batch)] = batch
+        stack.flush()
+        del stack
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+    print(f"[FRAMES] Decoded {len(sequence)} frames of {sequence.images_path} into {path}")
+    return path
+
+
+def attach(sequence):
+    """
+    Makes a sequence read its frames from its shared stack, if one was built.
+
+    Returns:
+        bool: Whether the stack is used
+    """
+    if not needs_decoding(sequence):
+        return False
+
+    path = stack_path(sequence)
+    try:
+        sequence.decoded = np.load(path, mmap_mode='r')
+    except FileNotFoundError:
+        return False
+
+    # Used stacks are kept longest by prune_stage_cache
+    os.utime(path)
+    return True
@@ -0,0 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand
+from scipy import ndimage
+
+from core import pipeline
+
+
+def _process_chunk(args):
+    images_path, start, end, parameters = args
+    sequence = pipeline.open_sequence(images_path, parameters)
+    trajectories = pipeline.process_chunk(sequence, start, end, parameters)
+    return len(trajectories['x'])
+
+
+def write_random_frames(folder, frames, particles, size, seed=0):
+    """Writes a sequence of frames with Gaussian particles moving at random"""
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(0, size, (particles, 2))
+    velocities = rng.normal(0, 1.5, (particles, 2))
+    for frame in range(frames):
+        current = np.mod(positions + frame * velocities, size).astype(int)
+        image = np.zeros((size, size), dtype=np.float32)
+        np.add.at(image, (current[:, 1], current[:, 0]), 4000.0)
+        image = np.clip(ndimage.gaussian_filter(image, 1.2), 0, 255).astype(np.uint8)
+        cv2.imwrite(os.path.join(folder, f'frame_{frame:06d}.png'), image)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures detection + tracking throughput (frames/s) against the number "
+        "of worker processes, as used by the 'cpu' queue"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', help="Image folder to use instead of synthetic frames")
+        parser.add_argument('--frames', type=int, default=400)
+        parser.add_argument('--particles', type=int, default=2000)
+        parser.add_argument('--size', type=int, default=1024, help="Synthetic frame size (px)")
+        parser.add_argument('--chunk-size', type=int, default=25)
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as folder:
+            images_path = options['images']
+            if not images_path:
+                self.stdout.write(f"Writing {options['frames']} synthetic frames...")
+                write_random_frames(folder, options['frames'], options['particles'], options['size'])
+                images_path = folder
+
+            parameters = pipeline.get_parameters({})
+            total_frames = len(pipeline.open_sequence(images_path, parameters))
+            chunks = [
+                (images_path, start, end, parameters)
+                for start, end in pipeline.split_into_chunks(total_frames, options['chunk_size'])
+            ]
+
+            worker_counts = []
+            workers = 1
+            while workers < options['max_workers']:
+                worker_counts.append(workers)
+                workers *= 2
+            worker_counts.append(options['max_workers'])
+
+            self.stdout.write(f"{'processes':>10} {'seconds':>10} {'frames/s':>10} {'speedup':>10}")
+            baseline = None
+            for workers in worker_counts:
+                begin = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(_process_chunk, chunks))
+                elapsed = time.perf_counter() - begin
+
+                throughput = total_frames / elapsed
+                baseline = baseline or throughput
+                self.stdout.write(
+                    f"{workers:>10} {elapsed:>10.2f} {throughput:>10.1f} {throughput / baseline:>9.2f}x"
+                )
@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core import calibration, pipeline
+
+
+# Two cameras 400 units apart looking at a 100-unit cube around the origin
+CAMERAS = (
+    calibration.Camera('cam1', [-200, 0, -500], [0, -0.38, 0], 512, 512, 1800),
+    calibration.Camera('cam2', [200, 0, -500], [0, 0.38, 0], 512, 512, 1800),
+)
+VOLUME = 100.0
+
+
+def dense_link_positions(previous, current, search_radius):
+    """Frame-to-frame linking over the full distance matrix (the unindexed baseline)"""
+    distances = np.linalg.norm(previous[:, None, :] - current[None, :, :], axis=2)
+    rows, cols = np.nonzero(distances <= search_radius)
+    return pipeline.assign_pairs(rows, cols, distances[rows, cols], len(current))
+
+
+def dense_match(rays, tolerance):
+    """Stereo matching over the distances of every pair of rays (the unindexed baseline)"""
+    distances = calibration.ray_distances(CAMERAS[0].O, rays[0][None, :], CAMERAS[1].O, rays[1][:, None])
+    rows, cols = np.nonzero(distances <= tolerance)
+    return pipeline.assign_pairs(rows, cols, distances[rows, cols], len(rays[0]))
+
+
+def indexed_match(rays, tolerance):
+    matches, candidates, distances = calibration.ray_candidates(
+        CAMERAS[0].O, rays[0], CAMERAS[1].O, rays[1], tolerance
+    )
+    return pipeline.assign_pairs(candidates, matches, distances, len(rays[0]))
+
+
+def _best_time(function, repeat):
+    best, output = None, None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures stereo matching and frame-to-frame tracking time against the "
+        "number of particles per frame, with and without the spatial indexes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--particles', default='1000,2000,5000,10000,20000,50000,100000',
+            help="Comma-separated particles per frame"
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.02,
+            help=f"Matching tolerance in a {VOLUME:g}-unit cube"
+        )
+        parser.add_argument('--search-radius', type=float, default=1.0, help="Tracking search radius")
+        parser.add_argument(
+            '--dense-limit', type=int, default=2000,
+            help="Largest particle count also run without indexes (O(N^2) memory)"
+        )
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        self.stdout.write(
+            f"{'particles':>10} {'match ms':>10} {'dense ms':>10} {'link ms':>10} {'dense ms':>10} {'matched':>8}"
+        )
+
+        for particles in (int(count) for count in options['particles'].split(',')):
+            points = rng.uniform(-VOLUME / 2, VOLUME / 2, (particles, 3))
+            rays = [camera.back_project(camera.project(points)) for camera in CAMERAS]
+            rays[1] = rays[1][rng.permutation(particles)]
+            moved = (points + rng.normal(0, options['search_radius'] / 4, points.shape))[rng.permutation(particles)]
+
+            match_time, links = _best_time(lambda: indexed_match(rays, options['tolerance']), options['repeat'])
+            link_time, _ = _best_time(
+                lambda: pipeline.link_positions(points, moved, options['search_radius']), options['repeat']
+            )
+
+            dense_match_time = dense_link_time = None
+            if particles <= options['dense_limit']:
+                dense_match_time, dense_links = _best_time(
+                    lambda: dense_match(rays, options['tolerance']), options['repeat']
+                )
+                dense_link_time, _ = _best_time(
+                    lambda: dense_link_positions(points, moved, options['search_radius']), options['repeat']
+                )
+                if not np.array_equal(links, dense_links):
+                    self.stderr.write(f"Indexed and dense matches differ at {particles} particles")
+
+            def ms(seconds):
+                return f"{seconds * 1000:>10.1f}" if seconds is not None else f"{'-':>10}"
+
+            self.stdout.write(
+                f"{particles:>10} {ms(match_time)} {ms(dense_match_time)} {ms(link_time)} {ms(dense_link_time)} "
+                f"{int((links >= 0).sum()):>8}"
+            )
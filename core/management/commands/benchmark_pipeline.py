@@ -0,0 +1,225 @@
+import json
+import platform
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import scipy
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import pipeline, profiling, synthetic
+
+
+# Accuracy scores compared against a baseline (higher is better)
+ACCURACY_SCORES = ('position_recall', 'position_precision', 'link_recall', 'link_precision')
+
+
+def benchmark_dir():
+    return Path(settings.PTV_DATA_DIR) / 'benchmarks'
+
+
+def run_pipeline(images_path, calibration_file, parameters, profile):
+    """
+    Runs the processing stages of an experiment over a dataset in this
+    process, chunk by chunk as the workers do, without the stage cache,
+    the database or Celery.
+
+    Returns:
+        tuple: (stitched trajectories, number of frames)
+    """
+    sequences = pipeline.open_sequences(images_path, parameters)
+    cameras = pipeline.stereo_cameras(sequences, calibration_file)
+    total_frames = len(next(iter(sequences.values())))
+
+    chunks = []
+    for start, end in pipeline.split_into_chunks(total_frames, parameters['chunk_size']):
+        detections = {
+            name: pipeline.concatenate_detections([
+                batch for _, batch in pipeline.iter_segmentation(sequence, start, end, parameters, profile)
+            ])
+            for name, sequence in sequences.items()
+        }
+        profile.count('blobs', sum(len(camera_detections['x']) for camera_detections in detections.values()))
+
+        if cameras is None:
+            positions = detections['']
+        else:
+            with profile.stage('matching'):
+                positions = pipeline.match_detections(
+                    detections, cameras,
+                    {name: sequence.read(0).shape for name, sequence in sequences.items()},
+                    start, end,
+                    parameters['match_tolerance']
+                )
+            profile.count('matches', len(positions['x']))
+
+        with profile.stage('tracking'):
+            chunks.append((start, end, pipeline.track_detections(positions, start, end, parameters['search_radius'])))
+
+    with profile.stage('stitching'):
+        trajectories = pipeline.stitch_chunks(chunks)
+    profile.count('frames', total_frames)
+    profile.count('positions', len(trajectories['x']))
+    profile.count('trajectories', len(np.unique(trajectories['traj_id'])))
+    return trajectories, total_frames
+
+
+def compare(record, baseline, max_slowdown, max_accuracy_drop):
+    """
+    Returns the regressions of a benchmark record against a baseline record
+    of the same configuration, as messages.
+    """
+    if record['config'] != baseline['config']:
+        raise CommandError(f"Baseline {baseline['name']!r} was run with another configuration")
+
+    regressions = []
+    if record['fps'] < baseline['fps'] * (1 - max_slowdown):
+        regressions.append(f"frames/s dropped from {baseline['fps']:.2f} to {record['fps']:.2f}")
+    for score in ACCURACY_SCORES:
+        if record['accuracy'][score] < baseline['accuracy'][score] - max_accuracy_drop:
+            regressions.append(
+                f"{score} dropped from {baseline['accuracy'][score]:.4f} to {record['accuracy'][score]:.4f}"
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic particle dataset with known trajectories, runs the "
+        "processing pipeline over it and reports frames/s, peak memory and "
+        "tracking accuracy; records can be saved and compared to catch regressions"
+    )
+
+    def add_arguments(self, parser):
+        dataset = parser.add_argument_group('dataset')
+        dataset.add_argument('--particles', type=int, default=500)
+        dataset.add_argument(
+            '--density', type=float,
+            help="Seeding density in particles per pixel (overrides --particles)"
+        )
+        dataset.add_argument('--frames', type=int, default=100)
+        dataset.add_argument('--cameras', type=int, default=1)
+        dataset.add_argument('--size', default='512x512', help="Image size, WIDTHxHEIGHT")
+        dataset.add_argument(
+            '--speed', type=float, default=1.0,
+            help="Displacement per frame (px with one camera, world units otherwise)"
+        )
+        dataset.add_argument('--seed', type=int, default=0)
+        dataset.add_argument(
+            '--dataset-dir',
+            help="Dataset folder (default: one per configuration under PTV_DATA_DIR/benchmarks/datasets)"
+        )
+
+        run = parser.add_argument_group('run')
+        run.add_argument('--parameters', default='{}', help="Processing parameter overrides as JSON")
+        run.add_argument(
+            '--tolerance', type=float, default=1.0,
+            help="Largest distance between a tracked and a true position of the same particle"
+        )
+        run.add_argument('--repeat', type=int, default=1, help="Runs, the fastest is reported")
+
+        regression = parser.add_argument_group('regression')
+        regression.add_argument('--save', metavar='NAME', help="Stores the record as NAME")
+        regression.add_argument('--compare', metavar='NAME', help="Compares the record with the stored NAME")
+        regression.add_argument('--max-slowdown', type=float, default=0.1, help="Tolerated frames/s drop (fraction)")
+        regression.add_argument('--max-accuracy-drop', type=float, default=0.01, help="Tolerated score drop")
+
+    def handle(self, *args, **options):
+        try:
+            width, height = (int(value) for value in options['size'].lower().split('x'))
+            overrides = json.loads(options['parameters'])
+        except ValueError as e:
+            raise CommandError(f"Invalid --size or --parameters: {e}")
+
+        particles = options['particles']
+        if options['density'] is not None:
+            particles = max(int(round(options['density'] * width * height)), 1)
+        dataset = {
+            'particles': particles, 'frames': options['frames'], 'cameras': options['cameras'],
+            'width': width, 'height': height, 'speed': options['speed'], 'seed': options['seed'],
+        }
+        parameters = pipeline.get_parameters(dict(synthetic.PARAMETERS, **overrides))
+        baseline = self._load(options['compare']) if options['compare'] else None
+
+        # 1. Generate the dataset, or reuse the one of the same configuration
+        folder = Path(options['dataset_dir'] or benchmark_dir() / 'datasets' / '_'.join(
+            f'{key}{value}' for key, value in dataset.items()
+        ))
+        description_file = folder / synthetic.DESCRIPTION_FILE
+        description = json.loads(description_file.read_text()) if description_file.is_file() else None
+        if description is None or any(description.get(key) != value for key, value in dataset.items()):
+            self.stdout.write(f"Generating {particles} particles x {options['frames']} frames into {folder}")
+            description = synthetic.generate(folder, **dataset)
+
+        # 2. Run the pipeline
+        best = None
+        for _ in range(max(options['repeat'], 1)):
+            profile = profiling.RunProfile()
+            begin = time.perf_counter()
+            trajectories, frames = run_pipeline(
+                description['images_path'], description['calibration_file'], parameters, profile
+            )
+            elapsed = time.perf_counter() - begin
+            if best is None or elapsed < best[0]:
+                best = (elapsed, profile, trajectories)
+        elapsed, profile, trajectories = best
+
+        # 3. Score the trajectories and report
+        accuracy = synthetic.score_tracking(synthetic.load_truth(folder), trajectories, options['tolerance'])
+        profile_data = profile.as_dict()
+        record = {
+            'name': options['save'] or '',
+            'date': timezone.now().isoformat(),
+            'config': {'dataset': dataset, 'parameters': parameters, 'tolerance': options['tolerance']},
+            'seconds': round(elapsed, 4),
+            'fps': round(frames / elapsed, 3),
+            'peak_rss_bytes': profile_data.pop('peak_rss_bytes', None),
+            'profile': profile_data,
+            'accuracy': accuracy,
+            'environment': {
+                'pipeline_version': pipeline.PIPELINE_VERSION,
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'scipy': scipy.__version__,
+                'opencv': cv2.__version__,
+            },
+        }
+        self._report(record)
+
+        if options['save']:
+            path = benchmark_dir() / 'results' / f"{options['save']}.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(record, indent=2))
+            self.stdout.write(f"Saved as {path}")
+
+        if baseline is not None:
+            regressions = compare(record, baseline, options['max_slowdown'], options['max_accuracy_drop'])
+            if regressions:
+                raise CommandError(f"Regressions against {options['compare']!r}: " + '; '.join(regressions))
+            self.stdout.write(self.style.SUCCESS(
+                f"No regression against {options['compare']!r} ({baseline['fps']:.2f} frames/s)"
+            ))
+
+    def _load(self, name):
+        path = benchmark_dir() / 'results' / f'{name}.json'
+        if not path.is_file():
+            raise CommandError(f"No stored benchmark {name!r} ({path})")
+        return json.loads(path.read_text())
+
+    def _report(self, record):
+        dataset = record['config']['dataset']
+        peak = record['peak_rss_bytes']
+        self.stdout.write(
+            f"{dataset['particles']} particles, {dataset['frames']} frames, {dataset['cameras']} camera(s): "
+            f"{record['seconds']:.3f}s, {record['fps']:.2f} frames/s, "
+            f"peak RSS {f'{peak / 1024 ** 2:.0f} MB' if peak else 'unknown'}"
+        )
+        for stage in profiling.STAGES:
+            seconds = record['profile'].get(f'{stage}_seconds')
+            if seconds is not None:
+                self.stdout.write(f"  {stage:<14} {seconds:>9.3f}s")
+        for score, value in record['accuracy'].items():
+            self.stdout.write(f"  {score:<18} {value}")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Result
+
+
+class Command(BaseCommand):
+    help = "Exports the trajectory store of an experiment's result to a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('experiment_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            result = Result.objects.get(experiment_id=options['experiment_id'])
+        except Result.DoesNotExist:
+            raise CommandError(f"Experiment {options['experiment_id']} has no result")
+
+        self.stdout.write(result.export_text())
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import frame_cache, stage_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes cached stage outputs and decoded frame stacks, least recently "
+        "used first, that are older than --max-age-days or beyond --max-size-gb"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, help="Delete outputs unused for this long")
+        parser.add_argument('--max-size-gb', type=float, help="Keep the cache under this size")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        outputs = []
+        paths = list(stage_cache.cache_dir().glob('*/*/*.npz')) + list(frame_cache.cache_dir().glob('*.npy'))
+        for path in paths:
+            stat = path.stat()
+            outputs.append((stat.st_mtime, stat.st_size, path))
+        outputs.sort(reverse=True)
+
+        # Walk from the most recently used output and keep what fits
+        now = time.time()
+        max_age = options['max_age_days'] * 86400 if options['max_age_days'] is not None else None
+        max_size = options['max_size_gb'] * 1024 ** 3 if options['max_size_gb'] is not None else None
+        kept_size = 0
+        deleted, deleted_size = 0, 0
+        for mtime, size, path in outputs:
+            too_old = max_age is not None and now - mtime > max_age
+            too_big = max_size is not None and kept_size + size > max_size
+            if not (too_old or too_big):
+                kept_size += size
+                continue
+
+            deleted += 1
+            deleted_size += size
+            if not options['dry_run']:
+                path.unlink(missing_ok=True)
+
+        action = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(
+            f"{action} {deleted} of {len(outputs)} outputs ({deleted_size / 1024 ** 2:.1f} MB), "
+            f"{kept_size / 1024 ** 2:.1f} MB kept"
+        )
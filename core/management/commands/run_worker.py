@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Starts a Celery worker for a queue with the pool configured in PTV_WORKER_POOLS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('queue', help="Queue to consume (e.g. cpu, io)")
+        parser.add_argument('--concurrency', type=int, help="Overrides the configured concurrency")
+        parser.add_argument('--loglevel', default='info')
+
+    def handle(self, *args, **options):
+        queue = options['queue']
+        if queue not in settings.PTV_WORKER_POOLS:
+            raise CommandError(
+                f"Unknown queue '{queue}'. Available: {', '.join(settings.PTV_WORKER_POOLS)}"
+            )
+
+        config = settings.PTV_WORKER_POOLS[queue]
+        pool = config['pool']
+        concurrency = options['concurrency'] or config['concurrency']
+
+        # Prefork is not supported on Windows: run one solo worker per process instead
+        if pool == 'prefork' and os.name == 'nt':
+            commands = [
+                self._worker_command(queue, 'solo', 1, config, options, f'{queue}{i}@%h')
+                for i in range(1, concurrency + 1)
+            ]
+        else:
+            commands = [self._worker_command(queue, pool, concurrency, config, options, f'{queue}@%h')]
+
+        self.stdout.write(
+            f"Starting {len(commands)} worker process(es) for queue '{queue}' "
+            f"(pool={pool}, concurrency={concurrency})"
+        )
+
+        # `python -m celery` applies eventlet monkey patching before anything is imported
+        processes = [subprocess.Popen(command) for command in commands]
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.wait()
+
+    def _worker_command(self, queue, pool, concurrency, config, options, hostname):
+        return [
+            sys.executable, '-m', 'celery',
+            '-A', 'ptv_controller',
+            'worker',
+            '-Q', queue,
+            '-P', pool,
+            '-c', str(concurrency),
+            '-n', hostname,
+            '-l', options['loglevel'],
+            '--prefetch-multiplier', str(config['prefetch_multiplier']),
+        ]
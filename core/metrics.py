@@ -0,0 +1,197 @@
+"""
+Summary statistics of a result, computed in one streaming pass.
+
+storage.write_store feeds a TrajectoryMetrics with blocks of the rows it
+writes (frame-major, with their velocities), so the statistics cost no extra
+read of the trajectories and never hold more than one block of temporaries:
+
+- particles per frame and trajectory lengths, from counts per frame and per
+  trajectory ID,
+- velocity components and speed: mean and variance merged block by block
+  (Chan et al.'s parallel form of Welford's algorithm), extremes and a
+  log-spaced speed histogram,
+- spatial coverage: bounding box and position statistics per axis, and the
+  cells of a COVERAGE_CELL_SIZE grid (x, y) holding at least one particle.
+
+The scalar headlines go to Result.key_metrics, the full statistics to
+Result.statistics; the results view shows them without recomputing.
+"""
+import numpy as np
+
+
+# Edge of the grid cells counted by the spatial coverage (px or world units)
+COVERAGE_CELL_SIZE = 8.0
+
+# Speed histogram (units per frame): log-spaced bins from 10^-3 to 10^3, with
+# the speeds outside counted in the first and last bins
+SPEED_BIN_EDGES = np.concatenate([[0.0], np.logspace(-3, 3, 25)[1:-1], [np.inf]])
+
+# Trajectory length histogram (frames): 1, 2, 3-4, 5-8, ...
+LENGTH_BIN_EDGES = np.concatenate([[1, 2], 2 ** np.arange(1, 21) + 1])
+
+
+class OnlineStats:
+    """Count, mean, variance and extremes of values seen in batches"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+
+        # Merge the batch into the running moments
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def as_dict(self):
+        if not self.count:
+            return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None}
+        return {
+            'count': self.count,
+            'mean': float(self.mean),
+            'std': float(np.sqrt(self.m2 / self.count)),
+            'min': self.minimum,
+            'max': self.maximum,
+        }
+
+
+class Histogram:
+    """Counts of values in fixed bins"""
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def update(self, values):
+        bins = np.searchsorted(self.edges, values, side='right') - 1
+        bins = np.clip(bins, 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    def as_dict(self):
+        edges = [float(edge) if np.isfinite(edge) else None for edge in self.edges]
+        return {'edges': edges, 'counts': self.counts.tolist()}
+
+
+def _add_counts(counts, keys):
+    """Adds the occurrences of the integer `keys` to the growable array `counts`"""
+    keys = np.asarray(keys, dtype=np.int64)
+    if not len(keys):
+        return counts
+    block = np.bincount(keys)
+    if len(block) > len(counts):
+        counts = np.concatenate([counts, np.zeros(len(block) - len(counts), dtype=np.int64)])
+    counts[:len(block)] += block
+    return counts
+
+
+class TrajectoryMetrics:
+    """
+    Streaming statistics of trajectory rows.
+
+    Feed it blocks of rows with `update`, then read `key_metrics` and
+    `statistics`. Frames and trajectory IDs are expected to be non-negative
+    integers.
+    """
+
+    def __init__(self):
+        self.frame_counts = np.zeros(0, dtype=np.int64)
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        self.velocity = {axis: OnlineStats() for axis in ('vx', 'vy', 'vz')}
+        self.speed = OnlineStats()
+        self.speed_histogram = Histogram(SPEED_BIN_EDGES)
+        self.position = {axis: OnlineStats() for axis in ('x', 'y', 'z')}
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.first_frame = None
+
+    def update(self, columns):
+        """
+        Adds a block of rows.
+
+        Args:
+            columns (dict): traj_id, frame, x, y, z, vx, vy, vz arrays
+        """
+        if not len(columns['frame']):
+            return
+        self.frame_counts = _add_counts(self.frame_counts, columns['frame'])
+        self.length_counts = _add_counts(self.length_counts, columns['traj_id'])
+        first_frame = int(columns['frame'].min())
+        self.first_frame = first_frame if self.first_frame is None else min(self.first_frame, first_frame)
+
+        for axis, stats in self.velocity.items():
+            stats.update(columns[axis])
+        speed = np.sqrt(columns['vx'] ** 2 + columns['vy'] ** 2 + columns['vz'] ** 2)
+        self.speed.update(speed)
+        self.speed_histogram.update(speed)
+
+        for axis, stats in self.position.items():
+            stats.update(columns[axis])
+
+        # Keys of the occupied (x, y) grid cells: y in the high, x in the low 32 bits
+        cell_x = np.floor(columns['x'] / COVERAGE_CELL_SIZE).astype(np.int64)
+        cell_y = np.floor(columns['y'] / COVERAGE_CELL_SIZE).astype(np.int64)
+        self.cells = np.union1d(self.cells, (cell_y << 32) + (cell_x & 0xFFFFFFFF))
+
+    def _particles_per_frame(self):
+        counts = self.frame_counts[self.first_frame:] if self.first_frame is not None else self.frame_counts
+        stats = OnlineStats()
+        stats.update(counts)
+        return stats
+
+    def _lengths(self):
+        return self.length_counts[self.length_counts > 0]
+
+    def _coverage(self):
+        """Fraction of the grid cells of the bounding box (x, y) holding particles"""
+        if not len(self.cells):
+            return 0.0
+        x, y = self.position['x'], self.position['y']
+        columns = np.floor(x.maximum / COVERAGE_CELL_SIZE) - np.floor(x.minimum / COVERAGE_CELL_SIZE) + 1
+        rows = np.floor(y.maximum / COVERAGE_CELL_SIZE) - np.floor(y.minimum / COVERAGE_CELL_SIZE) + 1
+        return float(len(self.cells) / (columns * rows))
+
+    def key_metrics(self):
+        """Headline metrics (Result.key_metrics)"""
+        lengths = self._lengths()
+        return {
+            'total_particles': int(self.frame_counts.sum()),
+            'total_trajectories': int(len(lengths)),
+            'mean_particles_per_frame': round(self._particles_per_frame().as_dict()['mean'] or 0.0, 3),
+            'mean_trajectory_length': round(float(lengths.mean()), 3) if len(lengths) else 0.0,
+            'mean_speed': round(self.speed.as_dict()['mean'] or 0.0, 4),
+            'coverage': round(self._coverage(), 4),
+        }
+
+    def statistics(self):
+        """Full statistics (Result.statistics)"""
+        lengths = OnlineStats()
+        lengths.update(self._lengths())
+        length_histogram = Histogram(LENGTH_BIN_EDGES)
+        length_histogram.update(self._lengths())
+        return {
+            'particles_per_frame': self._particles_per_frame().as_dict(),
+            'trajectory_length': dict(lengths.as_dict(), histogram=length_histogram.as_dict()),
+            'velocity': {
+                **{axis: stats.as_dict() for axis, stats in self.velocity.items()},
+                'speed': dict(self.speed.as_dict(), histogram=self.speed_histogram.as_dict()),
+            },
+            'position': {axis: stats.as_dict() for axis, stats in self.position.items()},
+            'coverage': {
+                'cell_size': COVERAGE_CELL_SIZE,
+                'occupied_cells': int(len(self.cells)),
+                'fraction': self._coverage(),
+            },
+        }
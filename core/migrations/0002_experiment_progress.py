@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='frames_processed',
+            field=models.PositiveIntegerField(default=0, help_text='Number of frames already processed'),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='total_frames',
+            field=models.PositiveIntegerField(default=0, help_text='Number of frames in the image sequence'),
+        ),
+    ]
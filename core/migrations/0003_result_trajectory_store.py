@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_experiment_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='data_path',
+            field=models.CharField(blank=True, help_text='Path to the columnar trajectory store (directory of .npy columns)', max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='result',
+            name='txt_file_path',
+            field=models.CharField(blank=True, help_text='Path to the .txt/.csv export of the trajectory data (generated on demand)', max_length=500),
+        ),
+    ]
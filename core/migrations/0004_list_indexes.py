@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_result_trajectory_store'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='experiment',
+            options={'ordering': ['-creation_date', '-id'], 'verbose_name': 'Experiment', 'verbose_name_plural': 'Experiments'},
+        ),
+        migrations.AlterModelOptions(
+            name='project',
+            options={'ordering': ['-creation_date', '-id'], 'verbose_name': 'Project', 'verbose_name_plural': 'Projects'},
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['project', '-creation_date', '-id'], name='experiment_project_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['state'], name='experiment_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['-creation_date', '-id'], name='project_created_idx'),
+        ),
+    ]
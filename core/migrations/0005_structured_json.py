@@ -0,0 +1,91 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:39
+
+import core.models
+import json
+
+from django.db import migrations, models
+
+
+# (model, field, default) of the JSON strings converted to JSONField
+JSON_TEXT_FIELDS = [
+    ('Experiment', 'used_parameters', dict),
+    ('PresetParameters', 'parameters', dict),
+    ('Result', 'key_metrics', dict),
+    ('Result', 'additional_files', list),
+]
+
+
+def clean_json_text(apps, schema_editor):
+    """
+    Rewrites every stored string as valid JSON of the expected type, so the
+    columns can be converted. Unparseable values are replaced by the default.
+    """
+    for model_name, field, default in JSON_TEXT_FIELDS:
+        model = apps.get_model('core', model_name)
+        for pk, text in model.objects.values_list('pk', field).iterator():
+            try:
+                value = json.loads(text)
+            except (TypeError, ValueError):
+                value = None
+            if not isinstance(value, default):
+                print(f"[MIGRATION] Invalid {model_name}.{field} of {pk} replaced by {default()!r}")
+                value = default()
+
+            cleaned = json.dumps(value)
+            if cleaned != text:
+                model.objects.filter(pk=pk).update(**{field: cleaned})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clean_json_text, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='experiment',
+            name='used_parameters',
+            field=models.JSONField(blank=True, default=dict, help_text='Copy of all parameters used (for reproducibility)'),
+        ),
+        migrations.AlterField(
+            model_name='presetparameters',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, help_text='All MyPTV parameters of the preset'),
+        ),
+        migrations.AlterField(
+            model_name='result',
+            name='additional_files',
+            field=models.JSONField(blank=True, default=list, help_text='List of paths to additional generated files'),
+        ),
+        migrations.AlterField(
+            model_name='result',
+            name='key_metrics',
+            field=models.JSONField(blank=True, default=dict, help_text='Calculated metrics (e.g. total_particles, frames_processed)'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(core.models.JSONNumber('used_parameters', 'threshold'), name='exp_threshold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(core.models.JSONNumber('used_parameters', 'min_particle_size'), name='exp_min_particle_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(core.models.JSONNumber('used_parameters', 'search_radius'), name='exp_search_radius_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(core.models.JSONNumber('key_metrics', 'total_particles'), name='result_total_particles_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(core.models.JSONNumber('key_metrics', 'total_trajectories'), name='result_total_trajectories_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(core.models.JSONNumber('key_metrics', 'frames_processed'), name='result_frames_processed_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_structured_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Hash of the images, calibration and parameters of the run', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='reused_from',
+            field=models.ForeignKey(blank=True, help_text='Experiment whose result was reused instead of processing again', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reuses', to='core.experiment'),
+        ),
+    ]
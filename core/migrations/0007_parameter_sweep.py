@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:44
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_experiment_cache_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Descriptive name of the sweep', max_length=200)),
+                ('creation_date', models.DateTimeField(auto_now_add=True, help_text='Automatic creation timestamp')),
+                ('mode', models.CharField(choices=[('GRID', 'Grid'), ('RANDOM', 'Random')], default='GRID', help_text='Every combination of the values, or random samples', max_length=10)),
+                ('spec', models.JSONField(default=dict, help_text="Swept keys: a list of values, or {'min': ..., 'max': ...} in random mode")),
+                ('samples', models.PositiveIntegerField(default=0, help_text='Number of experiments drawn in random mode')),
+                ('seed', models.IntegerField(blank=True, help_text='Random seed, for reproducible random sweeps', null=True)),
+                ('images_path', models.CharField(help_text='Path where the images are stored (shared by all the experiments)', max_length=500)),
+                ('calibration_file', models.CharField(help_text='Path to the .cal calibration file', max_length=500)),
+                ('priority', models.PositiveSmallIntegerField(default=5, help_text="Celery priority of the sweep's tasks, from 0 (highest) to 9", validators=[django.core.validators.MaxValueValidator(9)])),
+                ('max_concurrent', models.PositiveIntegerField(default=2, help_text='Maximum number of experiments of the sweep processed at once (0 = no limit)')),
+                ('celery_group_id', models.CharField(blank=True, help_text='Celery group ID for monitoring', max_length=255)),
+                ('preset', models.ForeignKey(blank=True, help_text='Base parameters, overridden by the swept values', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sweeps', to='core.presetparameters')),
+                ('project', models.ForeignKey(help_text='Project the experiments of the sweep belong to', on_delete=django.db.models.deletion.CASCADE, related_name='sweeps', to='core.project')),
+            ],
+            options={
+                'verbose_name': 'Parameter Sweep',
+                'verbose_name_plural': 'Parameter Sweeps',
+                'ordering': ['-creation_date', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='sweep',
+            field=models.ForeignKey(blank=True, help_text='Parameter sweep that created this experiment', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='experiments', to='core.parametersweep'),
+        ),
+    ]
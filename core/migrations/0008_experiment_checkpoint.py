@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_parameter_sweep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='checkpoint',
+            field=models.JSONField(blank=True, default=dict, help_text="Completed chunks of the run, kept to resume it: {'run': run key, 'chunks': {'start-end': stage key}}"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_experiment_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='chunk_task_ids',
+            field=models.JSONField(blank=True, default=list, help_text='Celery task IDs of the chunks of the current run, revoked on cancellation'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_experiment_chunk_task_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='frames_at_start',
+            field=models.PositiveIntegerField(default=0, help_text='Frames already processed when the run started (resumed runs), left out of the processing rate'),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='progress_stage',
+            field=models.CharField(blank=True, help_text='Processing stage last reported by the workers', max_length=20),
+        ),
+    ]
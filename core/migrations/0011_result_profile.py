@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_experiment_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='profile',
+            field=models.JSONField(blank=True, default=dict, help_text='Processing profile: <stage>_seconds, counters (frames, blobs, ...) and peak_rss_bytes'),
+        ),
+    ]
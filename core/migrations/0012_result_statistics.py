@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_result_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='statistics',
+            field=models.JSONField(blank=True, default=dict, help_text='Summary statistics: particles per frame, trajectory lengths, velocities, coverage (see core.metrics)'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:18
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_result_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='polled_at',
+            field=models.DateTimeField(blank=True, help_text='When the queued task last asked the scheduler for a slot', null=True),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=5, help_text="Scheduling and Celery priority of the experiment's tasks, from 0 (highest) to 9", validators=[django.core.validators.MaxValueValidator(9)]),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, help_text='When the experiment was last submitted for processing', null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='max_concurrent',
+            field=models.PositiveIntegerField(default=0, help_text='Maximum number of experiments of the project processed at once (0 = no limit)'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='share',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Relative share of the processing slots when projects compete for them'),
+        ),
+    ]
@@ -1,6 +1,53 @@
+from django.core.validators import MaxValueValidator
 from django.db import models
+from django.db.models import F, FloatField, Func
 from django.utils import timezone
+from pathlib import Path
 import json
+import re
+from .storage import TrajectoryStore
+
+
+# Numeric parameters and metrics with a database index, so filtering and
+# sorting experiments by them doesn't scan every row
+INDEXED_PARAMETERS = ('threshold', 'min_particle_size', 'search_radius')
+INDEXED_METRICS = ('total_particles', 'total_trajectories', 'frames_processed')
+
+
+# Keys allowed in JSONNumber (they are written into the SQL)
+JSON_KEY_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9]*(_[A-Za-z0-9]+)*$')
+
+
+class JSONNumber(Func):
+    """
+    Numeric value of a top-level key of a JSON field, e.g.
+    JSONNumber('used_parameters', 'threshold'). Rows without the key give NULL.
+    
+    The key is written literally into the SQL (not as a query parameter), so
+    that filters with this expression are served by the functional indexes
+    built with the same expression on INDEXED_PARAMETERS and INDEXED_METRICS.
+    """
+    output_field = FloatField()
+    
+    def __init__(self, field, key):
+        if not JSON_KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid JSON key: {key!r}")
+        self.key = key
+        super().__init__(F(field))
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template=f"CAST(JSON_EXTRACT(%(expressions)s, '$.\"{self.key}\"') AS REAL)",
+            **extra_context
+        )
+    
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template=f"CAST((%(expressions)s ->> '{self.key}') AS double precision)",
+            **extra_context
+        )
 
 
 class Project(models.Model):
@@ -21,10 +68,24 @@ class Project(models.Model):
         help_text="Automatic creation timestamp"
     )
     
+    # Scheduling (see core.scheduler)
+    share = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Relative share of the processing slots when projects compete for them"
+    )
+    max_concurrent = models.PositiveIntegerField(
+        default=0,
+        help_text="Maximum number of experiments of the project processed at once (0 = no limit)"
+    )
+    
     class Meta:
         verbose_name = "Project"
         verbose_name_plural = "Projects"
-        ordering = ['-creation_date']
+        ordering = ['-creation_date', '-id']
+        indexes = [
+            # Keyset pagination of the project list
+            models.Index(fields=['-creation_date', '-id'], name='project_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -43,9 +104,10 @@ class PresetParameters(models.Model):
         blank=True,
         help_text="Description of what this preset is for"
     )
-    parameters = models.TextField(
-        default="{}",
-        help_text="JSON string containing all MyPTV parameters"
+    parameters = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="All MyPTV parameters of the preset"
     )
     creation_date = models.DateTimeField(
         auto_now_add=True,
@@ -66,11 +128,130 @@ class PresetParameters(models.Model):
     
     def get_parameters_display(self):
         """Returns formatted parameters for display"""
-        try:
-            data = json.loads(self.parameters)
-            return json.dumps(data, indent=2)
-        except json.JSONDecodeError:
-            return self.parameters
+        return json.dumps(self.parameters, indent=2)
+
+
+class ParameterSweep(models.Model):
+    """
+    A batch of experiments over a grid or random sample of parameter values.
+    """
+    
+    MODES = [
+        ('GRID', 'Grid'),
+        ('RANDOM', 'Random'),
+    ]
+    
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name='sweeps',
+        help_text="Project the experiments of the sweep belong to"
+    )
+    preset = models.ForeignKey(
+        PresetParameters,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='sweeps',
+        help_text="Base parameters, overridden by the swept values"
+    )
+    name = models.CharField(
+        max_length=200,
+        help_text="Descriptive name of the sweep"
+    )
+    creation_date = models.DateTimeField(
+        auto_now_add=True,
+        help_text="Automatic creation timestamp"
+    )
+    
+    # Sweep definition
+    mode = models.CharField(
+        max_length=10,
+        choices=MODES,
+        default='GRID',
+        help_text="Every combination of the values, or random samples"
+    )
+    spec = models.JSONField(
+        default=dict,
+        help_text="Swept keys: a list of values, or {'min': ..., 'max': ...} in random mode"
+    )
+    samples = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of experiments drawn in random mode"
+    )
+    seed = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Random seed, for reproducible random sweeps"
+    )
+    images_path = models.CharField(
+        max_length=500,
+        help_text="Path where the images are stored (shared by all the experiments)"
+    )
+    calibration_file = models.CharField(
+        max_length=500,
+        help_text="Path to the .cal calibration file"
+    )
+    
+    # Execution control
+    priority = models.PositiveSmallIntegerField(
+        default=5,
+        validators=[MaxValueValidator(9)],
+        help_text="Celery priority of the sweep's tasks, from 0 (highest) to 9"
+    )
+    max_concurrent = models.PositiveIntegerField(
+        default=2,
+        help_text="Maximum number of experiments of the sweep processed at once (0 = no limit)"
+    )
+    celery_group_id = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Celery group ID for monitoring"
+    )
+    
+    class Meta:
+        verbose_name = "Parameter Sweep"
+        verbose_name_plural = "Parameter Sweeps"
+        ordering = ['-creation_date', '-id']
+    
+    def __str__(self):
+        return self.name
+
+
+class ExperimentQuerySet(models.QuerySet):
+    """
+    Filters and comparisons of experiments by the numeric values of their
+    parameters and result metrics, evaluated in the database.
+    """
+    
+    def with_values(self, parameters=(), metrics=()):
+        """Annotates parameters as param_<key> and result metrics as metric_<key>"""
+        return self.annotate(
+            **{f'param_{key}': JSONNumber('used_parameters', key) for key in parameters},
+            **{f'metric_{key}': JSONNumber('result__key_metrics', key) for key in metrics}
+        )
+    
+    def filter_parameter(self, key, lookup, value):
+        """Filters by a parameter, e.g. filter_parameter('threshold', 'gt', 80)"""
+        return self.alias(**{f'param_{key}': JSONNumber('used_parameters', key)}).filter(
+            **{f'param_{key}__{lookup}': value}
+        )
+    
+    def filter_metric(self, key, lookup, value):
+        """Filters by a result metric, e.g. filter_metric('total_particles', 'gt', 10000)"""
+        # Filtered on the results table, where the metric indexes are
+        results = Result.objects.alias(value=JSONNumber('key_metrics', key)).filter(
+            **{f'value__{lookup}': value}
+        )
+        return self.filter(id__in=results.values('experiment_id'))
+    
+    def compare(self, parameters=(), metrics=()):
+        """Returns one row per experiment with the given parameters and metrics"""
+        return self.with_values(parameters, metrics).values(
+            'id', 'name', 'state',
+            *[f'param_{key}' for key in parameters],
+            *[f'metric_{key}' for key in metrics]
+        )
 
 
 class Experiment(models.Model):
@@ -120,9 +301,35 @@ class Experiment(models.Model):
         max_length=500,
         help_text="Path where the images are stored (RAM or SSD)"
     )
-    used_parameters = models.TextField(
-        default="{}",
-        help_text="JSON string copy of all parameters used (for reproducibility)"
+    used_parameters = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Copy of all parameters used (for reproducibility)"
+    )
+    
+    sweep = models.ForeignKey(
+        ParameterSweep,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='experiments',
+        help_text="Parameter sweep that created this experiment"
+    )
+    
+    # Result reuse (see core.result_cache)
+    cache_key = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text="Hash of the images, calibration and parameters of the run"
+    )
+    reused_from = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='reuses',
+        help_text="Experiment whose result was reused instead of processing again"
     )
     
     # Execution control
@@ -137,6 +344,50 @@ class Experiment(models.Model):
         blank=True,
         help_text="Celery task ID for monitoring"
     )
+    priority = models.PositiveSmallIntegerField(
+        default=5,
+        validators=[MaxValueValidator(9)],
+        help_text="Scheduling and Celery priority of the experiment's tasks, from 0 (highest) to 9"
+    )
+    queued_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the experiment was last submitted for processing"
+    )
+    polled_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the queued task last asked the scheduler for a slot"
+    )
+    chunk_task_ids = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Celery task IDs of the chunks of the current run, revoked on cancellation"
+    )
+    
+    # Progress (updated by the processing tasks)
+    total_frames = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of frames in the image sequence"
+    )
+    frames_processed = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of frames already processed"
+    )
+    frames_at_start = models.PositiveIntegerField(
+        default=0,
+        help_text="Frames already processed when the run started (resumed runs), left out of the processing rate"
+    )
+    progress_stage = models.CharField(
+        max_length=20,
+        blank=True,
+        help_text="Processing stage last reported by the workers"
+    )
+    checkpoint = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Completed chunks of the run, kept to resume it: {'run': run key, 'chunks': {'start-end': stage key}}"
+    )
     
     # Error information
     error_message = models.TextField(
@@ -150,10 +401,20 @@ class Experiment(models.Model):
         help_text="Researcher notes and observations"
     )
     
+    objects = ExperimentQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Experiment"
         verbose_name_plural = "Experiments"
-        ordering = ['-creation_date']
+        ordering = ['-creation_date', '-id']
+        indexes = [
+            # Keyset pagination of the experiments of a project
+            models.Index(fields=['project', '-creation_date', '-id'], name='experiment_project_created_idx'),
+            models.Index(fields=['state'], name='experiment_state_idx'),
+        ] + [
+            models.Index(JSONNumber('used_parameters', key), name=f'exp_{key}_idx')
+            for key in INDEXED_PARAMETERS
+        ]
     
     def __str__(self):
         return f"{self.project.name} - {self.name} ({self.get_state_display()})"
@@ -176,9 +437,15 @@ class Result(models.Model):
         related_name='result',
         help_text="Associated experiment"
     )
+    data_path = models.CharField(
+        max_length=500,
+        blank=True,
+        help_text="Path to the columnar trajectory store (directory of .npy columns)"
+    )
     txt_file_path = models.CharField(
         max_length=500,
-        help_text="Path to the .txt/.csv file containing trajectory data"
+        blank=True,
+        help_text="Path to the .txt/.csv export of the trajectory data (generated on demand)"
     )
     generation_date = models.DateTimeField(
         auto_now_add=True,
@@ -186,28 +453,56 @@ class Result(models.Model):
     )
     
     # Calculated metrics
-    key_metrics = models.TextField(
-        default="{}",
-        help_text="JSON string with calculated metrics (e.g. num_particles, frames_processed)"
+    key_metrics = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Calculated metrics (e.g. total_particles, frames_processed)"
+    )
+    
+    statistics = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Summary statistics: particles per frame, trajectory lengths, velocities, coverage (see core.metrics)"
+    )
+    
+    # Per-stage times, counters and peak memory of the run (see core.profiling)
+    profile = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Processing profile: <stage>_seconds, counters (frames, blobs, ...) and peak_rss_bytes"
     )
     
     # Additional files (optional)
-    additional_files = models.TextField(
-        default="[]",
-        help_text="JSON string list of paths to additional generated files"
+    additional_files = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="List of paths to additional generated files"
     )
     
     class Meta:
         verbose_name = "Result"
         verbose_name_plural = "Results"
+        indexes = [
+            models.Index(JSONNumber('key_metrics', key), name=f'result_{key}_idx')
+            for key in INDEXED_METRICS
+        ]
     
     def __str__(self):
         return f"Result of {self.experiment.name}"
     
+    def get_store(self):
+        """Returns the TrajectoryStore holding the trajectory data"""
+        return TrajectoryStore(self.data_path)
+    
+    def export_text(self):
+        """Exports the trajectories to CSV if not done yet and returns its path"""
+        if not self.txt_file_path or not Path(self.txt_file_path).exists():
+            path = Path(self.data_path).with_suffix('.csv')
+            self.get_store().export_text(path)
+            self.txt_file_path = str(path)
+            self.save(update_fields=['txt_file_path'])
+        return self.txt_file_path
+    
     def get_metrics_display(self):
         """Returns formatted metrics"""
-        try:
-            data = json.loads(self.key_metrics)
-            return json.dumps(data, indent=2)
-        except json.JSONDecodeError:
-            return self.key_metrics
+        return json.dumps(self.key_metrics, indent=2)
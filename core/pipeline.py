@@ -0,0 +1,526 @@
+"""
+MyPTV processing pipeline used by the Celery tasks.
+
+An experiment's image sequence is split into frame-range chunks that are
+processed independently (segmentation + frame-to-frame tracking) and then
+stitched back together into a single set of trajectories.
+
+Consecutive chunks overlap by one frame: the last frame of a chunk is also the
+first frame of the next one. The detections of that shared frame are used to
+join the trajectories of both chunks under the same global ID.
+
+A multi-camera experiment has one subfolder of frames per camera of its
+calibration file. Every camera is segmented on its own, and the detections of
+each frame are matched across cameras and triangulated (see core.calibration)
+before tracking, which then links 3D positions.
+
+Segmentation, matching and tracking of a chunk, and stitching, are separate
+stages whose outputs are cached by core.stage_cache.
+"""
+from pathlib import Path
+import time
+
+import numpy as np
+from django.conf import settings
+from scipy.spatial import cKDTree
+
+from . import calibration, detection
+from .readers import FrameSequence, camera_folders
+
+
+# Default values for the parameters read from Experiment.used_parameters
+DEFAULT_PARAMETERS = {
+    'threshold': 100,
+    'min_particle_size': 3,
+    'search_radius': 5.0,
+    # Maximum distance between the camera rays of one particle (world units),
+    # only used by multi-camera experiments
+    'match_tolerance': 1.0,
+    'chunk_size': 500,
+    # Frames loaded and segmented together
+    'batch_size': 32,
+    # Batches loaded ahead by the prefetch thread, and size limit of a batch
+    'prefetch_batches': 1,
+    'max_batch_mb': 512,
+    # Frames sampled to estimate the static background (0 disables subtraction)
+    'background_samples': 20,
+    # Frame size and dtype, only needed for headerless .raw frames
+    'raw_shape': None,
+    'raw_dtype': 'uint8',
+}
+
+# Parameters read by each cached stage (see core.stage_cache). A stage's
+# output only depends on these, on the output of the stage before it and on
+# PIPELINE_VERSION.
+STAGE_PARAMETERS = {
+    'segmentation': ('threshold', 'min_particle_size', 'background_samples', 'raw_shape', 'raw_dtype'),
+    'matching': ('match_tolerance',),
+    'tracking': ('search_radius',),
+    'stitching': (),
+}
+
+# Parameters that only change how fast a run goes, not its output
+PERFORMANCE_PARAMETERS = ('batch_size', 'prefetch_batches', 'max_batch_mb')
+
+# Version of the processing code, part of the run keys (see core.fingerprints).
+# Bump it when a change alters the trajectories computed from the same inputs.
+PIPELINE_VERSION = 1
+
+# Maximum distance (px or world units) between two detections of the shared frame to
+# consider them the same particle when stitching chunks
+STITCH_TOLERANCE = 0.5
+
+TRAJECTORY_COLUMNS = ('traj_id', 'frame', 'x', 'y', 'z')
+
+
+def get_parameters(used_parameters):
+    """Returns the processing parameters with defaults applied"""
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update(used_parameters or {})
+    return parameters
+
+
+def experiment_store_path(experiment_id):
+    """Path of the trajectory store (see core.storage) of an experiment"""
+    return Path(settings.PTV_DATA_DIR) / 'results' / f'exp_{experiment_id}_trajectories'
+
+
+def open_sequence(images_path, parameters):
+    """Returns the FrameSequence of an experiment's images"""
+    return FrameSequence(images_path, parameters['raw_shape'], parameters['raw_dtype'])
+
+
+def open_sequences(images_path, parameters):
+    """
+    Returns the frame sequences of an experiment as {camera: FrameSequence}.
+
+    A folder of frames is a single-camera experiment, returned as
+    {'': sequence}. A folder of camera subfolders gives one sequence per
+    subfolder, which must all have the same number of frames.
+    """
+    sequence = open_sequence(images_path, parameters)
+    if len(sequence):
+        return {'': sequence}
+
+    sequences = {
+        name: open_sequence(folder, parameters)
+        for name, folder in camera_folders(images_path).items()
+    }
+    if not sequences:
+        return {'': sequence}
+
+    lengths = {name: len(camera_sequence) for name, camera_sequence in sequences.items()}
+    if len(set(lengths.values())) > 1:
+        raise ValueError(f"Cameras have different numbers of frames: {lengths}")
+    return sequences
+
+
+def stereo_cameras(sequences, calibration_file):
+    """
+    Returns the CameraSystem of a multi-camera experiment, or None for a
+    single-camera one.
+
+    Raises:
+        ValueError: If a camera subfolder has no camera in the calibration
+    """
+    if list(sequences) == ['']:
+        return None
+
+    cameras = calibration.load_cameras(calibration_file)
+    unknown = [name for name in sequences if name not in cameras]
+    if unknown:
+        raise ValueError(
+            f"No calibration for camera folders {unknown} in {calibration_file} "
+            f"(cameras: {cameras.names})"
+        )
+    if len(sequences) < 2:
+        raise ValueError("Multi-camera experiments need at least two camera folders")
+    return cameras
+
+
+def split_into_chunks(total_frames, chunk_size):
+    """
+    Splits a sequence into half-open frame ranges overlapping by one frame.
+
+    Args:
+        total_frames (int): Number of frames of the sequence
+        chunk_size (int): Maximum number of frames per chunk
+
+    Returns:
+        list: (start, end) tuples
+    """
+    chunk_size = max(int(chunk_size), 2)
+    chunks = []
+    start = 0
+    while start < total_frames:
+        end = min(start + chunk_size, total_frames)
+        chunks.append((start, end))
+        if end == total_frames:
+            break
+        start = end - 1
+    return chunks
+
+
+def assign_pairs(rows, cols, distances, columns):
+    """
+    Pairs rows and columns greedily from the closest candidate pair, so each
+    row and column is used at most once.
+
+    The result is the same as accepting the candidates one by one in order
+    of distance, but is computed in rounds: every pair that is the closest
+    remaining one of both its row and its column is accepted at once.
+
+    Args:
+        rows, cols (ndarray): Candidate pairs
+        distances (ndarray): Distance of each pair
+        columns (int): Number of columns
+
+    Returns:
+        ndarray: For each column, the index of its row, or -1
+    """
+    links = np.full(columns, -1, dtype=np.int64)
+    if len(rows) == 0:
+        return links
+
+    # Sort by distance, ties by row then column (two stable sorts beat lexsort)
+    order = np.argsort(rows * columns + cols, kind='stable')
+    order = order[np.argsort(distances[order], kind='stable')]
+    rows, cols = rows[order], cols[order]
+    rank = np.arange(len(rows))
+
+    while len(rows):
+        best_of_row = np.full(rows.max() + 1, len(order))
+        np.minimum.at(best_of_row, rows, rank)
+        best_of_col = np.full(columns, len(order))
+        np.minimum.at(best_of_col, cols, rank)
+        accepted = (best_of_row[rows] == rank) & (best_of_col[cols] == rank)
+        links[cols[accepted]] = rows[accepted]
+
+        used_rows = np.zeros(len(best_of_row), dtype=bool)
+        used_rows[rows[accepted]] = True
+        used_cols = np.zeros(columns, dtype=bool)
+        used_cols[cols[accepted]] = True
+        remaining = ~(used_rows[rows] | used_cols[cols])
+        rows, cols, rank = rows[remaining], cols[remaining], rank[remaining]
+    return links
+
+
+def _link_trees(previous, current, search_radius):
+    """`link_positions` over the KD-trees of both frames"""
+    if previous.n == 0 or current.n == 0:
+        return np.full(current.n, -1, dtype=np.int64)
+    pairs = previous.sparse_distance_matrix(current, search_radius, output_type='ndarray')
+    return assign_pairs(pairs['i'], pairs['j'], pairs['v'], current.n)
+
+
+def link_positions(previous, current, search_radius):
+    """
+    Links the particles of two consecutive frames by nearest neighbour.
+
+    Only the pairs within `search_radius`, found with a KD-tree of each
+    frame, are considered.
+
+    Returns:
+        ndarray: For each particle of `current`, the index of the particle in
+        `previous` it continues, or -1
+    """
+    return _link_trees(cKDTree(previous), cKDTree(current), search_radius)
+
+
+def track_chunk(positions_by_frame, first_frame, search_radius):
+    """
+    Builds trajectories from per-frame detections.
+
+    Args:
+        positions_by_frame (list): (N, 2) or (N, 3) arrays, one per
+            consecutive frame
+        first_frame (int): Global frame number of the first array
+        search_radius (float): Maximum displacement between frames (px)
+
+    Returns:
+        dict: Trajectory columns (traj_id, frame, x, y, z) as arrays
+    """
+    traj_ids = []
+    next_id = 0
+    previous_ids = np.empty(0, dtype=np.int64)
+    dimensions = positions_by_frame[0].shape[1] if positions_by_frame else 2
+    previous = cKDTree(np.empty((0, dimensions)))
+
+    for positions in positions_by_frame:
+        # Each frame's tree is reused as the previous one of the next frame
+        current = cKDTree(positions)
+        links = _link_trees(previous, current, search_radius)
+        ids = np.empty(len(positions), dtype=np.int64)
+        linked = links >= 0
+        ids[linked] = previous_ids[links[linked]]
+        new_count = int((~linked).sum())
+        ids[~linked] = np.arange(next_id, next_id + new_count)
+        next_id += new_count
+
+        traj_ids.append(ids)
+        previous, previous_ids = current, ids
+
+    counts = [len(p) for p in positions_by_frame]
+    if sum(counts) == 0:
+        return empty_trajectories()
+
+    positions = np.concatenate(positions_by_frame)
+    return {
+        'traj_id': np.concatenate(traj_ids),
+        'frame': np.repeat(np.arange(first_frame, first_frame + len(counts)), counts),
+        'x': positions[:, 0],
+        'y': positions[:, 1],
+        'z': positions[:, 2] if dimensions == 3 else np.zeros(len(positions)),
+    }
+
+
+def empty_trajectories():
+    return {
+        'traj_id': np.empty(0, dtype=np.int64),
+        'frame': np.empty(0, dtype=np.int64),
+        'x': np.empty(0),
+        'y': np.empty(0),
+        'z': np.empty(0),
+    }
+
+
+def iter_segmentation(sequence, start, end, parameters, profile=None):
+    """
+    Runs segmentation over the frames [start, end), one batch at a time.
+
+    Frames are segmented in batches of `batch_size` stacked frames, loaded
+    ahead by a background thread. The time spent waiting for frames and
+    segmenting them is added to the 'read' and 'segmentation' stages of
+    `profile` (a profiling.RunProfile).
+
+    Yields:
+        tuple: (frame after the batch, detection columns (frame, x, y) of
+        the batch)
+    """
+    background = None
+    if parameters['background_samples']:
+        background = detection.estimate_background(sequence, parameters['background_samples'])
+
+    batches = iter(sequence.iter_batches(
+        start, end,
+        parameters['batch_size'],
+        prefetch=parameters['prefetch_batches'],
+        max_batch_bytes=int(parameters['max_batch_mb'] * 1024 ** 2)
+    ))
+    while True:
+        begin = time.perf_counter()
+        batch = next(batches, None)
+        if batch is None:
+            break
+        batch_start, stack = batch
+        loaded = time.perf_counter()
+
+        if background is not None:
+            detection.subtract_background(stack, background)
+
+        frame_index, xy = detection.detect_batch(
+            stack,
+            parameters['threshold'],
+            parameters['min_particle_size']
+        )
+        if profile is not None:
+            profile.add_time('read', loaded - begin)
+            profile.add_time('segmentation', time.perf_counter() - loaded)
+        yield batch_start + len(stack), {
+            'frame': (frame_index + batch_start).astype(np.int64),
+            'x': xy[:, 0],
+            'y': xy[:, 1],
+        }
+
+
+def concatenate_detections(parts):
+    """Joins detection columns (frame, x, y) of consecutive frame ranges"""
+    return {
+        'frame': np.concatenate([np.empty(0, dtype=np.int64)] + [part['frame'] for part in parts]),
+        'x': np.concatenate([np.empty(0)] + [part['x'] for part in parts]),
+        'y': np.concatenate([np.empty(0)] + [part['y'] for part in parts]),
+    }
+
+
+def segment_chunk(sequence, start, end, parameters):
+    """
+    Runs segmentation over the frames [start, end).
+
+    Returns:
+        dict: Detection columns (frame, x, y) sorted by frame
+    """
+    return concatenate_detections([
+        detections for _, detections in iter_segmentation(sequence, start, end, parameters)
+    ])
+
+
+def match_frame(cameras, rays, tolerance):
+    """
+    Matches the detections of one frame across cameras and triangulates them.
+
+    Every detection of the first camera is paired with the detection of each
+    other camera whose ray passes closest to its own, within `tolerance`.
+    Candidates are searched along the epipolar planes (see
+    calibration.ray_candidates) instead of testing every pair of rays.
+    Detections matched in at least one other camera are triangulated from
+    all their matched rays.
+
+    Args:
+        cameras (list): Camera objects
+        rays (list): (N, 3) ray directions of the detections of each camera
+        tolerance (float): Maximum distance between two rays of a particle
+
+    Returns:
+        ndarray: (K, 3) world positions
+    """
+    reference = rays[0]
+    if len(reference) == 0:
+        return np.empty((0, 3))
+
+    directions = np.zeros((len(reference), len(cameras), 3))
+    weights = np.zeros((len(reference), len(cameras)))
+    directions[:, 0] = reference
+    weights[:, 0] = 1
+    for index in range(1, len(cameras)):
+        if len(rays[index]) == 0:
+            continue
+        matches, candidates, distances = calibration.ray_candidates(
+            cameras[0].O, reference, cameras[index].O, rays[index], tolerance
+        )
+        links = assign_pairs(candidates, matches, distances, len(reference))
+        matched = links >= 0
+        directions[matched, index] = rays[index][links[matched]]
+        weights[matched, index] = 1
+
+    seen = weights.sum(axis=1) >= 2
+    if not seen.any():
+        return np.empty((0, 3))
+    origins = np.array([camera.O for camera in cameras])
+    points, _ = calibration.triangulate(origins, directions[seen], weights[seen])
+    return points
+
+
+def match_detections(detections, cameras, shapes, start, end, tolerance):
+    """
+    Runs stereo matching over the detections of the frames [start, end).
+
+    Args:
+        detections (dict): {camera name: detection columns (frame, x, y)}
+        cameras (CameraSystem): Calibration of the cameras
+        shapes (dict): {camera name: image (height, width)}
+        tolerance (float): Maximum distance between two rays of a particle
+
+    Returns:
+        dict: Detection columns (frame, x, y, z) in world coordinates
+    """
+    names = list(detections)
+    camera_models = [cameras[name] for name in names]
+
+    # Rays of every detection of the chunk at once, from the lookup grids
+    rays_by_frame = []
+    for name, camera in zip(names, camera_models):
+        columns = detections[name]
+        rays = camera.back_project(np.column_stack([columns['x'], columns['y']]), shapes[name])
+        rays_by_frame.append(detection.split_by_frame(columns['frame'] - start, rays, end - start))
+
+    frames = [np.empty(0, dtype=np.int64)]
+    positions = [np.empty((0, 3))]
+    for offset in range(end - start):
+        points = match_frame(camera_models, [rays[offset] for rays in rays_by_frame], tolerance)
+        frames.append(np.full(len(points), start + offset, dtype=np.int64))
+        positions.append(points)
+
+    positions = np.concatenate(positions)
+    return {
+        'frame': np.concatenate(frames),
+        'x': positions[:, 0],
+        'y': positions[:, 1],
+        'z': positions[:, 2],
+    }
+
+
+def track_detections(detections, start, end, search_radius):
+    """
+    Runs tracking over the detections (2D, or 3D if they have a z column) of
+    the frames [start, end).
+
+    Returns:
+        dict: Trajectory columns with chunk-local trajectory IDs
+    """
+    columns = ('x', 'y', 'z') if 'z' in detections else ('x', 'y')
+    positions_by_frame = detection.split_by_frame(
+        detections['frame'] - start,
+        np.column_stack([detections[column] for column in columns]),
+        end - start
+    )
+    return track_chunk(positions_by_frame, start, search_radius)
+
+
+def process_chunk(sequence, start, end, parameters):
+    """
+    Runs segmentation and tracking over the frames [start, end).
+
+    Returns:
+        dict: Trajectory columns with chunk-local trajectory IDs
+    """
+    detections = segment_chunk(sequence, start, end, parameters)
+    return track_detections(detections, start, end, parameters['search_radius'])
+
+
+def stitch_chunks(chunks):
+    """
+    Merges the trajectories of consecutive chunks into global trajectories.
+
+    Each chunk's first frame is the previous chunk's last frame. Detections of
+    that shared frame are paired between both chunks; a trajectory of the
+    later chunk continues the paired trajectory of the earlier one, otherwise
+    it gets a new global ID. Rows of the shared frame are kept only once.
+
+    Args:
+        chunks (list): (start, end, trajectories) tuples sorted by start
+
+    Returns:
+        dict: Trajectory columns with global, contiguous trajectory IDs
+    """
+    merged = []
+    next_id = 0
+    previous = None
+
+    for start, end, data in chunks:
+        local_ids = data['traj_id']
+        id_map = np.full(local_ids.max() + 1 if len(local_ids) else 0, -1, dtype=np.int64)
+
+        if previous is not None and previous[1] - 1 == start:
+            prev_data = previous[2]
+            prev_rows = prev_data['frame'] == start
+            cur_rows = data['frame'] == start
+            links = link_positions(
+                np.column_stack([prev_data[column][prev_rows] for column in ('x', 'y', 'z')]),
+                np.column_stack([data[column][cur_rows] for column in ('x', 'y', 'z')]),
+                STITCH_TOLERANCE
+            )
+            prev_ids = prev_data['traj_id'][prev_rows]
+            cur_ids = local_ids[cur_rows]
+            linked = links >= 0
+            id_map[cur_ids[linked]] = prev_ids[links[linked]]
+
+            # The shared frame was already stored with the previous chunk
+            keep = ~cur_rows
+            data = {column: values[keep] for column, values in data.items()}
+            local_ids = data['traj_id']
+
+        unmapped = np.unique(local_ids[id_map[local_ids] == -1])
+        id_map[unmapped] = np.arange(next_id, next_id + len(unmapped))
+        next_id += len(unmapped)
+
+        data = dict(data, traj_id=id_map[local_ids])
+        merged.append(data)
+        previous = (start, end, data)
+
+    if not merged:
+        return empty_trajectories()
+    return {
+        column: np.concatenate([data[column] for data in merged])
+        for column in TRAJECTORY_COLUMNS
+    }
+
@@ -0,0 +1,161 @@
+"""
+Per-stage profiling of processing runs.
+
+Every chunk task times its stages and counts what they produced in a
+RunProfile; the merge task adds up the profiles of the chunks and stores
+them as Result.profile, a flat dict so the metrics view can aggregate its
+keys in SQL (see models.JSONNumber):
+
+- `<stage>_seconds` for the stages in STAGES. `read` is the time spent
+  waiting for frames from the prefetch thread (image I/O and decoding not
+  hidden behind segmentation), `segmentation` the detection itself.
+- counters: frames, blobs (detections over all cameras), matches
+  (triangulated particles of multi-camera runs), positions (tracked) and
+  trajectories.
+- peak_rss_bytes: highest peak resident memory of the worker process while
+  it ran a chunk or the merge. A worker's lifetime peak would carry the
+  memory of bigger tasks it ran before, so the peak is reset when a
+  RunProfile starts (Linux, see reset_peak_rss). Elsewhere the peak is
+  only kept when it rose during the run. With several tasks per process
+  (threads or eventlet pools) the peaks of the concurrent tasks mix.
+
+With PTV_PROFILE_TASKS set, the chunk tasks also run under cProfile and the
+merged pstats file is attached to Result.additional_files (open it with
+pstats, snakeviz or similar). Sampling profilers such as py-spy need no
+setup: attach them to a worker with `py-spy record --pid <pid>`.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+import cProfile
+import pstats
+import sys
+import time
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+STAGES = ('read', 'segmentation', 'matching', 'tracking', 'stitching', 'store')
+COUNTERS = ('frames', 'blobs', 'matches', 'positions', 'trajectories')
+
+
+def peak_rss_bytes():
+    """Returns the peak resident memory of this process, None where unknown"""
+    # Linux: the high water mark, which reset_peak_rss can reset
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory of this process to its current one.
+
+    Returns:
+        bool: Whether the system allows it (Linux 4.0+)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class RunProfile:
+    """Stage times and counters of (part of) a run, and its peak memory"""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        # Without a reset, the peak of the process before the run
+        self.peak_before = None if reset_peak_rss() else peak_rss_bytes()
+
+    @contextmanager
+    def stage(self, name):
+        """Times the block as stage `name`"""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - begin
+
+    def add_time(self, name, seconds):
+        self.seconds[name] += seconds
+
+    def count(self, name, amount):
+        self.counters[name] += int(amount)
+
+    def as_dict(self):
+        """Returns the flat profile stored with the Result"""
+        data = {f'{name}_seconds': round(seconds, 6) for name, seconds in self.seconds.items()}
+        data.update(self.counters)
+        peak = peak_rss_bytes()
+        if peak is not None and (self.peak_before is None or peak > self.peak_before):
+            data['peak_rss_bytes'] = peak
+        return data
+
+
+def merge_profiles(profiles):
+    """Adds up flat profiles (RunProfile.as_dict) of several chunks"""
+    merged = {}
+    for profile in profiles:
+        for key, value in profile.items():
+            if key == 'peak_rss_bytes':
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return {key: round(value, 6) if isinstance(value, float) else value for key, value in merged.items()}
+
+
+def profile_path(experiment_id, name):
+    return Path(settings.PTV_DATA_DIR) / 'profiles' / str(experiment_id) / f'{name}.prof'
+
+
+@contextmanager
+def cprofile(experiment_id, name):
+    """
+    Runs the block under cProfile when PTV_PROFILE_TASKS is set, dumping the
+    stats to profile_path(experiment_id, name).
+
+    Yields:
+        Path or None: Where the stats are written
+    """
+    if not settings.PTV_PROFILE_TASKS:
+        yield None
+        return
+
+    path = profile_path(experiment_id, name)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+
+
+def combine_cprofiles(paths, destination):
+    """Merges the pstats files `paths` (missing ones are skipped) into `destination`"""
+    paths = [str(path) for path in paths if path and Path(path).is_file()]
+    if not paths:
+        return None
+    stats = pstats.Stats(*paths)
+    Path(destination).parent.mkdir(parents=True, exist_ok=True)
+    stats.dump_stats(str(destination))
+    return destination
@@ -0,0 +1,93 @@
+"""
+Throttled progress reporting from the processing tasks.
+
+Chunk tasks report their progress frame batch by frame batch, but writing
+every report would mean a database write and a Redis publish per batch and
+per worker. A ProgressReporter accumulates the reports in memory and writes
+them at most every PTV_PROGRESS_INTERVAL seconds: one UPDATE of the changed
+columns (frames_processed as an F() increment, so concurrent chunks add up,
+and the stage when it changed) followed by one event (see core.events).
+Between writes a report costs a clock read and an addition.
+
+The frames each chunk counted are kept in the experiment's checkpoint and
+the increments are taken from them under a row lock (see
+checkpoints.count_chunk_frames), so a chunk task delivered again after its
+worker died doesn't count its frames twice.
+
+The processing rate and ETA are derived from these columns when the status is
+read (see events.experiment_snapshot), so they are not written at all.
+"""
+import time
+
+from django.conf import settings
+
+from . import checkpoints, events
+from .models import Experiment
+
+
+class ProgressReporter:
+    """
+    Reports the progress of one chunk of an experiment.
+
+    Progress is given in units of work (e.g. frames segmented, over all the
+    cameras), scaled to the `frames` the chunk adds to the experiment, so a
+    chunk always ends up counting exactly `frames`.
+
+    Args:
+        experiment_id (int): ID of the experiment being processed
+        chunk (tuple): (start, end) frames of the chunk
+        frames (int): Frames the chunk adds to frames_processed
+        work (int): Units of work of the chunk
+        interval (float): Minimum seconds between writes (defaults to PTV_PROGRESS_INTERVAL)
+    """
+
+    def __init__(self, experiment_id, chunk, frames, work, interval=None):
+        self.experiment_id = experiment_id
+        self.chunk = chunk
+        self.frames = frames
+        self.scale = frames / work if work else 0.0
+        self.interval = settings.PTV_PROGRESS_INTERVAL if interval is None else interval
+        self.done = 0.0
+        self.written = 0
+        self.stage = None
+        self.written_stage = None
+        self.last_write = time.monotonic()
+
+    def set_stage(self, stage):
+        """Reports the stage the chunk is in"""
+        self.stage = stage
+        self._maybe_write()
+
+    def advance(self, work):
+        """Reports `work` more units of work done"""
+        self.done += work
+        self._maybe_write()
+
+    def finish(self):
+        """Counts all the frames of the chunk and writes them right away"""
+        self.done = self.frames / self.scale if self.scale else 0.0
+        self.write(frames=self.frames)
+
+    def _maybe_write(self):
+        if time.monotonic() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self, frames=None):
+        """Writes the accumulated progress, if any"""
+        self.last_write = time.monotonic()
+        if frames is None:
+            # Never the last frame before finish(), which may still fail
+            frames = min(int(self.done * self.scale), self.frames - 1)
+        changes = {}
+        if self.stage != self.written_stage:
+            changes['progress_stage'] = self.stage or ''
+        if frames <= self.written and not changes:
+            return
+
+        checkpoints.count_chunk_frames(self.experiment_id, *self.chunk, frames, **changes)
+        self.written = max(self.written, frames)
+        self.written_stage = self.stage
+
+        experiment = Experiment.objects.filter(id=self.experiment_id).only(*events.SNAPSHOT_FIELDS).first()
+        if experiment is not None:
+            events.notify_experiment_changed(experiment)
@@ -0,0 +1,260 @@
+"""
+Bounded-memory access to the image sequence of an experiment.
+
+`FrameSequence` enumerates and sorts the frames of `images_path` once per
+worker process. Uncompressed TIFF, .npy and raw frames are memory-mapped
+instead of decoded; other formats are read with OpenCV. Batches are loaded
+into contiguous stacks by a background thread that stays at most `prefetch`
+batches ahead of the consumer, so memory use is bounded by
+(prefetch + 1) batches whatever the length of the sequence.
+"""
+from pathlib import Path
+import queue
+import re
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.png', '.bmp', '.jpg', '.jpeg', '.npy', '.raw')
+
+# Upper bound for the size of one batch stack
+DEFAULT_MAX_BATCH_BYTES = 512 * 1024 ** 2
+
+# Sorted frame lists, keyed by (folder, folder mtime)
+_listing_cache = {}
+
+
+def _natural_key(path):
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r'(\d+)', path.name)]
+
+
+def list_frames(images_path):
+    """
+    Returns the image files of a sequence sorted by frame number.
+
+    The listing is cached per process until the folder is modified.
+
+    Args:
+        images_path (str): Folder containing one image per frame
+
+    Returns:
+        list: Sorted list of Path objects
+    """
+    folder = Path(images_path)
+    if not folder.is_dir():
+        raise FileNotFoundError(f"Images folder not found: {images_path}")
+
+    key = (str(folder.resolve()), folder.stat().st_mtime_ns)
+    if key not in _listing_cache:
+        frames = [
+            path for path in folder.iterdir()
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+        ]
+        _listing_cache[key] = sorted(frames, key=_natural_key)
+    return _listing_cache[key]
+
+
+def camera_folders(images_path):
+    """
+    Returns the subfolders of `images_path` that contain frames, as
+    {folder name: Path} sorted by name.
+
+    Multi-camera experiments store the frames of each camera in a subfolder
+    named after the camera.
+    """
+    folder = Path(images_path)
+    if not folder.is_dir():
+        raise FileNotFoundError(f"Images folder not found: {images_path}")
+    return {
+        path.name: path
+        for path in sorted(folder.iterdir(), key=_natural_key)
+        if path.is_dir() and list_frames(path)
+    }
+
+
+def _tiff_layout(path):
+    """
+    Returns (offset, dtype, shape) of the pixel data of a single-page,
+    uncompressed, grayscale TIFF stored contiguously, or None.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(8)
+        if header[:4] == b'II*\x00':
+            order = '<'
+        elif header[:4] == b'MM\x00*':
+            order = '>'
+        else:
+            return None
+
+        ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+        f.seek(ifd_offset)
+        entry_count = struct.unpack(order + 'H', f.read(2))[0]
+        entries = f.read(12 * entry_count)
+
+        type_formats = {3: 'H', 4: 'I'}
+        tags = {}
+        for i in range(entry_count):
+            tag, field_type, count = struct.unpack(order + 'HHI', entries[12 * i:12 * i + 8])
+            if field_type not in type_formats:
+                continue
+            fmt = order + type_formats[field_type] * count
+            size = struct.calcsize(fmt)
+            raw = entries[12 * i + 8:12 * i + 12]
+            if size > 4:
+                f.seek(struct.unpack(order + 'I', raw)[0])
+                raw = f.read(size)
+            tags[tag] = struct.unpack(fmt, raw[:size])
+
+    width, height = tags.get(256, (0,))[0], tags.get(257, (0,))[0]
+    bits = tags.get(258, (1,))[0]
+    compression = tags.get(259, (1,))[0]
+    samples = tags.get(277, (1,))[0]
+    offsets, counts = tags.get(273), tags.get(279)
+    if compression != 1 or samples != 1 or bits not in (8, 16) or not offsets or not counts:
+        return None
+    for i in range(len(offsets) - 1):
+        if offsets[i] + counts[i] != offsets[i + 1]:
+            return None
+
+    dtype = np.dtype(np.uint8) if bits == 8 else np.dtype(order + 'u2')
+    return offsets[0], dtype, (height, width)
+
+
+class FrameSequence:
+    """
+    Sorted, random-access view over the frames of an image folder.
+
+    Args:
+        images_path (str): Folder containing one image per frame
+        raw_shape (tuple): (height, width) of .raw frames
+        raw_dtype (str): Pixel dtype of .raw frames
+    """
+
+    def __init__(self, images_path, raw_shape=None, raw_dtype='uint8'):
+        self.images_path = images_path
+        self.paths = list_frames(images_path)
+        self.raw_shape = tuple(raw_shape) if raw_shape else None
+        self.raw_dtype = raw_dtype
+        self._layouts = {}
+        # (frames, height, width) stack of already decoded frames (see core.frame_cache)
+        self.decoded = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read(self, index):
+        """
+        Returns frame `index` as a 2D array.
+
+        Memory-mapped frames are returned as read-only views of the file.
+        """
+        if self.decoded is not None:
+            return self.decoded[index]
+
+        path = self.paths[index]
+        suffix = path.suffix.lower()
+
+        if suffix == '.npy':
+            return np.load(path, mmap_mode='r')
+
+        if suffix == '.raw':
+            if self.raw_shape is None:
+                raise ValueError("raw_shape is required to read .raw frames")
+            return np.memmap(path, dtype=self.raw_dtype, mode='r', shape=self.raw_shape)
+
+        if suffix in ('.tif', '.tiff'):
+            if path not in self._layouts:
+                self._layouts[path] = _tiff_layout(path)
+            layout = self._layouts[path]
+            if layout is not None:
+                offset, dtype, shape = layout
+                return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+        image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE | cv2.IMREAD_ANYDEPTH)
+        if image is None:
+            raise IOError(f"Could not read frame: {path}")
+        return image
+
+    def load(self, indices):
+        """
+        Loads frames into a single contiguous, writable stack.
+
+        Returns:
+            ndarray: (frames, height, width) array
+        """
+        indices = list(indices)
+        first = self.read(indices[0])
+        stack = np.empty((len(indices),) + first.shape, dtype=first.dtype)
+        stack[0] = first
+        for i, index in enumerate(indices[1:], start=1):
+            stack[i] = self.read(index)
+        return stack
+
+    def frame_nbytes(self):
+        return self.read(0).nbytes
+
+    def iter_batches(self, start, end, batch_size, prefetch=1, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+        """
+        Yields the frames [start, end) as consecutive stacks.
+
+        The next `prefetch` batches are loaded on a background thread while
+        the current one is processed. `batch_size` is reduced if needed so
+        that a stack never exceeds `max_batch_bytes`.
+
+        Yields:
+            tuple: (first frame index, (frames, height, width) stack)
+        """
+        if start >= end:
+            return
+
+        batch_size = max(1, min(int(batch_size), max_batch_bytes // max(self.frame_nbytes(), 1)))
+        starts = range(start, end, batch_size)
+
+        if prefetch <= 0:
+            for batch_start in starts:
+                yield batch_start, self.load(range(batch_start, min(batch_start + batch_size, end)))
+            return
+
+        batches = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def producer():
+            try:
+                for batch_start in starts:
+                    if stop.is_set():
+                        return
+                    stack = self.load(range(batch_start, min(batch_start + batch_size, end)))
+                    while not stop.is_set():
+                        try:
+                            batches.put((batch_start, stack), timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                batches.put(done)
+            except BaseException as e:
+                batches.put(e)
+
+        thread = threading.Thread(target=producer, name='frame-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
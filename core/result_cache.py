@@ -0,0 +1,80 @@
+"""
+Reuse of completed results between identical runs.
+
+Every experiment stores its run key (see core.fingerprints). When a new
+experiment has the key of a completed one whose trajectory store still
+exists, it is completed right away with a Result sharing that store instead
+of being processed again.
+"""
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import fingerprints
+from .models import Experiment, Result
+
+
+def assign_cache_key(experiment):
+    """Computes and saves the run key of an experiment ('' if unavailable)"""
+    experiment.cache_key = fingerprints.run_key(
+        experiment.images_path,
+        experiment.calibration_file,
+        experiment.used_parameters
+    ) or ''
+    experiment.save(update_fields=['cache_key'])
+    return experiment.cache_key
+
+
+def find_reusable_result(experiment):
+    """
+    Returns the most recent completed Result with the experiment's run key,
+    or None.
+    """
+    if not experiment.cache_key:
+        return None
+
+    candidates = Result.objects.filter(
+        experiment__cache_key=experiment.cache_key,
+        experiment__state='COMPLETED'
+    ).exclude(experiment=experiment).select_related('experiment').order_by('-generation_date')
+
+    for result in candidates:
+        if is_reusable(result):
+            return result
+    return None
+
+
+def is_reusable(result):
+    """Whether a result's trajectory store still exists"""
+    return bool(result.data_path) and Path(result.data_path).is_dir()
+
+
+@transaction.atomic
+def reuse_result(experiment, source):
+    """
+    Completes an experiment with a copy of another experiment's Result.
+
+    The copy shares the trajectory store (and text export) of the source.
+
+    Returns:
+        Result: The experiment's new Result
+    """
+    result = Result.objects.create(
+        experiment=experiment,
+        data_path=source.data_path,
+        txt_file_path=source.txt_file_path,
+        key_metrics=source.key_metrics,
+        statistics=source.statistics,
+        additional_files=source.additional_files
+    )
+
+    now = timezone.now()
+    experiment.reused_from = source.experiment
+    experiment.state = 'COMPLETED'
+    experiment.processing_start_time = now
+    experiment.processing_end_time = now
+    experiment.total_frames = source.experiment.total_frames
+    experiment.frames_processed = source.experiment.frames_processed
+    experiment.save()
+    return result
@@ -0,0 +1,327 @@
+"""
+Fair scheduling of experiments across projects.
+
+Experiments are sent to Celery as soon as they are submitted (see `submit`),
+but the orchestrator task only starts processing once the scheduler grants
+it a slot (see `acquire_slot`). Until then the experiment stays PENDING and
+its task asks again every PTV_SCHEDULER_RETRY_SECONDS. A slot is granted
+when:
+
+- fewer than PTV_SCHEDULER_SLOTS experiments are PROCESSING,
+- the project and the sweep of the experiment are under their
+  max_concurrent (0 = no limit),
+- and no other waiting experiment comes first in the fair order.
+
+The fair order goes by priority first (0 = highest: interactive runs get
+PRIORITY_INTERACTIVE, sweep experiments the priority of their sweep), then
+picks the project with the fewest running experiments per unit of its
+share, then the experiment queued first. A project submitting a 50-run
+sweep thus gets slots in turn with the others instead of ahead of them.
+
+Only experiments whose task asked for a slot recently count as waiting
+(polled_at), so a task lost with its worker never holds up the queue. The
+Celery priority of the tasks of an experiment, chunks included, is its
+priority, so the workers also take the chunks of interactive runs first.
+"""
+from collections import defaultdict, deque
+from datetime import timedelta
+import heapq
+import math
+
+from celery.utils import uuid
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Experiment, ParameterSweep, Project
+
+
+PRIORITY_INTERACTIVE = 2
+PRIORITY_BATCH = 5
+
+# A waiting experiment whose task hasn't asked for a slot for this many retry
+# periods is left out of the fair order
+STALE_POLLS = 3
+
+# Completed runs averaged for the wait estimates
+DURATION_SAMPLES = 50
+
+
+def submit(experiment, priority=None):
+    """
+    Queues an experiment: marks it PENDING and sends its orchestrator task,
+    which waits for a slot (see acquire_slot).
+
+    The task ID is saved before sending, so the task always finds it.
+    """
+    from .tasks import test_myptv_task
+
+    if priority is not None:
+        experiment.priority = priority
+    experiment.state = 'PENDING'
+    experiment.celery_task_id = uuid()
+    experiment.queued_at = timezone.now()
+    experiment.polled_at = None
+    experiment.save(update_fields=['state', 'celery_task_id', 'queued_at', 'polled_at', 'priority'])
+    return test_myptv_task.apply_async(
+        (experiment.id,), task_id=experiment.celery_task_id, priority=experiment.priority
+    )
+
+
+def _stale_before(now):
+    return now - timedelta(seconds=STALE_POLLS * settings.PTV_SCHEDULER_RETRY_SECONDS)
+
+
+def _load_state(now):
+    """
+    Returns the waiting experiments (dicts), the running counts per project
+    and per sweep, and the shares and limits of the projects and sweeps involved.
+    """
+    waiting = list(Experiment.objects.filter(
+        state='PENDING', polled_at__gte=_stale_before(now)
+    ).values('id', 'name', 'project_id', 'sweep_id', 'priority', 'queued_at'))
+    for row in waiting:
+        row['queued_at'] = row['queued_at'] or now
+    running = list(Experiment.objects.filter(state='PROCESSING').values('project_id', 'sweep_id').annotate(
+        count=Count('id')
+    ).order_by())
+
+    running_projects, running_sweeps = defaultdict(int), defaultdict(int)
+    for row in running:
+        running_projects[row['project_id']] += row['count']
+        if row['sweep_id']:
+            running_sweeps[row['sweep_id']] += row['count']
+
+    project_ids = {row['project_id'] for row in waiting} | set(running_projects)
+    projects = {
+        row['id']: row for row in Project.objects.filter(id__in=project_ids).values('id', 'name', 'share', 'max_concurrent')
+    }
+    sweep_ids = {row['sweep_id'] for row in waiting if row['sweep_id']}
+    sweep_limits = dict(ParameterSweep.objects.filter(id__in=sweep_ids).values_list('id', 'max_concurrent'))
+    return waiting, running_projects, running_sweeps, projects, sweep_limits
+
+
+def fair_order(waiting, running_projects, running_sweeps, projects, sweep_limits, slots):
+    """
+    Orders the waiting experiments in which they get slots.
+
+    Slots are handed out one at a time to the best head of the per-project
+    queues, counting every grant as running. Experiments blocked by the
+    limit of their project or sweep, or past the free slots, are ordered
+    as if the limits were lifted: their `granted` is False.
+
+    The heads are kept in a heap. A grant only changes the rank of the
+    head of its own project and ranks never decrease, so heads whose rank
+    went stale are pushed back when they come out, in O(N log N) overall.
+
+    Args:
+        waiting (list): Experiments as dicts with id, project_id, sweep_id, priority, queued_at
+        running_projects, running_sweeps (dict): PROCESSING experiments by project and sweep ID
+        projects (dict): Project ID -> dict with share and max_concurrent
+        sweep_limits (dict): Sweep ID -> max_concurrent
+        slots (int): Experiments allowed to process at once (0 = no limit)
+
+    Returns:
+        list: The waiting dicts in order, with `granted` set
+    """
+    queues = defaultdict(deque)
+    for experiment in sorted(waiting, key=lambda row: (row['priority'], row['queued_at'], row['id'])):
+        queues[experiment['project_id']].append(experiment)
+    # Experiments held by a limit, set aside in order: limits only fill up
+    held = defaultdict(deque)
+    running_projects = defaultdict(int, running_projects)
+    running_sweeps = defaultdict(int, running_sweeps)
+    free = slots - sum(running_projects.values()) if slots else math.inf
+    order = []
+
+    def blocked(experiment):
+        project_limit = projects[experiment['project_id']]['max_concurrent']
+        sweep_limit = sweep_limits.get(experiment['sweep_id'])
+        return bool(
+            project_limit and running_projects[experiment['project_id']] >= project_limit
+            or sweep_limit and running_sweeps[experiment['sweep_id']] >= sweep_limit
+        )
+
+    def rank(project_id, experiment):
+        share = max(projects[project_id]['share'], 1)
+        return (experiment['priority'], running_projects[project_id] / share, experiment['queued_at'])
+
+    def grantable_head(project_id):
+        """First experiment of a project not held by a limit"""
+        queue = queues[project_id]
+        while queue and blocked(queue[0]):
+            held[project_id].append(queue.popleft())
+        return queue[0] if queue else None
+
+    def take(project_id, experiment, granted):
+        nonlocal free
+        order.append(dict(experiment, granted=granted))
+        free -= 1
+        running_projects[project_id] += 1
+        if experiment['sweep_id']:
+            running_sweeps[experiment['sweep_id']] += 1
+
+    # Grantable experiments first
+    heap = []
+    for project_id in list(queues):
+        head = grantable_head(project_id)
+        if head is not None:
+            heap.append((rank(project_id, head), project_id))
+    heapq.heapify(heap)
+    while heap:
+        head_rank, project_id = heapq.heappop(heap)
+        head = grantable_head(project_id)
+        if head is None:
+            continue
+        if rank(project_id, head) != head_rank:
+            heapq.heappush(heap, (rank(project_id, head), project_id))
+            continue
+        take(project_id, queues[project_id].popleft(), free > 0)
+        head = grantable_head(project_id)
+        if head is not None:
+            heapq.heappush(heap, (rank(project_id, head), project_id))
+
+    # Only held experiments are left (the rest of each queue is held too)
+    for project_id, queue in queues.items():
+        held[project_id].extend(queue)
+    heap = [(rank(project_id, queue[0]), project_id) for project_id, queue in held.items() if queue]
+    heapq.heapify(heap)
+    while heap:
+        _, project_id = heapq.heappop(heap)
+        queue = held[project_id]
+        take(project_id, queue.popleft(), False)
+        if queue:
+            heapq.heappush(heap, (rank(project_id, queue[0]), project_id))
+    return order
+
+
+def _granted(experiment_id, now):
+    """Whether the fair order gives a slot to the experiment now"""
+    order = fair_order(*_load_state(now), settings.PTV_SCHEDULER_SLOTS)
+    return any(row['id'] == experiment_id and row['granted'] for row in order)
+
+
+def acquire_slot(experiment_id, task_id):
+    """
+    Asks for a processing slot for an experiment, marking it PROCESSING
+    when granted.
+
+    Most requests are denied, so the fair order is first computed without
+    locks. Only when it grants the slot are the projects of the running and
+    waiting experiments locked and the order checked again, so concurrent
+    requests never take the same slot. An experiment already PROCESSING
+    (its task was retried after the grant) keeps its slot; finished,
+    cancelled and missing ones get none.
+
+    Only the task the experiment was last submitted with (celery_task_id)
+    gets a slot: the task of an earlier submission, e.g. of a resume sent
+    twice, must not process the experiment a second time.
+
+    Args:
+        experiment_id (int): ID of the experiment
+        task_id (str): Celery task ID of the orchestrator task asking
+
+    Returns:
+        bool: Whether the experiment may start
+    """
+    now = timezone.now()
+    experiment = Experiment.objects.filter(id=experiment_id).values('state', 'celery_task_id').first()
+    if experiment is None or experiment['celery_task_id'] != task_id:
+        return False
+    if experiment['state'] != 'PENDING':
+        return experiment['state'] == 'PROCESSING'
+
+    Experiment.objects.filter(id=experiment_id).update(polled_at=now)
+    if not _granted(experiment_id, now):
+        return False
+
+    with transaction.atomic():
+        project_ids = set(Experiment.objects.filter(
+            state__in=('PENDING', 'PROCESSING')
+        ).values_list('project_id', flat=True).distinct())
+        list(Project.objects.select_for_update().filter(id__in=project_ids).order_by('id'))
+        if not _granted(experiment_id, now):
+            return False
+
+        # Conditional, so an experiment cancelled meanwhile stays CANCELLED
+        return bool(Experiment.objects.filter(
+            id=experiment_id, state='PENDING', celery_task_id=task_id
+        ).update(state='PROCESSING'))
+
+
+def mean_run_seconds():
+    """Mean processing time of the last completed runs, None without any"""
+    runs = Experiment.objects.filter(
+        state='COMPLETED', processing_start_time__isnull=False, processing_end_time__isnull=False
+    ).order_by('-processing_end_time').values_list('processing_start_time', 'processing_end_time')[:DURATION_SAMPLES]
+    durations = [(end - start).total_seconds() for start, end in runs]
+    return sum(durations) / len(durations) if durations else None
+
+
+def queue_snapshot():
+    """
+    Depth of the queue and estimated waits.
+
+    A waiting experiment's wait is estimated from the mean run time and its
+    rank among the waiting experiments, globally and within its project
+    when the project has a limit, taking the longer of the two.
+
+    Returns:
+        dict: slots, running, waiting, mean_run_seconds, per-project counts
+        (projects) and the waiting experiments in order (queue)
+    """
+    now = timezone.now()
+    waiting, running_projects, running_sweeps, projects, sweep_limits = _load_state(now)
+    slots = settings.PTV_SCHEDULER_SLOTS
+    order = fair_order(waiting, running_projects, running_sweeps, projects, sweep_limits, slots)
+    duration = mean_run_seconds()
+    running = sum(running_projects.values())
+
+    def wait(rank, free, concurrency):
+        if rank < free:
+            return 0.0
+        if duration is None:
+            return None
+        return (rank - free + 1) * duration / concurrency
+
+    queue = []
+    project_ranks = defaultdict(int)
+    for rank, experiment in enumerate(order):
+        project = projects[experiment['project_id']]
+        estimates = [wait(rank, slots - running if slots else math.inf, slots or 1)]
+        if project['max_concurrent']:
+            estimates.append(wait(
+                project_ranks[project['id']],
+                project['max_concurrent'] - running_projects[project['id']],
+                project['max_concurrent']
+            ))
+        project_ranks[project['id']] += 1
+        queue.append({
+            'id': experiment['id'],
+            'name': experiment['name'],
+            'project': project['name'],
+            'priority': experiment['priority'],
+            'position': rank + 1,
+            'waiting_seconds': round((now - experiment['queued_at']).total_seconds(), 1),
+            'estimated_wait_seconds': None if None in estimates else round(max(estimates), 1),
+        })
+
+    return {
+        'slots': slots,
+        'running': running,
+        'waiting': len(order),
+        'mean_run_seconds': round(duration, 1) if duration is not None else None,
+        'projects': [
+            {
+                'id': project['id'],
+                'name': project['name'],
+                'share': project['share'],
+                'max_concurrent': project['max_concurrent'],
+                'running': running_projects[project['id']],
+                'waiting': project_ranks[project['id']],
+            }
+            for project in sorted(projects.values(), key=lambda project: project['name'])
+        ],
+        'queue': queue,
+    }
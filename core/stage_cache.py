@@ -0,0 +1,132 @@
+"""
+Persistent cache of the output of every pipeline stage.
+
+A run is a chain of stages: segmentation (of every camera), matching (for
+multi-camera experiments) and tracking of every chunk, then stitching of the
+chunks. The output of a stage is stored under a key built
+from the key of its input (the frames it reads, or the output of the stage
+before it) and the parameters it uses (pipeline.STAGE_PARAMETERS). A run
+that only changes a downstream parameter finds the upstream outputs already
+computed and only runs the stages after it, e.g. a new search_radius only
+re-runs tracking and stitching.
+
+Outputs are .npz files under PTV_DATA_DIR/stages/<stage>/. They are written
+atomically, so concurrent workers computing the same output never read a
+partial file. Reading an output refreshes its modification time, so the
+`prune_stage_cache` command drops the least recently used ones first.
+"""
+from pathlib import Path
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+from django.conf import settings
+
+from . import detection, fingerprints, pipeline
+
+
+STAGES = tuple(pipeline.STAGE_PARAMETERS)
+
+
+def stage_key(stage, parameters, *inputs):
+    """Returns the key of a stage's output for the given input keys"""
+    return fingerprints.digest(
+        stage,
+        pipeline.PIPELINE_VERSION,
+        fingerprints.canonical_parameters(parameters, pipeline.STAGE_PARAMETERS[stage]),
+        *inputs
+    )
+
+
+def segmentation_key(sequence, start, end, parameters):
+    """
+    Key of the segmentation of the frames [start, end).
+
+    Besides the frames of the chunk, it covers the frames sampled to estimate
+    the background, which are spread over the whole sequence.
+    """
+    paths = sequence.paths[start:end]
+    if parameters['background_samples']:
+        indices = detection.background_indices(len(sequence), parameters['background_samples'])
+        paths = paths + [sequence.paths[index] for index in indices]
+    return stage_key(
+        'segmentation', parameters,
+        len(sequence), start, end, fingerprints.frames_fingerprint(paths)
+    )
+
+
+def matching_key(segmentation_keys, calibration_digest, parameters):
+    """Key of the matching of the segmentations of every camera of a chunk"""
+    return stage_key('matching', parameters, calibration_digest, *segmentation_keys)
+
+
+def tracking_key(positions, parameters):
+    """Key of the tracking of a segmentation (single camera) or matching output"""
+    return stage_key('tracking', parameters, positions)
+
+
+def stitching_key(tracking_keys, parameters):
+    return stage_key('stitching', parameters, *tracking_keys)
+
+
+def cache_dir():
+    return Path(settings.PTV_DATA_DIR) / 'stages'
+
+
+def output_path(stage, key):
+    return cache_dir() / stage / key[:2] / f'{key}.npz'
+
+
+def load_output(stage, key):
+    """Returns a cached output as a dict of arrays, or None"""
+    path = output_path(stage, key)
+    try:
+        with np.load(path) as data:
+            output = {name: data[name] for name in data.files}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print(f"[STAGES] Discarding unreadable {stage} output {key}: {e}")
+        path.unlink(missing_ok=True)
+        return None
+
+    os.utime(path)
+    return output
+
+
+def save_output(stage, key, output):
+    """Stores the output (dict of arrays) of a stage"""
+    path = output_path(stage, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **output)
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    return path
+
+
+def run_stage(stage, key, compute):
+    """
+    Returns the cached output of a stage, computing and storing it if needed.
+
+    Args:
+        stage (str): Stage name
+        key (str): Key of the output
+        compute (callable): Computes the output when it isn't cached
+
+    Returns:
+        tuple: (output, whether it was cached)
+    """
+    output = load_output(stage, key)
+    if output is not None:
+        return output, True
+
+    output = compute()
+    save_output(stage, key, output)
+    return output, False
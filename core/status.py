@@ -0,0 +1,123 @@
+"""
+Cached, batched experiment status lookups.
+
+The status of an experiment combines its database row, its Celery task state
+and its result. Statuses are cached for PTV_STATUS_CACHE_TTL seconds and the
+workers invalidate an experiment's entry whenever its state changes (see
+core.events.notify_experiment_changed), so the cache never hides a state
+change for long. Cache misses are resolved together: one query for the
+experiments and their results, and one MGET for all the Celery task states.
+"""
+from celery import current_app, states
+from celery.backends.base import BaseKeyValueStoreBackend
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import cache
+
+from . import events
+
+
+def status_cache_key(experiment_id):
+    return f'ptv:status:{experiment_id}'
+
+
+def invalidate_status(experiment_id):
+    cache.delete(status_cache_key(experiment_id))
+
+
+def fetch_task_states(task_ids):
+    """
+    Returns the Celery state and info of several tasks.
+
+    Key-value result backends (e.g. Redis) are read with a single MGET;
+    other backends fall back to one lookup per task.
+
+    Returns:
+        dict: {task_id: {'status': state, 'result': info}}
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return {}
+
+    backend = current_app.backend
+    if not isinstance(backend, BaseKeyValueStoreBackend):
+        return {
+            task_id: {'status': result.state, 'result': result.info}
+            for task_id, result in ((task_id, AsyncResult(task_id)) for task_id in task_ids)
+        }
+
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = backend.mget(keys)
+    if hasattr(values, 'items'):
+        # Some clients (e.g. memcached) return a mapping of the found keys
+        values = [values.get(key) for key in keys]
+    return {
+        task_id: backend.decode_result(value) if value else {'status': states.PENDING, 'result': None}
+        for task_id, value in zip(task_ids, values)
+    }
+
+
+def _build_status(experiment, task_meta):
+    """Builds the status of an experiment from its row and task state"""
+    data = events.experiment_snapshot(experiment)
+
+    # Check Celery task state if available
+    if task_meta is not None:
+        info = task_meta['result']
+        data['celery_state'] = task_meta['status']
+        data['celery_info'] = str(info) if info else None
+
+        if task_meta['status'] == 'PROGRESS' and 'progress' not in data:
+            data['progress'] = info
+
+    # Include result info if experiment is completed
+    if experiment.state == 'COMPLETED':
+        result = getattr(experiment, 'result', None)
+        data['result'] = None if result is None else {
+            'id': result.id,
+            'data_path': result.data_path,
+            'metrics': result.key_metrics
+        }
+    return data
+
+
+def get_experiment_statuses(experiment_ids):
+    """
+    Returns the statuses of several experiments.
+
+    Args:
+        experiment_ids (list): IDs of the experiments
+
+    Returns:
+        dict: {experiment_id: status}; unknown IDs are left out
+    """
+    from .models import Experiment
+
+    experiment_ids = list(dict.fromkeys(experiment_ids))
+    keys = {experiment_id: status_cache_key(experiment_id) for experiment_id in experiment_ids}
+    cached = cache.get_many(keys.values())
+    statuses = {
+        experiment_id: cached[key]
+        for experiment_id, key in keys.items() if key in cached
+    }
+
+    missing = [experiment_id for experiment_id in experiment_ids if experiment_id not in statuses]
+    if missing:
+        experiments = list(Experiment.objects.filter(id__in=missing).select_related('result'))
+        task_states = fetch_task_states(
+            experiment.celery_task_id for experiment in experiments if experiment.celery_task_id
+        )
+        fresh = {
+            experiment.id: _build_status(experiment, task_states.get(experiment.celery_task_id))
+            for experiment in experiments
+        }
+        cache.set_many(
+            {keys[experiment_id]: data for experiment_id, data in fresh.items()},
+            timeout=settings.PTV_STATUS_CACHE_TTL
+        )
+        statuses.update(fresh)
+
+    return {
+        experiment_id: statuses[experiment_id]
+        for experiment_id in experiment_ids if experiment_id in statuses
+    }
@@ -0,0 +1,302 @@
+"""
+Columnar binary storage of trajectories.
+
+A result is stored as a directory with one .npy file per column, rows sorted
+by frame, plus two index tables:
+
+- frame_offsets.npy: rows of frame f are [offsets[f - first_frame],
+  offsets[f - first_frame + 1])
+- traj_order.npy / traj_offsets.npy: row numbers sorted by trajectory and
+  frame; the rows of trajectory t are
+  traj_order[traj_offsets[t]:traj_offsets[t + 1]]
+
+Columns are opened memory-mapped, so reading one frame range or one
+trajectory only touches the pages that hold it. Text (CSV) output is an
+on-demand export of the store.
+"""
+from io import StringIO
+from pathlib import Path
+import json
+
+import numpy as np
+
+
+STORE_VERSION = 1
+
+COLUMNS = ('traj_id', 'frame', 'x', 'y', 'z', 'vx', 'vy', 'vz')
+
+COLUMN_DTYPES = {
+    'traj_id': np.int64,
+    'frame': np.int64,
+    'x': np.float64,
+    'y': np.float64,
+    'z': np.float64,
+    'vx': np.float64,
+    'vy': np.float64,
+    'vz': np.float64,
+}
+
+TEXT_FORMATS = {
+    'traj_id': '%d',
+    'frame': '%d',
+}
+
+# Rows written per block by the text export
+EXPORT_BLOCK_ROWS = 1_000_000
+
+# Rows read per block when streaming filtered rows
+STREAM_BLOCK_ROWS = 50_000
+
+# Rows fed per block to the statistics of a store being written (see core.metrics)
+METRICS_BLOCK_ROWS = 1_000_000
+
+
+def compute_velocities(traj_id, frame, positions):
+    """
+    Finite-difference velocities (units per frame) along each trajectory.
+
+    Inputs must be sorted by trajectory and frame. Central differences are
+    used inside a trajectory, one-sided differences at its ends, and zero for
+    single-point trajectories.
+
+    Args:
+        traj_id (ndarray): Trajectory of each row
+        frame (ndarray): Frame of each row
+        positions (ndarray): (N, 3) positions
+
+    Returns:
+        ndarray: (N, 3) velocities
+    """
+    count = len(traj_id)
+    velocities = np.zeros((count, 3))
+    if count < 2:
+        return velocities
+
+    same_as_next = np.zeros(count, dtype=bool)
+    same_as_next[:-1] = traj_id[1:] == traj_id[:-1]
+    same_as_previous = np.zeros(count, dtype=bool)
+    same_as_previous[1:] = same_as_next[:-1]
+
+    following = np.where(same_as_next, np.arange(count) + 1, np.arange(count))
+    preceding = np.where(same_as_previous, np.arange(count) - 1, np.arange(count))
+
+    dt = (frame[following] - frame[preceding]).astype(np.float64)
+    moving = dt > 0
+    velocities[moving] = (positions[following[moving]] - positions[preceding[moving]]) / dt[moving, None]
+    return velocities
+
+
+def write_store(path, trajectories, metrics=None):
+    """
+    Writes trajectories to a columnar store.
+
+    Args:
+        path (Path): Store directory (created if needed)
+        trajectories (dict): traj_id, frame, x, y, z arrays; trajectory IDs
+            must be contiguous from 0
+        metrics (metrics.TrajectoryMetrics): Fed the rows as they are
+            written, one block at a time
+
+    Returns:
+        Path: The store directory
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    traj_id = np.asarray(trajectories['traj_id'], dtype=np.int64)
+    frame = np.asarray(trajectories['frame'], dtype=np.int64)
+    positions = np.column_stack([trajectories['x'], trajectories['y'], trajectories['z']]).astype(np.float64)
+
+    by_trajectory = np.lexsort((frame, traj_id))
+    velocities = np.empty_like(positions)
+    velocities[by_trajectory] = compute_velocities(
+        traj_id[by_trajectory], frame[by_trajectory], positions[by_trajectory]
+    )
+
+    # Rows are stored frame-major
+    order = np.lexsort((traj_id, frame))
+    columns = {
+        'traj_id': traj_id[order],
+        'frame': frame[order],
+        'x': positions[order, 0],
+        'y': positions[order, 1],
+        'z': positions[order, 2],
+        'vx': velocities[order, 0],
+        'vy': velocities[order, 1],
+        'vz': velocities[order, 2],
+    }
+    for name in COLUMNS:
+        np.save(path / f'{name}.npy', columns[name].astype(COLUMN_DTYPES[name]))
+    if metrics is not None:
+        for start in range(0, len(order), METRICS_BLOCK_ROWS):
+            metrics.update({name: column[start:start + METRICS_BLOCK_ROWS] for name, column in columns.items()})
+
+    rows = len(order)
+    first_frame = int(columns['frame'][0]) if rows else 0
+    last_frame = int(columns['frame'][-1]) if rows else -1
+    frame_offsets = np.searchsorted(columns['frame'], np.arange(first_frame, last_frame + 2))
+    np.save(path / 'frame_offsets.npy', frame_offsets.astype(np.int64))
+
+    trajectory_count = int(traj_id.max()) + 1 if rows else 0
+    traj_order = np.lexsort((columns['frame'], columns['traj_id']))
+    traj_offsets = np.searchsorted(columns['traj_id'][traj_order], np.arange(trajectory_count + 1))
+    np.save(path / 'traj_order.npy', traj_order.astype(np.int64))
+    np.save(path / 'traj_offsets.npy', traj_offsets.astype(np.int64))
+
+    meta = {
+        'version': STORE_VERSION,
+        'columns': list(COLUMNS),
+        'rows': rows,
+        'first_frame': first_frame,
+        'last_frame': last_frame,
+        'trajectories': trajectory_count,
+    }
+    (path / 'meta.json').write_text(json.dumps(meta, indent=2))
+    return path
+
+
+class TrajectoryStore:
+    """
+    Read access to a columnar trajectory store.
+
+    Args:
+        path (str): Store directory written by `write_store`
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / 'meta.json').read_text())
+        self._arrays = {}
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(self.path / f'{name}.npy', mmap_mode='r')
+        return self._arrays[name]
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @property
+    def first_frame(self):
+        return self.meta['first_frame']
+
+    @property
+    def last_frame(self):
+        return self.meta['last_frame']
+
+    @property
+    def trajectory_count(self):
+        return self.meta['trajectories']
+
+    def column(self, name):
+        """Returns a whole column as a read-only memory-mapped array"""
+        if name not in COLUMNS:
+            raise KeyError(f"Unknown column: {name}")
+        return self._array(name)
+
+    def frame_rows(self, start, end):
+        """Returns the (first, last + 1) rows of the frames [start, end)"""
+        offsets = self._array('frame_offsets')
+        start = min(max(start, self.first_frame), self.last_frame + 1)
+        end = min(max(end, start), self.last_frame + 1)
+        return int(offsets[start - self.first_frame]), int(offsets[end - self.first_frame])
+
+    def rows(self, first, last, columns=COLUMNS):
+        """Returns the rows [first, last) as a dict of arrays"""
+        return {name: np.asarray(self.column(name)[first:last]) for name in columns}
+
+    def frame_range(self, start, end, columns=COLUMNS):
+        """Returns the rows of the frames [start, end) as a dict of arrays"""
+        return self.rows(*self.frame_rows(start, end), columns=columns)
+
+    def trajectory_rows(self, traj_id):
+        """Returns the row numbers of a trajectory, sorted by frame"""
+        if not 0 <= traj_id < self.trajectory_count:
+            return np.empty(0, dtype=np.int64)
+        offsets = self._array('traj_offsets')
+        return np.asarray(self._array('traj_order')[offsets[traj_id]:offsets[traj_id + 1]])
+
+    def trajectory(self, traj_id, columns=COLUMNS):
+        """Returns the rows of one trajectory as a dict of arrays"""
+        rows = self.trajectory_rows(traj_id)
+        return {name: self.column(name)[rows] for name in columns}
+
+    def trajectory_index(self):
+        """Returns (traj_order, traj_offsets), the per-trajectory row index"""
+        return self._array('traj_order'), self._array('traj_offsets')
+
+    def trajectory_lengths(self):
+        """Returns the number of points of every trajectory"""
+        return np.diff(self._array('traj_offsets'))
+
+    def iter_rows(self, first, last, columns=COLUMNS, min_length=None, bbox=None,
+                  limit=None, block_rows=STREAM_BLOCK_ROWS):
+        """
+        Yields the rows [first, last) that pass the filters, block by block.
+
+        Args:
+            first (int): First row to read
+            last (int): Row after the last one to read
+            columns (tuple): Columns to return
+            min_length (int): Minimum number of points of the trajectory
+            bbox (tuple): (xmin, ymin, xmax, ymax) or
+                (xmin, ymin, zmin, xmax, ymax, zmax) spatial bounds
+            limit (int): Maximum number of rows to yield
+
+        Yields:
+            tuple: (dict of column arrays, next row to read)
+        """
+        lengths = self.trajectory_lengths() if min_length else None
+        filter_columns = set(columns)
+        if bbox:
+            filter_columns |= {'x', 'y', 'z'} if len(bbox) == 6 else {'x', 'y'}
+        if min_length:
+            filter_columns.add('traj_id')
+
+        remaining = limit
+        for block_first in range(first, last, block_rows):
+            block_last = min(block_first + block_rows, last)
+            block = self.rows(block_first, block_last, columns=filter_columns)
+
+            keep = np.ones(block_last - block_first, dtype=bool)
+            if min_length:
+                keep &= lengths[block['traj_id']] >= min_length
+            if bbox:
+                axes = ('x', 'y', 'z')[:len(bbox) // 2]
+                for axis, low, high in zip(axes, bbox[:len(axes)], bbox[len(axes):]):
+                    keep &= (block[axis] >= low) & (block[axis] <= high)
+
+            selected = np.nonzero(keep)[0]
+            if remaining is not None and len(selected) >= remaining:
+                selected = selected[:remaining]
+                next_row = block_first + int(selected[-1]) + 1 if len(selected) else block_first
+                yield {name: block[name][selected] for name in columns}, next_row
+                return
+
+            if remaining is not None:
+                remaining -= len(selected)
+            yield {name: block[name][selected] for name in columns}, block_last
+
+    def iter_text(self, block_rows=EXPORT_BLOCK_ROWS):
+        """Yields the store as CSV text: the header, then `block_rows` rows at a time"""
+        formats = [TEXT_FORMATS.get(name, '%.4f') for name in COLUMNS]
+        yield ','.join(COLUMNS) + '\n'
+        for first in range(0, len(self), block_rows):
+            block = self.rows(first, min(first + block_rows, len(self)))
+            text = StringIO()
+            np.savetxt(text, np.column_stack([block[name] for name in COLUMNS]), delimiter=',', fmt=formats)
+            yield text.getvalue()
+
+    def export_text(self, path, block_rows=EXPORT_BLOCK_ROWS):
+        """
+        Writes the store as a CSV file, block by block.
+
+        Returns:
+            Path: The written file
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', newline='') as f:
+            for text in self.iter_text(block_rows):
+                f.write(text)
+        return path
@@ -0,0 +1,182 @@
+"""
+Parameter sweeps: batches of experiments over a grid or random sample of
+parameter values, on top of a PresetParameters base.
+
+All the experiments of a sweep are created in one transaction and submitted
+as a single Celery group, after a task that decodes the shared image set
+once (see core.frame_cache). The experiments take the sweep's priority, and
+the scheduler processes at most `max_concurrent` of them at once (see
+core.scheduler). Experiments identical to an already completed run reuse its
+result and are not submitted.
+"""
+import itertools
+import random
+
+from celery import chain, group
+from celery.utils import uuid
+from django.db import transaction
+from django.utils import timezone
+
+from . import fingerprints, pipeline, result_cache
+from .models import Experiment, ParameterSweep, Result
+
+
+# Largest number of experiments of one sweep
+MAX_SWEEP_EXPERIMENTS = 500
+
+
+def expand_grid(spec):
+    """
+    Returns every combination of the swept values.
+
+    Args:
+        spec (dict): {key: [values]}
+
+    Returns:
+        list: One {key: value} dict per combination
+    """
+    for key, values in spec.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Grid values of '{key}' must be a non-empty list")
+
+    count = 1
+    for values in spec.values():
+        count *= len(values)
+    if count > MAX_SWEEP_EXPERIMENTS:
+        raise ValueError(f"The grid has {count} combinations, the maximum is {MAX_SWEEP_EXPERIMENTS}")
+
+    keys = list(spec)
+    return [dict(zip(keys, combination)) for combination in itertools.product(*spec.values())]
+
+
+def sample_random(spec, samples, seed=None):
+    """
+    Returns random combinations of the swept values.
+
+    Args:
+        spec (dict): {key: [choices]} or {key: {'min': low, 'max': high}};
+            ranges of integers give integers
+        samples (int): Number of combinations
+        seed (int): Random seed
+
+    Returns:
+        list: One {key: value} dict per sample
+    """
+    if not 0 < samples <= MAX_SWEEP_EXPERIMENTS:
+        raise ValueError(f"samples must be between 1 and {MAX_SWEEP_EXPERIMENTS}")
+
+    rng = random.Random(seed)
+    draws = {}
+    for key, values in spec.items():
+        if isinstance(values, list) and values:
+            draws[key] = lambda values=values: rng.choice(values)
+        elif isinstance(values, dict) and {'min', 'max'} <= set(values):
+            low, high = values['min'], values['max']
+            if low > high:
+                raise ValueError(f"Range of '{key}' has min > max")
+            if isinstance(low, int) and isinstance(high, int):
+                draws[key] = lambda low=low, high=high: rng.randint(low, high)
+            else:
+                draws[key] = lambda low=low, high=high: rng.uniform(low, high)
+        else:
+            raise ValueError(f"Random values of '{key}' must be a list or {{'min': ..., 'max': ...}}")
+
+    return [{key: draw() for key, draw in draws.items()} for _ in range(samples)]
+
+
+def expand_sweep(sweep):
+    """Returns the swept values of every experiment of a sweep"""
+    if not isinstance(sweep.spec, dict) or not sweep.spec:
+        raise ValueError("The sweep needs at least one swept parameter")
+    if sweep.mode == 'RANDOM':
+        return sample_random(sweep.spec, sweep.samples, sweep.seed)
+    return expand_grid(sweep.spec)
+
+
+def _experiment_name(sweep, values):
+    return f"{sweep.name} [{', '.join(f'{key}={value}' for key, value in values.items())}]"[:200]
+
+
+@transaction.atomic
+def create_sweep(sweep):
+    """
+    Saves a sweep and bulk-creates its experiments in one transaction.
+
+    Experiments whose run key matches a completed result reuse it right away.
+
+    Args:
+        sweep (ParameterSweep): Unsaved sweep
+
+    Returns:
+        list: The experiments that need processing
+    """
+    combinations = expand_sweep(sweep)
+    sweep.save()
+
+    base = sweep.preset.parameters if sweep.preset else {}
+    images = fingerprints.image_set_fingerprint(sweep.images_path)
+    calibration = fingerprints.file_digest(sweep.calibration_file)
+
+    experiments = []
+    for values in combinations:
+        parameters = pipeline.get_parameters(dict(base, **values))
+        experiments.append(Experiment(
+            project=sweep.project,
+            sweep=sweep,
+            name=_experiment_name(sweep, values),
+            calibration_file=sweep.calibration_file,
+            images_path=sweep.images_path,
+            used_parameters=parameters,
+            priority=sweep.priority,
+            cache_key=fingerprints.combine_run_key(images, calibration, parameters) if images else ''
+        ))
+    experiments = Experiment.objects.bulk_create(experiments)
+
+    # One query for the results of all the identical runs
+    reusable = {}
+    candidates = Result.objects.filter(
+        experiment__cache_key__in={experiment.cache_key for experiment in experiments if experiment.cache_key},
+        experiment__state='COMPLETED'
+    ).select_related('experiment').order_by('generation_date')
+    for result in candidates:
+        if result_cache.is_reusable(result):
+            reusable[result.experiment.cache_key] = result
+
+    pending = []
+    for experiment in experiments:
+        source = reusable.get(experiment.cache_key)
+        if source is None:
+            pending.append(experiment)
+        else:
+            result_cache.reuse_result(experiment, source)
+    return pending
+
+
+def submit_sweep(sweep, experiments):
+    """
+    Submits the experiments of a sweep as one Celery group, after decoding
+    the shared image set.
+    """
+    if not experiments:
+        return None
+
+    from .tasks import prepare_frames_task, test_myptv_task
+
+    # Task IDs are known up front so the experiments can be monitored at once
+    queued_at = timezone.now()
+    for experiment in experiments:
+        experiment.celery_task_id = uuid()
+        experiment.queued_at = queued_at
+    Experiment.objects.bulk_update(experiments, ['celery_task_id', 'queued_at'])
+
+    workflow = chain(
+        prepare_frames_task.si(sweep.id).set(priority=sweep.priority),
+        group(
+            test_myptv_task.si(experiment.id).set(task_id=experiment.celery_task_id, priority=experiment.priority)
+            for experiment in experiments
+        )
+    )
+    result = workflow.apply_async()
+    ParameterSweep.objects.filter(id=sweep.id).update(celery_group_id=result.id)
+    print(f"[DJANGO] Sweep {sweep.id} submitted: {len(experiments)} experiments")
+    return result
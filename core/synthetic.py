@@ -0,0 +1,236 @@
+"""
+Synthetic PTV datasets with known ground truth, for benchmarks and tests.
+
+Particles move through a volume with a constant velocity plus a small random
+walk, bouncing off its walls so their number stays constant, and are rendered
+as Gaussian blobs:
+
+- With one camera the volume is the image itself: particles move in pixel
+  coordinates and the frames are written straight into the dataset folder.
+- With several cameras particles move in a cube of VOLUME world units seen
+  by cameras spread on an arc (see make_cameras). Every camera gets a
+  subfolder of frames and the matching .cal file is written next to them.
+
+The ground truth (traj_id, frame, x, y, z) is saved as ground_truth.npz and
+score_tracking compares a run's trajectories against it.
+"""
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import calibration, pipeline
+
+
+# Edge of the cube of world units the particles of multi-camera datasets move in
+VOLUME = 100.0
+# Distance of the cameras to the center of the volume, and largest yaw of the outer ones
+CAMERA_DISTANCE = 540.0
+MAX_YAW = 0.38
+
+# Blobs: standard deviation (px) and peak intensity
+BLOB_SIGMA = 1.2
+BLOB_INTENSITY = 250
+BLOB_RADIUS = 4
+
+# Parameters that segment the rendered blobs
+PARAMETERS = {'threshold': 60, 'min_particle_size': 3, 'background_samples': 0}
+
+TRUTH_FILE = 'ground_truth.npz'
+CALIBRATION_FILE = 'cameras.cal'
+DESCRIPTION_FILE = 'dataset.json'
+
+
+def make_cameras(count, width, height):
+    """
+    Returns `count` cameras at CAMERA_DISTANCE from the center of the volume,
+    spread over yaws from -MAX_YAW to MAX_YAW and looking at the center, with
+    a focal length that fits the volume into width x height images.
+    """
+    focal = 0.8 * min(width, height) * (CAMERA_DISTANCE - VOLUME) / VOLUME
+    cameras = []
+    for index, yaw in enumerate(np.linspace(-MAX_YAW, MAX_YAW, count)):
+        origin = [CAMERA_DISTANCE * np.sin(yaw), 0.0, -CAMERA_DISTANCE * np.cos(yaw)]
+        cameras.append(calibration.Camera(f'cam{index + 1}', origin, [0.0, yaw, 0.0], width / 2, height / 2, focal))
+    return cameras
+
+
+def simulate(particles, frames, low, high, speed, seed):
+    """
+    Returns the positions of `particles` moving between the bounds `low` and
+    `high` (one per dimension) over `frames` frames, as a
+    (frames, particles, dimensions) array.
+
+    Every particle moves `speed` units per frame in a random direction, which
+    drifts by a tenth of that every frame.
+    """
+    rng = np.random.default_rng(seed)
+    low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+    dimensions = len(low)
+
+    def directions(count):
+        vectors = rng.normal(size=(count, dimensions))
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    positions = np.empty((frames, particles, dimensions))
+    position = rng.uniform(low, high, (particles, dimensions))
+    velocity = directions(particles) * speed
+    for frame in range(frames):
+        positions[frame] = position
+        velocity += directions(particles) * speed / 10
+        velocity *= speed / np.linalg.norm(velocity, axis=1, keepdims=True)
+        position = position + velocity
+
+        # Bounce off the walls
+        below, above = position < low, position > high
+        position = np.where(below, 2 * low - position, np.where(above, 2 * high - position, position))
+        velocity = np.where(below | above, -velocity, velocity)
+    return positions
+
+
+def render(points, width, height):
+    """Renders 2D points (px) as Gaussian blobs into a uint8 image"""
+    image = np.zeros(height * width)
+    offsets = np.arange(-BLOB_RADIUS, BLOB_RADIUS + 1)
+    dy, dx = (grid.ravel() for grid in np.meshgrid(offsets, offsets, indexing='ij'))
+
+    x = np.floor(points[:, 0]).astype(np.int64)[:, None] + dx
+    y = np.floor(points[:, 1]).astype(np.int64)[:, None] + dy
+    values = BLOB_INTENSITY * np.exp(
+        -((x - points[:, 0:1]) ** 2 + (y - points[:, 1:2]) ** 2) / (2 * BLOB_SIGMA ** 2)
+    )
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    np.add.at(image, y[inside] * width + x[inside], values[inside])
+    return np.clip(image, 0, 255).astype(np.uint8).reshape(height, width)
+
+
+def generate(folder, particles, frames, cameras=1, width=256, height=256, speed=1.0, seed=0):
+    """
+    Writes a synthetic dataset into `folder`.
+
+    Args:
+        folder (str or Path): Dataset folder (created)
+        particles (int): Number of particles
+        frames (int): Number of frames
+        cameras (int): Number of cameras
+        width, height (int): Image size (px)
+        speed (float): Displacement per frame (px with one camera, world units otherwise)
+        seed (int): Seed of the random generator
+
+    Returns:
+        dict: Description of the dataset: images_path, calibration_file
+        (empty with one camera) and the arguments
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    description = {
+        'particles': particles, 'frames': frames, 'cameras': cameras,
+        'width': width, 'height': height, 'speed': speed, 'seed': seed,
+        'images_path': str(folder), 'calibration_file': '',
+    }
+
+    if cameras == 1:
+        # Away from the borders, so every blob is fully visible
+        margin = BLOB_RADIUS
+        positions = simulate(particles, frames, [margin, margin], [width - margin, height - margin], speed, seed)
+        for frame in range(frames):
+            cv2.imwrite(str(folder / f'frame_{frame:05d}.png'), render(positions[frame], width, height))
+        positions = np.concatenate([positions, np.zeros((frames, particles, 1))], axis=2)
+    else:
+        system = make_cameras(cameras, width, height)
+        positions = simulate(particles, frames, [-VOLUME / 2] * 3, [VOLUME / 2] * 3, speed, seed)
+        for camera in system:
+            camera_folder = folder / camera.name
+            camera_folder.mkdir(exist_ok=True)
+            for frame in range(frames):
+                image = render(camera.project(positions[frame]), width, height)
+                cv2.imwrite(str(camera_folder / f'frame_{frame:05d}.png'), image)
+        calibration_file = folder / CALIBRATION_FILE
+        calibration_file.write_text(calibration.dumps(system))
+        description['calibration_file'] = str(calibration_file)
+
+    np.savez(
+        folder / TRUTH_FILE,
+        traj_id=np.tile(np.arange(particles), frames),
+        frame=np.repeat(np.arange(frames), particles),
+        x=positions[:, :, 0].ravel(),
+        y=positions[:, :, 1].ravel(),
+        z=positions[:, :, 2].ravel(),
+    )
+    (folder / DESCRIPTION_FILE).write_text(json.dumps(description, indent=2))
+    return description
+
+
+def load_truth(folder):
+    with np.load(Path(folder) / TRUTH_FILE) as truth:
+        return {column: truth[column] for column in pipeline.TRAJECTORY_COLUMNS}
+
+
+def _match_positions(truth, trajectories, tolerance):
+    """
+    Pairs the tracked positions of every frame with the closest true ones
+    within `tolerance`. Returns, per tracked row, the true traj_id (-1 if
+    unmatched) and the distance.
+    """
+    true_ids = np.full(len(trajectories['x']), -1, dtype=np.int64)
+    errors = np.full(len(trajectories['x']), np.nan)
+    for frame in np.unique(trajectories['frame']):
+        tracked = np.flatnonzero(trajectories['frame'] == frame)
+        expected = np.flatnonzero(truth['frame'] == frame)
+        if not len(expected):
+            continue
+        tracked_points = np.column_stack([trajectories[axis][tracked] for axis in 'xyz'])
+        true_points = np.column_stack([truth[axis][expected] for axis in 'xyz'])
+        pairs = cKDTree(true_points).sparse_distance_matrix(
+            cKDTree(tracked_points), tolerance, output_type='ndarray'
+        )
+        links = pipeline.assign_pairs(pairs['i'], pairs['j'], pairs['v'], len(tracked))
+        matched = links >= 0
+        true_ids[tracked[matched]] = truth['traj_id'][expected[links[matched]]]
+        errors[tracked[matched]] = np.linalg.norm(
+            tracked_points[matched] - true_points[links[matched]], axis=1
+        )
+    return true_ids, errors
+
+
+def _frame_links(trajectories):
+    """Returns the (row, next row) pairs of consecutive frames of the same trajectory"""
+    order = np.lexsort((trajectories['frame'], trajectories['traj_id']))
+    traj_id, frame = trajectories['traj_id'][order], trajectories['frame'][order]
+    consecutive = (traj_id[1:] == traj_id[:-1]) & (frame[1:] == frame[:-1] + 1)
+    return order[:-1][consecutive], order[1:][consecutive]
+
+
+def score_tracking(truth, trajectories, tolerance):
+    """
+    Scores tracked trajectories against the ground truth.
+
+    Args:
+        truth (dict): Ground truth columns (see load_truth)
+        trajectories (dict): Tracked trajectory columns
+        tolerance (float): Largest distance between a tracked and a true position of the same particle
+
+    Returns:
+        dict: position_recall/precision (positions found), link_recall/
+        precision (frame-to-frame links between the right particles) and
+        rms_error of the found positions
+    """
+    true_ids, errors = _match_positions(truth, trajectories, tolerance)
+    found = true_ids >= 0
+
+    first, second = _frame_links(trajectories)
+    correct = found[first] & (true_ids[first] == true_ids[second])
+    true_links = len(truth['frame']) - len(np.unique(truth['traj_id']))
+
+    def ratio(count, total):
+        return round(float(count) / total, 4) if total else 0.0
+
+    return {
+        'position_recall': ratio(found.sum(), len(truth['x'])),
+        'position_precision': ratio(found.sum(), len(trajectories['x'])),
+        'link_recall': ratio(correct.sum(), true_links),
+        'link_precision': ratio(correct.sum(), len(first)),
+        'rms_error': round(float(np.sqrt(np.mean(errors[found] ** 2))), 4) if found.any() else None,
+    }
@@ -1,97 +1,452 @@
-from celery import shared_task
+from celery import shared_task, chord
+from celery.exceptions import Ignore
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-import time
-from .models import Experiment, Result
+from .cancellation import ExperimentCancelled
+from .models import Experiment, ParameterSweep, Result
+from . import (
+    cancellation, checkpoints, events, frame_cache, metrics, pipeline, profiling, progress, result_cache, scheduler,
+    stage_cache, storage, visualization
+)
 
 
 @shared_task(bind=True, name='core.test_myptv_task')
 def test_myptv_task(self, experiment_id):
     """
-    Test task that simulates MyPTV processing.
-    
+    Entry point of MyPTV processing for an experiment.
+
+    Splits the image sequence into frame-range chunks and replaces itself
+    with a chord: every chunk is processed by `process_chunk_task` in
+    parallel and `merge_chunks_task` stitches the outputs into one Result.
+    The Celery task ID of this task resolves to the merge result.
+
+    Chunks completed by an earlier, interrupted run of the experiment (see
+    core.checkpoints) are not processed again, so this task also resumes
+    experiments.
+
     Args:
         experiment_id (int): ID of the experiment to process
-        
+
     Returns:
         dict: Status message and result metadata
     """
     print(f"[CELERY] Starting task for Experiment ID: {experiment_id}")
     print(f"[CELERY] Celery Task ID: {self.request.id}")
-    
+
+    # Cancelled while waiting in the queue (before taking a slot, which marks it PROCESSING)
+    try:
+        cancellation.check_abort(experiment_id)
+    except ExperimentCancelled as e:
+        return _cancelled(e)
+
+    # Wait for the scheduler to grant a processing slot
+    if not scheduler.acquire_slot(experiment_id, self.request.id):
+        # Finished, deleted or submitted again with another task since it was queued: nothing to wait for
+        experiment = Experiment.objects.filter(id=experiment_id).values('state', 'celery_task_id').first()
+        state = experiment['state'] if experiment else None
+        if state not in ('PENDING', 'PROCESSING'):
+            message = f"Experiment {experiment_id} is {state or 'missing'}, not processing it"
+            print(f"[CELERY] {message}")
+            return {'status': state or 'ERROR', 'message': message}
+        if experiment['celery_task_id'] != self.request.id:
+            message = f"Experiment {experiment_id} was submitted again, task {self.request.id} is stale"
+            print(f"[CELERY] {message}")
+            return {'status': state, 'message': message}
+        print(f"[CELERY] No processing slot for experiment {experiment_id} yet, retrying later")
+        raise self.retry(countdown=settings.PTV_SCHEDULER_RETRY_SECONDS, max_retries=None)
+
     try:
         # 1. Retrieve experiment from database
         experiment = Experiment.objects.get(id=experiment_id)
         print(f"[CELERY] Experiment found: {experiment.name}")
-        
-        # 2. Update state and register start time
+
+        # Key the run so identical experiments can reuse its result, and
+        # interrupted runs resume from their checkpoint
+        result_cache.assign_cache_key(experiment)
+        checkpoint = checkpoints.start_run(experiment)
+
+        # 2. Enumerate frames, check the calibration of multi-camera runs and split into chunks
+        parameters = pipeline.get_parameters(experiment.used_parameters)
+        sequences = pipeline.open_sequences(experiment.images_path, parameters)
+        pipeline.stereo_cameras(sequences, experiment.calibration_file)
+        total_frames = len(next(iter(sequences.values())))
+        if not total_frames:
+            raise ValueError(f"No images found in {experiment.images_path}")
+        chunks = pipeline.split_into_chunks(total_frames, parameters['chunk_size'])
+        completed = checkpoints.completed_chunks(checkpoint, chunks)
+        pending = [chunk for chunk in chunks if chunk not in completed]
+
+        # 3. Update state and register start time
         experiment.state = 'PROCESSING'
         experiment.processing_start_time = timezone.now()
-        experiment.save()
-        print(f"[CELERY] Status updated to PROCESSING")
-        
-        # 3. SIMULATED MyPTV processing
-        total_steps = 10
-        for step in range(1, total_steps + 1):
-            time.sleep(1.5)  # Simulate heavy computation
-            
-            # Update progress (optional)
-            progress = (step / total_steps) * 100
-            print(f"[CELERY] Progress: {progress:.0f}%")
-            
-            # Update state for Celery monitoring
-            self.update_state(
-                state='PROGRESS',
-                meta={
-                    'current': step,
-                    'total': total_steps,
-                    'status': f'Processing frame {step}/{total_steps}'
-                }
-            )
-        
-        print(f"[CELERY] Simulation completed successfully")
-        
-        # 4. Create simulated result
-        result = Result.objects.create(
-            experiment=experiment,
-            result_file_path=f"C:/ptv_platform/experiment_data/exp_{experiment_id}_results.csv",
-            key_metrics={
-                'total_particles': 10500,
-                'frames_processed': 100,
-                'duration_seconds': 15.0
-            }
+        experiment.total_frames = total_frames
+        experiment.frames_processed = checkpoints.reset_progress(checkpoint, completed, _chunk_new_frames)
+        experiment.frames_at_start = experiment.frames_processed
+        experiment.progress_stage = ''
+        experiment.error_message = ''
+        # Conditional, so a cancellation during the setup isn't overwritten
+        updated = Experiment.objects.filter(id=experiment_id, state__in=('PENDING', 'PROCESSING')).update(
+            state=experiment.state,
+            processing_start_time=experiment.processing_start_time,
+            total_frames=experiment.total_frames,
+            frames_processed=experiment.frames_processed,
+            frames_at_start=experiment.frames_at_start,
+            progress_stage=experiment.progress_stage,
+            error_message=experiment.error_message,
+            checkpoint=checkpoint
         )
-        print(f"[CELERY] Result created: {result.result_file_path}")
-        
-        # 5. Mark experiment as COMPLETED
-        experiment.state = 'COMPLETED'
-        experiment.processing_end_time = timezone.now()
-        experiment.save()
-        print(f"[CELERY] Experiment completed successfully")
-        
-        return {
-            'status': 'COMPLETED',
-            'experiment_id': experiment_id,
-            'result_id': result.id,
-            'message': 'MyPTV test processing completed successfully'
-        }
-        
+        if not updated:
+            raise ExperimentCancelled(f"Experiment {experiment_id} was cancelled")
+        events.notify_experiment_changed(experiment)
+        print(f"[CELERY] {total_frames} frames of {len(sequences)} camera(s) split into {len(chunks)} chunks")
+        if completed:
+            print(f"[CELERY] Resuming: {len(completed)} chunks already completed, {len(pending)} to process")
+
     except Experiment.DoesNotExist:
         error_msg = f"Experiment with ID {experiment_id} does not exist"
         print(f"[CELERY ERROR] {error_msg}")
         return {'status': 'ERROR', 'message': error_msg}
-    
+
+    except ExperimentCancelled as e:
+        return _cancelled(e)
+
     except Exception as e:
-        error_msg = f"Error during processing: {str(e)}"
-        print(f"[CELERY ERROR] {error_msg}")
-        
-        # Update experiment with error state
-        try:
-            experiment = Experiment.objects.get(id=experiment_id)
-            experiment.state = 'ERROR'
-            experiment.error_message = error_msg
-            experiment.processing_end_time = timezone.now()
-            experiment.save()
-        except:
-            pass
-        
-        return {'status': 'ERROR', 'message': error_msg}
+        return _mark_experiment_error(experiment_id, e)
+
+    # 4. Fan out the pending chunks and merge them with the completed ones
+    # once all are done, with the priority of the experiment
+    options = {'priority': experiment.priority}
+    completed_outputs = [{'start': start, 'end': end, 'key': key} for (start, end), key in completed.items()]
+    header = [process_chunk_task.s(experiment_id, start, end).set(**options) for start, end in pending]
+
+    # The chunk task IDs are fixed now so a cancellation can revoke them
+    # (the merge takes over the ID of this task)
+    experiment.chunk_task_ids = [signature.freeze().id for signature in header]
+    experiment.save(update_fields=['chunk_task_ids'])
+
+    # Last check before the chunks are sent: a cancellation from here on revokes them
+    try:
+        cancellation.check_abort(experiment_id)
+    except ExperimentCancelled as e:
+        return _cancelled(e)
+
+    if not pending:
+        return self.replace(merge_chunks_task.si(completed_outputs, experiment_id).set(**options))
+    workflow = chord(header, merge_chunks_task.s(experiment_id, completed=completed_outputs).set(**options))
+    return self.replace(workflow)
+
+
+@shared_task(bind=True, name='core.prepare_frames_task')
+def prepare_frames_task(self, sweep_id):
+    """
+    Decodes the image set of a sweep once into the shared frame cache, so its
+    experiments don't each decode the frames again.
+
+    Args:
+        sweep_id (int): ID of the sweep
+
+    Returns:
+        list: Paths of the decoded stacks, one per camera that needs them
+    """
+    sweep = ParameterSweep.objects.get(id=sweep_id)
+    try:
+        sequences = pipeline.open_sequences(sweep.images_path, pipeline.get_parameters(
+            sweep.preset.parameters if sweep.preset else {}
+        ))
+        paths = [frame_cache.build(sequence) for sequence in sequences.values()]
+    except Exception as e:
+        # Experiments still run (and report the error) without the cache
+        print(f"[CELERY ERROR] Could not decode frames of sweep {sweep_id}: {e}")
+        return []
+    return [str(path) for path in paths if path]
+
+
+# A chunk is only acknowledged once done, so the chunk of a worker that dies
+# is delivered again instead of being lost
+@shared_task(bind=True, name='core.process_chunk_task', acks_late=True, reject_on_worker_lost=True)
+def process_chunk_task(self, experiment_id, start, end):
+    """
+    Runs segmentation, matching (multi-camera experiments) and tracking over
+    the frames [start, end) of an experiment.
+
+    Args:
+        experiment_id (int): ID of the experiment being processed
+        start (int): First frame of the chunk
+        end (int): Frame after the last frame of the chunk
+
+    Returns:
+        dict: Frame range, stage cache key of the chunk trajectories and
+        profile of the chunk (see core.profiling)
+    """
+    try:
+        cancellation.check_abort(experiment_id)
+        experiment = Experiment.objects.get(id=experiment_id)
+        parameters = pipeline.get_parameters(experiment.used_parameters)
+        sequences = pipeline.open_sequences(experiment.images_path, parameters)
+        for sequence in sequences.values():
+            frame_cache.attach(sequence)
+        cameras = pipeline.stereo_cameras(sequences, experiment.calibration_file)
+
+        # Segmentation, the bulk of the work, reports every batch of every camera
+        reporter = progress.ProgressReporter(experiment_id, (start, end), _chunk_new_frames(start, end), (end - start) * len(sequences))
+        profile = profiling.RunProfile()
+        profile.count('frames', _chunk_new_frames(start, end))
+        with profiling.cprofile(experiment_id, f'chunk_{start}_{end}') as cprofile_path:
+            trajectories, tracking, reused = _run_chunk_stages(
+                sequences, cameras, start, end, parameters,
+                aborted=lambda: cancellation.is_aborted(experiment_id),
+                reporter=reporter,
+                profile=profile
+            )
+        checkpoints.record_chunk(experiment_id, start, end, tracking)
+        reporter.finish()
+        print(
+            f"[CELERY] Chunk {start}-{end} done: {len(trajectories['x'])} positions"
+            f" (reused: {', '.join(reused) or 'none'})"
+        )
+
+        return {
+            'start': start,
+            'end': end,
+            'key': tracking,
+            'profile': profile.as_dict(),
+            'cprofile': str(cprofile_path) if cprofile_path else None,
+        }
+
+    except ExperimentCancelled as e:
+        # Ignored rather than failed: the chord never runs the merge and no error is recorded
+        _cancelled(e)
+        raise Ignore()
+
+    except Exception as e:
+        _mark_experiment_error(experiment_id, e)
+        raise
+
+
+@shared_task(bind=True, name='core.merge_chunks_task', acks_late=True, reject_on_worker_lost=True)
+def merge_chunks_task(self, chunk_outputs, experiment_id, completed=()):
+    """
+    Stitches the chunk outputs of an experiment and stores the Result.
+
+    Args:
+        chunk_outputs (list): Return values of `process_chunk_task`
+        experiment_id (int): ID of the experiment being processed
+        completed (list): Outputs of the chunks completed by an earlier run
+
+    Returns:
+        dict: Status message and result metadata
+    """
+    try:
+        cancellation.check_abort(experiment_id)
+        experiment = Experiment.objects.get(id=experiment_id)
+        # Delivered again after completing (the merge is acknowledged late)
+        result = Result.objects.filter(experiment=experiment).first()
+        if experiment.state == 'COMPLETED' and result is not None:
+            print(f"[CELERY] Experiment {experiment_id} already completed")
+            return _completed(experiment_id, result)
+
+        experiment.progress_stage = 'stitching'
+        experiment.save(update_fields=['progress_stage'])
+        events.notify_experiment_changed(experiment)
+
+        parameters = pipeline.get_parameters(experiment.used_parameters)
+
+        chunk_outputs = sorted(list(chunk_outputs) + list(completed), key=lambda chunk: chunk['start'])
+        profile = profiling.RunProfile()
+        with profiling.cprofile(experiment_id, 'merge') as cprofile_path:
+            with profile.stage('stitching'):
+                trajectories, cached = stage_cache.run_stage(
+                    'stitching',
+                    stage_cache.stitching_key([chunk['key'] for chunk in chunk_outputs], parameters),
+                    lambda: pipeline.stitch_chunks([
+                        (chunk['start'], chunk['end'], _load_chunk_trajectories(chunk))
+                        for chunk in chunk_outputs
+                    ])
+                )
+            with profile.stage('store'):
+                # Statistics are computed from the rows as they are written
+                statistics = metrics.TrajectoryMetrics()
+                store_path = storage.write_store(
+                    pipeline.experiment_store_path(experiment_id), trajectories, metrics=statistics
+                )
+                visualization.build_levels(storage.TrajectoryStore(store_path))
+        key_metrics = dict(statistics.key_metrics(), frames_processed=experiment.total_frames)
+        profile.count('trajectories', key_metrics['total_trajectories'])
+
+        # Chunks completed by an earlier run have no profile
+        additional_files = []
+        cprofile_path = profiling.combine_cprofiles(
+            [chunk.get('cprofile') for chunk in chunk_outputs] + [cprofile_path],
+            profiling.profile_path(experiment_id, 'run')
+        )
+        if cprofile_path:
+            additional_files.append(str(cprofile_path))
+
+        experiment.state = 'COMPLETED'
+        experiment.processing_end_time = timezone.now()
+        with transaction.atomic():
+            # Replaces the Result of an earlier, interrupted delivery of the merge
+            result, _ = Result.objects.update_or_create(experiment=experiment, defaults={
+                'data_path': str(store_path),
+                'key_metrics': key_metrics,
+                'statistics': statistics.statistics(),
+                'profile': profiling.merge_profiles(
+                    [chunk.get('profile', {}) for chunk in chunk_outputs] + [profile.as_dict()]
+                ),
+                'additional_files': additional_files,
+            })
+
+            # Mark experiment as COMPLETED, unless it was cancelled during the merge
+            updated = Experiment.objects.filter(id=experiment_id, state='PROCESSING').update(
+                state=experiment.state,
+                processing_end_time=experiment.processing_end_time
+            )
+            if not updated:
+                raise ExperimentCancelled(f"Experiment {experiment_id} was cancelled during the merge")
+        print(f"[CELERY] Result stored: {result.data_path}")
+        events.notify_experiment_changed(experiment)
+        print(f"[CELERY] Experiment completed successfully")
+
+        return _completed(experiment_id, result)
+
+    except ExperimentCancelled as e:
+        return _cancelled(e)
+
+    except Exception as e:
+        return _mark_experiment_error(experiment_id, e)
+
+
+def _chunk_new_frames(start, end):
+    """Frames of a chunk not counted with the previous chunk"""
+    # The first frame of every chunk but the first is shared with the previous one
+    return end - start - (1 if start > 0 else 0)
+
+
+def _run_chunk_stages(sequences, cameras, start, end, parameters, aborted=None, reporter=None, profile=None):
+    """
+    Runs the stages of a chunk, reusing the outputs of earlier runs with the
+    same inputs.
+
+    `aborted` is checked between segmentation batches and between stages,
+    raising ExperimentCancelled once it returns True. The stages and
+    segmented frames are reported to `reporter` (a progress.ProgressReporter),
+    their times and outputs counted in `profile` (a profiling.RunProfile).
+
+    Returns:
+        tuple: (trajectories, tracking stage key, names of the reused stages)
+    """
+    segmentation = {
+        name: stage_cache.segmentation_key(sequence, start, end, parameters)
+        for name, sequence in sequences.items()
+    }
+    if cameras is None:
+        positions = segmentation['']
+    else:
+        positions = stage_cache.matching_key(segmentation.values(), cameras.digest, parameters)
+    tracking = stage_cache.tracking_key(positions, parameters)
+
+    if profile is None:
+        profile = profiling.RunProfile()
+
+    trajectories = stage_cache.load_output('tracking', tracking)
+    if trajectories is not None:
+        profile.count('positions', len(trajectories['x']))
+        stages = ['segmentation', 'tracking'] if cameras is None else ['segmentation', 'matching', 'tracking']
+        return trajectories, tracking, stages
+
+    reused = []
+    aborted = aborted or (lambda: False)
+    set_stage = reporter.set_stage if reporter is not None else (lambda stage: None)
+    advance = reporter.advance if reporter is not None else None
+
+    def check_abort(stage):
+        if aborted():
+            raise ExperimentCancelled(f"Chunk {start}-{end} stopped before {stage}")
+        set_stage(stage)
+
+    def segment(name):
+        set_stage('segmentation')
+        detections, cached = stage_cache.run_stage(
+            'segmentation', segmentation[name],
+            lambda: checkpoints.segment_chunk(
+                sequences[name], start, end, parameters, segmentation[name], aborted, advance, profile
+            )
+        )
+        profile.count('blobs', len(detections['x']))
+        if cached and 'segmentation' not in reused:
+            reused.append('segmentation')
+        return detections
+
+    def match():
+        camera_detections = {name: segment(name) for name in sequences}
+        check_abort('matching')
+        with profile.stage('matching'):
+            return pipeline.match_detections(
+                camera_detections,
+                cameras,
+                {name: sequence.read(0).shape for name, sequence in sequences.items()},
+                start, end,
+                parameters['match_tolerance']
+            )
+
+    if cameras is None:
+        detections = segment('')
+    else:
+        detections, cached = stage_cache.run_stage('matching', positions, match)
+        profile.count('matches', len(detections['x']))
+        if cached:
+            reused += ['segmentation', 'matching']
+
+    check_abort('tracking')
+    with profile.stage('tracking'):
+        trajectories = pipeline.track_detections(detections, start, end, parameters['search_radius'])
+    profile.count('positions', len(trajectories['x']))
+    stage_cache.save_output('tracking', tracking, trajectories)
+    return trajectories, tracking, reused
+
+
+def _load_chunk_trajectories(chunk):
+    trajectories = stage_cache.load_output('tracking', chunk['key'])
+    if trajectories is None:
+        raise FileNotFoundError(f"Tracking output of chunk {chunk['start']}-{chunk['end']} is missing")
+    return trajectories
+
+
+def _completed(experiment_id, result):
+    """Returns the task payload of a completed experiment"""
+    return {
+        'status': 'COMPLETED',
+        'experiment_id': experiment_id,
+        'result_id': result.id,
+        'message': 'MyPTV processing completed successfully'
+    }
+
+
+def _cancelled(exception):
+    """Returns the task payload of a cancelled experiment"""
+    print(f"[CELERY] {exception}")
+    return {'status': 'CANCELLED', 'message': str(exception)}
+
+
+def _mark_experiment_error(experiment_id, exception):
+    """Stores the error on the experiment and returns the task error payload"""
+    error_msg = f"Error during processing: {str(exception)}"
+    print(f"[CELERY ERROR] {error_msg}")
+
+    # Update experiment with error state
+    try:
+        experiment = Experiment.objects.get(id=experiment_id)
+        if experiment.state == 'CANCELLED':
+            # Errors of tasks stopping after a cancellation are not the experiment's
+            return {'status': 'CANCELLED', 'message': error_msg}
+        experiment.state = 'ERROR'
+        experiment.error_message = error_msg
+        experiment.processing_end_time = timezone.now()
+        # Chunks still running may be recording their checkpoint
+        experiment.save(update_fields=['state', 'error_message', 'processing_end_time'])
+        events.notify_experiment_changed(experiment)
+    except Exception:
+        pass
+
+    return {'status': 'ERROR', 'message': error_msg}
@@ -1,3 +1,1878 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
 
-# Create your tests here.
+from celery import current_app
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import cv2
+import numpy as np
+from scipy import ndimage
+
+from . import (
+    calibration, cancellation, checkpoints, detection, downloads, events, fingerprints, frame_cache, metrics,
+    pipeline, profiling, progress, scheduler, stage_cache, status, storage, sweeps, synthetic, tasks, visualization
+)
+from .management.commands import benchmark_pipeline
+from .models import Project, PresetParameters, ParameterSweep, Experiment, Result
+from .readers import FrameSequence
+from .views import EXPERIMENTS_PER_PAGE, MAX_BULK_STATUS, PROJECTS_PER_PAGE
+
+
+def create_experiments(project, count, state='COMPLETED'):
+    experiments = Experiment.objects.bulk_create([
+        Experiment(
+            project=project,
+            name=f'Experiment {project.experiments.count() + i}',
+            calibration_file='camera.cal',
+            images_path='/tmp/images',
+            state=state
+        )
+        for i in range(count)
+    ])
+    Result.objects.bulk_create([Result(experiment=experiment) for experiment in experiments])
+    return experiments
+
+
+class QueryCountTests(TestCase):
+    """
+    The list pages must run a fixed number of queries, whatever the number of
+    projects, experiments and results.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def create_projects(self, count, experiments_per_project=3):
+        for i in range(count):
+            project = Project.objects.create(name=f'Project {Project.objects.count()}')
+            create_experiments(project, experiments_per_project)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, grow):
+        """Checks the query count of a page doesn't change when `grow` adds rows"""
+        before = self.count_queries(url)
+        grow()
+        self.assertEqual(self.count_queries(url), before)
+
+    def test_index(self):
+        self.create_projects(2)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('index'))
+        self.assertConstantQueries(reverse('index'), lambda: self.create_projects(10))
+
+    def test_index_experiment_counts(self):
+        self.create_projects(1, experiments_per_project=4)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['projects'][0].experiment_count, 4)
+
+    def test_project_detail(self):
+        project = Project.objects.create(name='Project')
+        create_experiments(project, 2)
+        url = reverse('project_detail_view', args=[project.id])
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.assertConstantQueries(url, lambda: create_experiments(project, 20, state='PROCESSING'))
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        self.create_projects(2)
+        for name in ('project', 'experiment', 'result'):
+            with self.subTest(model=name):
+                self.assertConstantQueries(
+                    reverse(f'admin:core_{name}_changelist'),
+                    lambda: self.create_projects(5)
+                )
+
+
+class KeysetPaginationTests(TestCase):
+
+    def collect_pages(self, url, context_name):
+        """Follows the next-page cursors and returns the items of every page"""
+        pages = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'after': cursor} if cursor else {})
+            pages.append(list(response.context[context_name]))
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_projects(self):
+        projects = [Project.objects.create(name=f'Project {i}') for i in range(PROJECTS_PER_PAGE * 2 + 1)]
+        pages = self.collect_pages(reverse('index'), 'projects')
+
+        self.assertEqual([len(page) for page in pages], [PROJECTS_PER_PAGE, PROJECTS_PER_PAGE, 1])
+        listed = [project.id for page in pages for project in page]
+        self.assertEqual(listed, [project.id for project in reversed(projects)])
+
+    def test_experiments_with_same_creation_date(self):
+        project = Project.objects.create(name='Project')
+        experiments = create_experiments(project, EXPERIMENTS_PER_PAGE + 5)
+        # Ties on creation_date are broken by id
+        Experiment.objects.filter(project=project).update(creation_date=experiments[0].creation_date)
+
+        pages = self.collect_pages(reverse('project_detail_view', args=[project.id]), 'experiments')
+
+        self.assertEqual([len(page) for page in pages], [EXPERIMENTS_PER_PAGE, 5])
+        listed = [experiment.id for page in pages for experiment in page]
+        self.assertEqual(listed, sorted((experiment.id for experiment in experiments), reverse=True))
+
+    def test_invalid_cursor_gives_first_page(self):
+        Project.objects.create(name='Project')
+        for cursor in ('not-a-cursor', '99999999999999999999.1', '-99999999999999999.1', '0.99999999999999999999'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('index'), {'after': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['projects']), 1)
+
+
+class ParameterQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Project.objects.create(name='Project')
+        cls.experiments = {}
+        for name, threshold, particles in [('low', 50, 20000), ('high', 90, 5000), ('pending', 120, None)]:
+            experiment = Experiment.objects.create(
+                project=project,
+                name=name,
+                calibration_file='camera.cal',
+                images_path='/tmp/images',
+                used_parameters={'threshold': threshold, 'search_radius': 5.0}
+            )
+            if particles is not None:
+                Result.objects.create(experiment=experiment, key_metrics={'total_particles': particles})
+            cls.experiments[name] = experiment
+
+    def names(self, queryset):
+        return sorted(queryset.values_list('name', flat=True))
+
+    def test_filter_parameter(self):
+        self.assertEqual(self.names(Experiment.objects.filter_parameter('threshold', 'gt', 80)), ['high', 'pending'])
+        self.assertEqual(self.names(Experiment.objects.filter_parameter('missing', 'gt', 0)), [])
+
+    def test_filter_metric(self):
+        self.assertEqual(self.names(Experiment.objects.filter_metric('total_particles', 'gte', 10000)), ['low'])
+
+    def test_compare(self):
+        rows = {
+            row['name']: row
+            for row in Experiment.objects.compare(parameters=['threshold'], metrics=['total_particles'])
+        }
+        self.assertEqual(rows['high']['param_threshold'], 90)
+        self.assertEqual(rows['high']['metric_total_particles'], 5000)
+        self.assertIsNone(rows['pending']['metric_total_particles'])
+
+    def test_compare_view(self):
+        response = self.client.get(reverse('compare_experiments'), {
+            'parameters': 'threshold',
+            'param.threshold__lte': '100',
+            'order': '-metric.total_particles',
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['metrics'], ['total_particles'])
+        self.assertEqual([row['name'] for row in data['experiments']], ['low', 'high'])
+        self.assertEqual(data['experiments'][0]['parameters'], {'threshold': 50})
+
+        response = self.client.get(reverse('compare_experiments'), {'order': '-metric.total_particles', 'limit': '1'})
+        self.assertEqual([row['name'] for row in response.json()['experiments']], ['low'])
+
+    def test_compare_view_rejects_invalid_keys(self):
+        for query in (
+            {'param.x)--__gt': '1'}, {'parameters': "a'b"}, {'param.threshold__in': '1'},
+            {'limit': '-1'}, {'limit': '0'}, {'limit': 'all'},
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(reverse('compare_experiments'), query).status_code, 400)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PipelineTests(TestCase):
+
+    def detections(self, frames, particles=30, seed=0):
+        """Detections of particles moving by random steps, each seen for a part of the frames"""
+        rng = np.random.default_rng(seed)
+        start = rng.normal(0, 150, (particles, 2))
+        steps = rng.uniform(-1, 1, (frames, particles, 2))
+        positions = start + np.cumsum(steps, axis=0)
+        births = rng.integers(0, frames, particles)
+        deaths = births + rng.integers(1, frames + 1, particles)
+        frame, particle = np.nonzero(
+            (np.arange(frames)[:, None] >= births) & (np.arange(frames)[:, None] < deaths)
+        )
+        return {'frame': frame, 'x': positions[frame, particle, 0], 'y': positions[frame, particle, 1]}
+
+    def track(self, detections, total_frames, chunk_size):
+        """Tracks the chunks of the sequence on their own and stitches them"""
+        chunks = []
+        for start, end in pipeline.split_into_chunks(total_frames, chunk_size):
+            rows = (detections['frame'] >= start) & (detections['frame'] < end)
+            chunk = {column: values[rows] for column, values in detections.items()}
+            chunks.append((start, end, pipeline.track_detections(chunk, start, end, 5.0)))
+        return pipeline.stitch_chunks(chunks)
+
+    def assertSameTrajectories(self, trajectories, expected):
+        for column in pipeline.TRAJECTORY_COLUMNS:
+            np.testing.assert_array_equal(trajectories[column], expected[column], err_msg=column)
+
+    def test_split_into_chunks(self):
+        self.assertEqual(pipeline.split_into_chunks(10, 4), [(0, 4), (3, 7), (6, 10)])
+        self.assertEqual(pipeline.split_into_chunks(10, 1), pipeline.split_into_chunks(10, 2))
+        self.assertEqual(pipeline.split_into_chunks(1, 4), [(0, 1)])
+        self.assertEqual(pipeline.split_into_chunks(0, 4), [])
+
+    def test_chunked_tracking_matches_single_pass(self):
+        detections = self.detections(60)
+        expected = pipeline.track_detections(detections, 0, 60, 5.0)
+        # Every particle is followed from its first to its last frame
+        self.assertEqual(len(np.unique(expected['traj_id'])), 30)
+        for chunk_size in (2, 3, 7, 50):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertSameTrajectories(self.track(detections, 60, chunk_size), expected)
+
+    def test_empty_chunks(self):
+        # No particle on frames 10-25: whole chunks have no detections
+        detections = self.detections(40, seed=1)
+        rows = (detections['frame'] < 10) | (detections['frame'] >= 26)
+        detections = {column: values[rows] for column, values in detections.items()}
+        expected = pipeline.track_detections(detections, 0, 40, 5.0)
+        for chunk_size in (3, 7):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertSameTrajectories(self.track(detections, 40, chunk_size), expected)
+
+        empty = {'frame': np.empty(0, dtype=np.int64), 'x': np.empty(0), 'y': np.empty(0)}
+        self.assertSameTrajectories(self.track(empty, 12, 5), pipeline.empty_trajectories())
+        self.assertSameTrajectories(self.track(empty, 0, 5), pipeline.empty_trajectories())
+
+    def test_single_frame(self):
+        detections = self.detections(1)
+        trajectories = self.track(detections, 1, 7)
+        self.assertSameTrajectories(trajectories, pipeline.track_detections(detections, 0, 1, 5.0))
+        np.testing.assert_array_equal(trajectories['traj_id'], np.arange(len(detections['frame'])))
+
+
+class DetectionTests(TestCase):
+
+    def detect_frame(self, image, threshold, min_particle_size):
+        """Reference detector segmenting a single frame with scipy.ndimage"""
+        mask = image > threshold
+        labels, count = ndimage.label(mask)
+        index = np.arange(1, count + 1)
+        index = index[ndimage.sum_labels(mask, labels, index) >= min_particle_size]
+        if len(index) == 0:
+            return np.empty((0, 2))
+        return np.asarray(ndimage.center_of_mass(image, labels, index))[:, ::-1]
+
+    def stack(self, dtype=np.uint8):
+        """Frames of slowly moving blobs, which overlap from one frame to the next"""
+        rng = np.random.default_rng(0)
+        points = rng.uniform(-2, 98, (40, 2))
+        frames = []
+        for frame in range(8):
+            image = synthetic.render(points + frame * 0.7, 96, 96).astype(dtype)
+            # Specks under the minimum particle size
+            image[rng.integers(0, 96, 5), rng.integers(0, 96, 5)] = 250
+            frames.append(image if frame != 3 else np.zeros_like(image))
+        return np.stack(frames)
+
+    def test_matches_per_frame_detection(self):
+        for dtype in (np.uint8, np.uint16):
+            stack = self.stack(dtype)
+            for threshold, min_particle_size in ((30, 3), (100, 1), (300, 3)):
+                with self.subTest(dtype=dtype.__name__, threshold=threshold, min_particle_size=min_particle_size):
+                    frame_index, xy = detection.detect_batch(stack, threshold, min_particle_size)
+                    self.assertTrue(np.all(np.diff(frame_index) >= 0))
+                    per_frame = detection.split_by_frame(frame_index, xy, len(stack))
+                    self.assertEqual(len(per_frame), len(stack))
+                    for image, positions in zip(stack, per_frame):
+                        np.testing.assert_allclose(positions, self.detect_frame(image, threshold, min_particle_size))
+
+        frame_index, xy = detection.detect_batch(self.stack(), 30, 3)
+        counts = np.bincount(frame_index, minlength=8)
+        self.assertEqual(counts[3], 0)
+        self.assertTrue(np.all(np.delete(counts, 3) >= 20))
+
+    def test_background_subtraction(self):
+        stack = self.stack()
+        background = np.full(stack.shape[1:], 20, dtype=np.uint8)
+        expected = np.clip(stack.astype(np.int64) - 20, 0, None).astype(np.uint8)
+        np.testing.assert_array_equal(detection.subtract_background(stack.copy(), background), expected)
+
+
+class ReaderTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        # Frame i is filled with i
+        for frame in range(11):
+            np.save(Path(folder.name) / f'frame_{frame}.npy', np.full((4, 4), frame, dtype=np.uint8))
+        self.sequence = FrameSequence(folder.name)
+
+    def batches(self, *args, **kwargs):
+        return [(first, stack[:, 0, 0].tolist()) for first, stack in self.sequence.iter_batches(*args, **kwargs)]
+
+    def test_order_and_sizes(self):
+        for prefetch in (0, 1, 3):
+            with self.subTest(prefetch=prefetch):
+                self.assertEqual(self.batches(0, 11, 4, prefetch=prefetch), [
+                    (0, [0, 1, 2, 3]), (4, [4, 5, 6, 7]), (8, [8, 9, 10])
+                ])
+                self.assertEqual(self.batches(2, 9, 3, prefetch=prefetch), [(2, [2, 3, 4]), (5, [5, 6, 7]), (8, [8])])
+                self.assertEqual(self.batches(5, 5, 3, prefetch=prefetch), [])
+
+        # Stacks stay under the byte limit, at least one frame each
+        self.assertEqual([len(frames) for _, frames in self.batches(0, 11, 8, max_batch_bytes=40)], [2] * 5 + [1])
+        self.assertEqual([len(frames) for _, frames in self.batches(0, 3, 8, max_batch_bytes=1)], [1, 1, 1])
+
+    def test_prefetch_is_bounded(self):
+        with mock.patch.object(self.sequence, 'load', wraps=self.sequence.load) as load:
+            batches = self.sequence.iter_batches(0, 11, 1, prefetch=2)
+            next(batches)
+            time.sleep(0.3)
+            # The batch taken, two queued and one waiting for room in the queue
+            self.assertEqual(load.call_count, 4)
+            batches.close()
+        self.assertFalse(any(thread.name == 'frame-prefetch' for thread in threading.enumerate()))
+
+    def test_reader_errors_are_raised(self):
+        read = self.sequence.read
+
+        def failing_read(index):
+            if index == 6:
+                raise IOError(f"Could not read frame {index}")
+            return read(index)
+
+        for prefetch in (0, 2):
+            with self.subTest(prefetch=prefetch), mock.patch.object(self.sequence, 'read', failing_read):
+                batches = self.sequence.iter_batches(0, 11, 3, prefetch=prefetch)
+                self.assertEqual(next(batches)[0], 0)
+                self.assertEqual(next(batches)[0], 3)
+                with self.assertRaisesMessage(IOError, 'Could not read frame 6'):
+                    next(batches)
+
+
+class FakePubSub:
+    """
+    Redis pub/sub returning queued messages, None standing for a heartbeat
+    timeout and coroutine functions for something happening during one
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages, timeout):
+        if not self.messages:
+            raise AssertionError("The stream read past the last event")
+        message = self.messages.pop(0)
+        if callable(message):
+            await message()
+            return None
+        return message if message is None else {'type': 'message', 'data': json.dumps(message)}
+
+    async def unsubscribe(self):
+        self.channels = []
+
+    async def aclose(self):
+        self.closed = True
+
+
+class EventStreamTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.experiment = Experiment.objects.create(
+            project=Project.objects.create(name='Project'), name='Run', state='PROCESSING', total_frames=10
+        )
+
+    def subscribe(self, messages):
+        pubsub = FakePubSub(messages)
+        client = mock.MagicMock(pubsub=mock.Mock(return_value=pubsub), aclose=mock.AsyncMock())
+        patcher = mock.patch('core.events.redis.asyncio.Redis.from_url', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return pubsub
+
+    async def stream(self, experiment_id):
+        response = await self.async_client.get(reverse('experiment_events', args=[experiment_id]))
+        if response.status_code != 200:
+            return response, []
+        content = b''.join([part async for part in response.streaming_content]).decode()
+        return response, content.split('\n\n')[:-1]
+
+    def test_wsgi_fallback(self):
+        response = self.client.get(reverse('experiment_events', args=[self.experiment.id]))
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('ASGI', response.json()['error'])
+
+    async def test_stream_ends_on_terminal_state(self):
+        pubsub = self.subscribe([
+            None,
+            {'status': 'PROCESSING', 'progress': {'current': 5, 'total': 10}},
+            {'status': 'COMPLETED'},
+        ])
+        response, messages = await self.stream(self.experiment.id)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(json.loads(messages[0][len('data: '):])['status'], 'PROCESSING')
+        # The snapshot is sent again on heartbeats
+        self.assertEqual(json.loads(messages[1][len('data: '):])['status'], 'PROCESSING')
+        self.assertEqual(json.loads(messages[2][len('data: '):])['progress']['current'], 5)
+        self.assertEqual(json.loads(messages[3][len('data: '):]), {'status': 'COMPLETED'})
+        self.assertEqual((pubsub.messages, pubsub.channels, pubsub.closed), ([], [], True))
+
+    async def test_stream_ends_without_terminal_event(self):
+        async def fail():
+            # The worker dies before publishing the error
+            await Experiment.objects.filter(id=self.experiment.id).aupdate(state='ERROR', error_message='Worker lost')
+
+        pubsub = self.subscribe([None, fail, None])
+        response, messages = await self.stream(self.experiment.id)
+
+        events = [json.loads(message[len('data: '):]) for message in messages]
+        self.assertEqual([event['status'] for event in events], ['PROCESSING', 'PROCESSING', 'ERROR'])
+        self.assertEqual(events[-1]['error_message'], 'Worker lost')
+        self.assertEqual((pubsub.messages, pubsub.closed), ([None], True))
+
+    async def test_finished_experiment_sends_one_event(self):
+        await Experiment.objects.filter(id=self.experiment.id).aupdate(state='CANCELLED')
+        pubsub = self.subscribe([{'status': 'PROCESSING'}])
+        response, messages = await self.stream(self.experiment.id)
+
+        self.assertEqual([json.loads(message[len('data: '):])['status'] for message in messages], ['CANCELLED'])
+        self.assertEqual(len(pubsub.messages), 1)
+        self.assertTrue(pubsub.closed)
+
+    async def test_missing_experiment(self):
+        response, _ = await self.stream(self.experiment.id + 1)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BulkStatusTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        project = Project.objects.create(name='Project')
+        self.experiments = [
+            Experiment.objects.create(project=project, name=f'Run {index}', celery_task_id=f'task-{index}')
+            for index in range(3)
+        ]
+        Experiment.objects.create(project=project, name='Not sent')
+        # Only the first task has a state stored in the result backend
+        backend = current_app.backend
+        stored = {
+            backend.get_key_for_task('task-0'):
+                backend.encode({'status': 'PROGRESS', 'result': {'current': 3}, 'task_id': 'task-0'})
+        }
+        patcher = mock.patch.object(backend, 'mget', side_effect=lambda keys: [stored.get(key) for key in keys])
+        self.mget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ids(self, experiments):
+        return [experiment.id for experiment in experiments]
+
+    def test_misses_are_fetched_together(self):
+        with self.assertNumQueries(1):
+            statuses = status.get_experiment_statuses(self.ids(self.experiments))
+
+        # One MGET for the task states of all the missed experiments
+        self.mget.assert_called_once()
+        self.assertEqual(len(self.mget.call_args.args[0]), 3)
+        self.assertEqual(list(statuses), self.ids(self.experiments))
+        self.assertEqual(statuses[self.experiments[0].id]['celery_state'], 'PROGRESS')
+        self.assertEqual(statuses[self.experiments[0].id]['progress'], {'current': 3})
+        self.assertEqual(statuses[self.experiments[1].id]['celery_state'], 'PENDING')
+
+    def test_hits_skip_the_database(self):
+        status.get_experiment_statuses(self.ids(self.experiments[:2]))
+        self.mget.reset_mock()
+
+        with self.assertNumQueries(0):
+            status.get_experiment_statuses(self.ids(self.experiments[:2]))
+        self.mget.assert_not_called()
+
+        # Only the invalidated and the new experiment are fetched again
+        Experiment.objects.filter(id=self.experiments[0].id).update(state='CANCELLED')
+        status.invalidate_status(self.experiments[0].id)
+        with self.assertNumQueries(1):
+            statuses = status.get_experiment_statuses(self.ids(self.experiments))
+        self.assertEqual(len(self.mget.call_args.args[0]), 2)
+        self.assertEqual(statuses[self.experiments[0].id]['status'], 'CANCELLED')
+
+    def test_view(self):
+        url = reverse('bulk_experiment_status')
+        data = self.client.get(url, {'ids': f'{self.experiments[1].id},{self.experiments[0].id},9999'}).json()
+        self.assertEqual([row['experiment_id'] for row in data['experiments']], self.ids(self.experiments[1::-1]))
+        self.assertEqual(data['missing'], [9999])
+
+        # The cached statuses are reused
+        data = self.client.get(url, {'project': self.experiments[0].project_id}).json()
+        self.assertEqual(len(data['experiments']), 4)
+        self.assertEqual(self.mget.call_args.args[0], [current_app.backend.get_key_for_task('task-2')])
+
+        too_many = ','.join(str(index) for index in range(MAX_BULK_STATUS + 1))
+        self.assertEqual(self.client.get(url, {'ids': too_many}).status_code, 400)
+        for query in (
+            {'ids': '1,two'}, {'ids': '1,99999999999999999999999'}, {'ids': '0'}, {'ids': '-3'},
+            {'project': 'all'}, {'project': '99999999999999999999999'},
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(url, query).status_code, 400)
+
+
+class StorageTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        # Unsorted rows on frames 5-30 with no particle on frames 12-14
+        rng = np.random.default_rng(0)
+        traj_id = rng.integers(0, 20, 300)
+        frame = rng.choice(np.r_[5:12, 15:31], 300)
+        unique = np.unique(np.column_stack([traj_id, frame]), axis=0)
+        rng.shuffle(unique)
+        self.trajectories = {
+            'traj_id': unique[:, 0], 'frame': unique[:, 1],
+            'x': rng.normal(size=len(unique)), 'y': rng.normal(size=len(unique)), 'z': rng.normal(size=len(unique)),
+        }
+        self.store = storage.TrajectoryStore(storage.write_store(self.folder / 'store', self.trajectories))
+
+    def rows_where(self, keep, columns=('traj_id', 'frame', 'x', 'y', 'z')):
+        """The input rows selected by `keep`, in store order (frame, then trajectory)"""
+        order = np.lexsort((self.trajectories['traj_id'][keep], self.trajectories['frame'][keep]))
+        return {name: self.trajectories[name][keep][order] for name in columns}
+
+    def assertRowsEqual(self, rows, expected):
+        for name, values in expected.items():
+            np.testing.assert_array_equal(rows[name], values, err_msg=name)
+
+    def test_meta(self):
+        self.assertEqual(len(self.store), len(self.trajectories['frame']))
+        self.assertEqual((self.store.first_frame, self.store.last_frame, self.store.trajectory_count), (5, 30, 20))
+        np.testing.assert_array_equal(
+            self.store.trajectory_lengths(), np.bincount(self.trajectories['traj_id'], minlength=20)
+        )
+
+    def test_frame_ranges(self):
+        frame = self.trajectories['frame']
+        for start, end in ((5, 31), (8, 9), (10, 16), (12, 15), (0, 7), (29, 100), (-10, 100)):
+            with self.subTest(start=start, end=end):
+                self.assertRowsEqual(self.store.frame_range(start, end), self.rows_where((frame >= start) & (frame < end)))
+
+        # Windows outside the stored frames, or inverted, are empty
+        for start, end in ((0, 5), (31, 40), (20, 10), (12, 15)):
+            with self.subTest(start=start, end=end):
+                first, last = self.store.frame_rows(start, end)
+                self.assertEqual(first, last)
+
+    def test_trajectory_lookup(self):
+        traj_id = self.trajectories['traj_id']
+        for trajectory in range(20):
+            expected = self.rows_where(traj_id == trajectory)
+            order = np.argsort(expected['frame'], kind='stable')
+            rows = self.store.trajectory(trajectory)
+            self.assertRowsEqual(rows, {name: values[order] for name, values in expected.items()})
+
+        for trajectory in (-1, 20, 1000):
+            self.assertEqual(len(self.store.trajectory(trajectory)['frame']), 0)
+
+    def test_velocities(self):
+        store = storage.TrajectoryStore(storage.write_store(self.folder / 'line', {
+            'traj_id': np.array([0, 0, 0, 1]), 'frame': np.array([2, 0, 4, 1]),
+            'x': np.array([2.0, 0.0, 8.0, 5.0]), 'y': np.zeros(4), 'z': np.zeros(4),
+        }))
+        trajectory = store.trajectory(0)
+        np.testing.assert_array_equal(trajectory['frame'], [0, 2, 4])
+        # One-sided at the ends, central inside
+        np.testing.assert_allclose(trajectory['vx'], [1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(store.trajectory(1)['vx'], [0.0])
+
+    def test_empty_store(self):
+        store = storage.TrajectoryStore(storage.write_store(self.folder / 'empty', pipeline.empty_trajectories()))
+        self.assertEqual((len(store), store.trajectory_count), (0, 0))
+        self.assertEqual(store.frame_rows(0, 10), (0, 0))
+        self.assertEqual(len(store.trajectory(0)['frame']), 0)
+
+    def test_export_text(self):
+        path = self.store.export_text(self.folder / 'trajectories.csv', block_rows=7)
+        exported = np.loadtxt(path, delimiter=',', skiprows=1)
+        self.assertEqual(path.read_text().splitlines()[0], ','.join(storage.COLUMNS))
+        np.testing.assert_array_equal(exported[:, 0], self.store.column('traj_id'))
+        np.testing.assert_array_equal(exported[:, 1], self.store.column('frame'))
+        np.testing.assert_allclose(exported[:, 2], self.store.column('x'), atol=1e-4)
+
+
+class TrajectoryApiTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        # Trajectory 0 on frames 0-9, 1 on frames 2-4 and 2 on frames 5-19
+        frames = [np.arange(10), np.arange(2, 5), np.arange(5, 20)]
+        store = storage.write_store(Path(folder.name) / 'store', {
+            'traj_id': np.concatenate([np.full(len(f), i) for i, f in enumerate(frames)]),
+            'frame': np.concatenate(frames),
+            'x': np.concatenate([frames[0] * 1.0, 100.0 + frames[1], np.full(15, 50.0)]),
+            'y': np.zeros(28),
+            'z': np.zeros(28),
+        })
+        self.store = storage.TrajectoryStore(store)
+        self.experiment = Experiment.objects.create(
+            project=Project.objects.create(name='Project'), name='Run', state='COMPLETED'
+        )
+        Result.objects.create(experiment=self.experiment, data_path=str(store))
+        self.url = reverse('trajectory_rows', args=[self.experiment.id])
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        if response.status_code != 200:
+            return response.status_code, response.json()
+        return 200, json.loads(b''.join(response.streaming_content))
+
+    def test_cursor_pages(self):
+        rows, cursor, pages = [], None, 0
+        while True:
+            params = {'limit': 6, 'columns': 'traj_id,frame'}
+            if cursor is not None:
+                params['cursor'] = cursor
+            status, page = self.get(**params)
+            self.assertEqual((status, page['total']), (200, 28))
+            self.assertLessEqual(len(page['rows']), 6)
+            rows += page['rows']
+            pages += 1
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, 5)
+        expected = self.store.rows(0, len(self.store), columns=('traj_id', 'frame'))
+        self.assertEqual(rows, [list(row) for row in zip(expected['traj_id'].tolist(), expected['frame'].tolist())])
+
+    def test_filters(self):
+        status, page = self.get(frame_start=3, frame_end=6, columns='traj_id,frame')
+        self.assertEqual(page['total'], 6)
+        self.assertEqual(page['rows'], [[0, 3], [1, 3], [0, 4], [1, 4], [0, 5], [2, 5]])
+
+        # Filters drop rows, not the total of the window
+        status, page = self.get(frame_start=3, frame_end=6, min_length=4, columns='traj_id')
+        self.assertEqual((page['total'], page['rows']), (6, [[0], [0], [0], [2]]))
+
+        status, page = self.get(bbox='99,-1,200,1', columns='traj_id,x')
+        self.assertEqual(page['rows'], [[1, 102.0], [1, 103.0], [1, 104.0]])
+
+        # Frames past the end give an empty window
+        status, page = self.get(frame_start=50)
+        self.assertEqual((page['total'], page['rows'], page['next_cursor']), (0, [], None))
+
+        response = self.client.get(self.url, {'format': 'binary', 'columns': 'frame,x', 'frame_end': 2})
+        self.assertEqual(response['X-PTV-Columns'], 'frame,x')
+        records = np.frombuffer(b''.join(response.streaming_content), dtype='<f4').reshape(-1, 2)
+        np.testing.assert_array_equal(records, [[0, 0], [1, 1]])
+
+    def test_invalid_parameters(self):
+        for params in (
+            {'limit': 0}, {'limit': -5}, {'limit': 'ten'}, {'cursor': 'next'},
+            {'frame_start': '1.5'}, {'min_length': 'long'}, {'bbox': '0,0,1'}, {'bbox': 'a,b,c,d'},
+            {'columns': 'x,speed'},
+        ):
+            with self.subTest(**params):
+                status, data = self.get(**params)
+                self.assertEqual(status, 400)
+                self.assertIn('error', data)
+
+
+class VisualizationTests(TestCase):
+
+    def setUp(self):
+        target_points = mock.patch.object(visualization, 'TARGET_POINTS', 100)
+        target_points.start()
+        self.addCleanup(target_points.stop)
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        # 50 diagonal trajectories of 40 points side by side
+        self.traj_id, frame = np.repeat(np.arange(50), 40), np.tile(np.arange(40), 50)
+        self.x, self.y = self.traj_id * 20 + frame * 0.5, frame * 10.0
+        store = storage.write_store(Path(folder.name) / 'store', {
+            'traj_id': self.traj_id, 'frame': frame, 'x': self.x, 'y': self.y, 'z': np.zeros(2000),
+        })
+        self.store = storage.TrajectoryStore(store)
+        visualization.build_levels(self.store)
+        self.experiment = Experiment.objects.create(
+            project=Project.objects.create(name='Project'), name='Run', state='COMPLETED'
+        )
+        Result.objects.create(experiment=self.experiment, data_path=str(store))
+
+    def test_levels(self):
+        meta = json.loads((self.store.path / visualization.LOD_DIR / 'meta.json').read_text())
+        self.assertEqual([level['budget'] for level in meta['levels']], [100, 400, 1600, 6400])
+        self.assertEqual(meta['levels'][-1]['points'], 2000)
+        for level in meta['levels'][:-1]:
+            self.assertLessEqual(level['points'], level['budget'])
+
+    def test_levels_with_uneven_trajectories(self):
+        # Long trajectories on even IDs, two-point ones on odd IDs
+        lengths = np.where(np.arange(50) % 2 == 0, 200, 2)
+        traj_id = np.repeat(np.arange(50), lengths)
+        frame = np.concatenate([np.arange(length) for length in lengths])
+        path = storage.write_store(self.store.path.parent / 'uneven', {
+            'traj_id': traj_id, 'frame': frame, 'x': traj_id * 20.0, 'y': frame * 1.0, 'z': np.zeros(len(frame)),
+        })
+        store = storage.TrajectoryStore(path)
+        for budget in (10, 100, 400):
+            with self.subTest(budget=budget):
+                rows = visualization._level_rows(store, budget)
+                self.assertLessEqual(len(rows), budget)
+                self.assertEqual(len(np.unique(rows)), len(rows))
+
+        visualization.build_levels(store)
+        meta = json.loads((path / visualization.LOD_DIR / 'meta.json').read_text())
+        for level in meta['levels'][:-1]:
+            self.assertLessEqual(level['points'], level['budget'])
+
+    def test_level_follows_zoom(self):
+        view = visualization.get_view(self.store)
+        self.assertEqual((view['level'], view['levels']), (0, 4))
+        self.assertLessEqual(view['points'], visualization.TARGET_POINTS)
+
+        # Zoomed in far enough, every point of the viewport is sent
+        bbox = (0, 0, 100, 100)
+        view = visualization.get_view(self.store, bbox)
+        inside = (self.x <= 100) & (self.y <= 100)
+        self.assertEqual((view['level'], view['points']), (3, int(inside.sum())))
+        # One None between consecutive trajectories
+        self.assertEqual(len(view['x']), view['points'] + len(np.unique(self.traj_id[inside])) - 1)
+
+    def test_point_budget(self):
+        levels = set()
+        for width in (50, 100, 200, 400, 800, 1200):
+            for bbox in ((0, 0, width, 400), (1000 - width, 0, 1000, 400)):
+                view = visualization.get_view(self.store, bbox)
+                self.assertLessEqual(view['points'], visualization.TARGET_POINTS)
+                levels.add(view['level'])
+        self.assertGreater(len(levels), 2)
+
+    def test_plot_view(self):
+        url = reverse('trajectory_plot', args=[self.experiment.id])
+        response = self.client.get(url, {'bbox': '0,0,100,100'})
+        self.assertEqual(response.json()['level'], 3)
+        self.assertEqual(self.client.get(url, {'kind': 'density'}).json()['dx'], self.x.max() / visualization.DENSITY_BINS)
+        for bbox in ('100,0,0,100', '0,100,100,0', '0,0,nan,100', '0,0,100'):
+            with self.subTest(bbox=bbox):
+                self.assertEqual(self.client.get(url, {'bbox': bbox}).status_code, 400)
+
+
+class ResultReuseTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+
+        self.images = self.folder / 'images'
+        self.images.mkdir()
+        for frame in range(3):
+            (self.images / f'frame_{frame}.png').write_bytes(b'frame %d' % frame)
+        self.calibration = self.folder / 'camera.cal'
+        self.calibration.write_text('calibration')
+        self.store = self.folder / 'store'
+        self.store.mkdir()
+
+        self.project = Project.objects.create(name='Project')
+        self.source = Experiment.objects.create(
+            project=self.project,
+            name='Source',
+            calibration_file=str(self.calibration),
+            images_path=str(self.images),
+            used_parameters=self.start_parameters(),
+            state='COMPLETED',
+            total_frames=3,
+            frames_processed=3
+        )
+        self.source.cache_key = self.key()
+        self.source.save()
+        Result.objects.create(experiment=self.source, data_path=str(self.store), key_metrics={'total_particles': 7})
+
+    def start_parameters(self):
+        """Parameters given to new experiments by start_experiment_view"""
+        return {'test_mode': True, 'threshold': 100, 'min_particle_size': 3}
+
+    def key(self, **changes):
+        return fingerprints.run_key(self.images, self.calibration, dict(self.start_parameters(), **changes))
+
+    def start(self, **extra):
+        data = {'name': 'Rerun', 'images_path': str(self.images), 'calibration_file': str(self.calibration)}
+        data.update(extra)
+        with mock.patch('core.tasks.test_myptv_task.apply_async') as apply_async:
+            response = self.client.post(reverse('start_experiment', args=[self.project.id]), data)
+        return response, apply_async, Experiment.objects.get(name='Rerun')
+
+    def test_run_key(self):
+        self.assertEqual(self.key(), self.key(threshold=100.0))
+        self.assertEqual(self.key(), self.key(batch_size=1))
+        self.assertNotEqual(self.key(), self.key(threshold=90))
+
+        self.calibration.write_text('other calibration')
+        self.assertNotEqual(self.key(), self.source.cache_key)
+
+    def test_identical_run_reuses_result(self):
+        response, apply_async, experiment = self.start()
+
+        apply_async.assert_not_called()
+        self.assertRedirects(response, reverse('experiment_result', args=[experiment.id]))
+        self.assertEqual(experiment.state, 'COMPLETED')
+        self.assertEqual(experiment.reused_from, self.source)
+        self.assertEqual(experiment.result.data_path, str(self.store))
+        self.assertEqual(experiment.result.key_metrics, {'total_particles': 7})
+
+    def test_force_recompute(self):
+        response, apply_async, experiment = self.start(force_recompute='1')
+
+        apply_async.assert_called_once_with(
+            (experiment.id,), task_id=experiment.celery_task_id, priority=scheduler.PRIORITY_INTERACTIVE
+        )
+        # Queued until the scheduler gives it a slot
+        self.assertEqual(experiment.state, 'PENDING')
+        self.assertEqual(experiment.cache_key, self.source.cache_key)
+
+    def test_changed_images_are_processed(self):
+        (self.images / 'frame_3.png').write_bytes(b'frame 3')
+        response, apply_async, experiment = self.start()
+        apply_async.assert_called_once()
+
+    def test_deleted_store_is_not_reused(self):
+        self.store.rmdir()
+        response, apply_async, experiment = self.start()
+        apply_async.assert_called_once()
+
+    def test_unreadable_images_path_is_processed(self):
+        # Paths that can't be listed have no fingerprint: the task reports the error
+        for images_path in (self.calibration, self.images / 'missing', self.images / ('x' * 300)):
+            with self.subTest(images_path=images_path):
+                self.assertIsNone(fingerprints.image_set_fingerprint(str(images_path)))
+                response, apply_async, experiment = self.start(images_path=str(images_path))
+                self.assertRedirects(response, reverse('experiment_monitoring', args=[experiment.id]))
+                apply_async.assert_called_once()
+                self.assertFalse(experiment.cache_key)
+                experiment.delete()
+
+        # A camera frame removed after the folder was listed
+        camera = self.images / 'cam1'
+        camera.mkdir()
+        (camera / 'frame_0.png').write_bytes(b'frame')
+        with mock.patch('core.fingerprints.list_frames', side_effect=lambda path: (
+            [] if Path(path) == self.images else [camera / 'frame_0.png', camera / 'frame_1.png']
+        )):
+            self.assertIsNone(fingerprints.image_set_fingerprint(str(self.images)))
+
+
+class StageCacheTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        data_dir = override_settings(PTV_DATA_DIR=folder.name)
+        data_dir.enable()
+        self.addCleanup(data_dir.disable)
+        self.parameters = pipeline.get_parameters({})
+
+    def test_keys_follow_stage_parameters(self):
+        segmentation = stage_cache.stage_key('segmentation', self.parameters, 'frames')
+        tracking = stage_cache.tracking_key(segmentation, self.parameters)
+
+        # A tracking parameter leaves the segmentation key unchanged
+        changed = dict(self.parameters, search_radius=7.0)
+        self.assertEqual(stage_cache.stage_key('segmentation', changed, 'frames'), segmentation)
+        self.assertNotEqual(stage_cache.tracking_key(segmentation, changed), tracking)
+
+        # A segmentation parameter changes every downstream key
+        changed = dict(self.parameters, threshold=10)
+        changed_segmentation = stage_cache.stage_key('segmentation', changed, 'frames')
+        self.assertNotEqual(changed_segmentation, segmentation)
+        self.assertNotEqual(stage_cache.tracking_key(changed_segmentation, changed), tracking)
+
+    def test_run_stage(self):
+        compute = mock.Mock(return_value={'frame': np.arange(3)})
+
+        output, cached = stage_cache.run_stage('segmentation', 'a' * 64, compute)
+        self.assertFalse(cached)
+        output, cached = stage_cache.run_stage('segmentation', 'a' * 64, compute)
+        self.assertTrue(cached)
+
+        compute.assert_called_once()
+        np.testing.assert_array_equal(output['frame'], np.arange(3))
+
+    def test_unreadable_output_is_recomputed(self):
+        path = stage_cache.output_path('tracking', 'b' * 64)
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b'truncated')
+
+        self.assertIsNone(stage_cache.load_output('tracking', 'b' * 64))
+        self.assertFalse(path.exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SweepTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        data_dir = override_settings(PTV_DATA_DIR=str(self.folder / 'data'))
+        data_dir.enable()
+        self.addCleanup(data_dir.disable)
+
+        self.images = self.folder / 'images'
+        self.images.mkdir()
+        for frame in range(4):
+            cv2.imwrite(str(self.images / f'frame_{frame}.png'), np.full((8, 10), frame * 10, dtype=np.uint8))
+        self.calibration = self.folder / 'camera.cal'
+        self.calibration.write_text('calibration')
+
+        self.project = Project.objects.create(name='Project')
+        self.preset = PresetParameters.objects.create(name='Preset', parameters={'threshold': 100, 'search_radius': 4})
+
+    def launch(self, **data):
+        body = {
+            'preset': self.preset.id,
+            'spec': {'threshold': [60, 80, 100], 'min_particle_size': [2, 3]},
+            'images_path': str(self.images),
+            'calibration_file': str(self.calibration),
+        }
+        body.update(data)
+        with mock.patch('core.sweeps.submit_sweep') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse('launch_sweep', args=[self.project.id]), body, content_type='application/json'
+                )
+        return response, submit
+
+    def test_expand_grid(self):
+        combinations = sweeps.expand_grid({'threshold': [60, 80, 100], 'search_radius': [3, 5]})
+        self.assertEqual(len(combinations), 6)
+        self.assertIn({'threshold': 80, 'search_radius': 5}, combinations)
+
+        with self.assertRaises(ValueError):
+            sweeps.expand_grid({'threshold': list(range(sweeps.MAX_SWEEP_EXPERIMENTS + 1))})
+
+    def test_sample_random(self):
+        spec = {'threshold': {'min': 50, 'max': 150}, 'search_radius': {'min': 1.0, 'max': 2.0}, 'min_particle_size': [2, 3]}
+        samples = sweeps.sample_random(spec, 20, seed=1)
+
+        self.assertEqual(samples, sweeps.sample_random(spec, 20, seed=1))
+        for values in samples:
+            self.assertIsInstance(values['threshold'], int)
+            self.assertTrue(50 <= values['threshold'] <= 150)
+            self.assertTrue(1.0 <= values['search_radius'] <= 2.0)
+            self.assertIn(values['min_particle_size'], (2, 3))
+
+    def test_launch_creates_experiments(self):
+        response, submit = self.launch()
+
+        self.assertEqual(response.status_code, 201)
+        sweep = ParameterSweep.objects.get(id=response.json()['sweep_id'])
+        experiments = list(sweep.experiments.all())
+        self.assertEqual(len(experiments), 6)
+        self.assertEqual(len({experiment.cache_key for experiment in experiments}), 6)
+        for experiment in experiments:
+            # Swept values override the preset, the rest of the preset is kept
+            self.assertEqual(experiment.used_parameters['search_radius'], 4)
+            self.assertIn(experiment.used_parameters['threshold'], (60, 80, 100))
+        submit.assert_called_once()
+        self.assertEqual(len(submit.call_args.args[1]), 6)
+
+    def test_launch_reuses_completed_runs(self):
+        parameters = pipeline.get_parameters({'threshold': 60, 'min_particle_size': 2, 'search_radius': 4})
+        store = self.folder / 'store'
+        store.mkdir()
+        source = Experiment.objects.create(
+            project=self.project,
+            name='Source',
+            calibration_file=str(self.calibration),
+            images_path=str(self.images),
+            used_parameters=parameters,
+            cache_key=fingerprints.run_key(self.images, self.calibration, parameters),
+            state='COMPLETED'
+        )
+        Result.objects.create(experiment=source, data_path=str(store))
+
+        response, submit = self.launch()
+
+        self.assertEqual(response.json()['reused'], 1)
+        self.assertEqual(len(submit.call_args.args[1]), 5)
+        self.assertEqual(Experiment.objects.filter(reused_from=source).count(), 1)
+
+    def test_invalid_sweep(self):
+        response, submit = self.launch(spec={'threshold': []})
+        self.assertEqual(response.status_code, 400)
+        submit.assert_not_called()
+        self.assertFalse(ParameterSweep.objects.exists())
+
+    @override_settings(PTV_SCHEDULER_SLOTS=0)
+    def test_acquire_slot(self):
+        sweep = ParameterSweep.objects.create(project=self.project, name='Sweep', spec={}, max_concurrent=2)
+        experiments = [
+            Experiment.objects.create(project=self.project, sweep=sweep, name=f'Run {i}') for i in range(3)
+        ]
+
+        self.assertTrue(scheduler.acquire_slot(experiments[0].id, experiments[0].celery_task_id))
+        self.assertTrue(scheduler.acquire_slot(experiments[1].id, experiments[1].celery_task_id))
+        self.assertFalse(scheduler.acquire_slot(experiments[2].id, experiments[2].celery_task_id))
+
+        Experiment.objects.filter(id=experiments[0].id).update(state='COMPLETED')
+        self.assertTrue(scheduler.acquire_slot(experiments[2].id, experiments[2].celery_task_id))
+
+    def test_frame_cache(self):
+        sequence = FrameSequence(str(self.images))
+        self.assertFalse(frame_cache.attach(sequence))
+
+        path = frame_cache.build(sequence)
+        self.assertEqual(np.load(path).shape, (4, 8, 10))
+
+        cached = FrameSequence(str(self.images))
+        self.assertTrue(frame_cache.attach(cached))
+        for index in range(4):
+            np.testing.assert_array_equal(cached.read(index), sequence.read(index))
+
+
+class CalibrationTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = Path(folder.name) / 'stereo.cal'
+        self.cameras = [
+            calibration.Camera('cam1', [-200, 0, -500], [0, -0.38, 0], 320, 240, 900,
+                               [[0.01, 0, 0.02, 0, 0], [0, 0.01, 0, 0.02, 0]]),
+            calibration.Camera('cam2', [200, 0, -500], [0, 0.38, 0], 320, 240, 900),
+        ]
+        self.path.write_text(calibration.dumps(self.cameras))
+        self.points = np.random.default_rng(0).uniform(-50, 50, (200, 3))
+
+    def test_parse(self):
+        cameras = calibration.load_cameras(self.path)
+        self.assertEqual(cameras.names, ['cam1', 'cam2'])
+        np.testing.assert_allclose(cameras['cam1'].E, self.cameras[0].E)
+        np.testing.assert_allclose(cameras['cam2'].project(self.points), self.cameras[1].project(self.points))
+
+        for text in ('1 2 3', 'cam1\n0 0 0\n0 0 0\n320 240', 'cam1\n0 0 0\n0 0 0\n320 240\n-1'):
+            with self.subTest(text=text), self.assertRaises(calibration.CalibrationError):
+                calibration.parse(text)
+
+    def test_models_are_cached_by_content(self):
+        cameras = calibration.load_cameras(self.path)
+        self.assertIs(calibration.load_cameras(str(self.path)), cameras)
+
+        self.path.write_text(calibration.dumps(self.cameras[:1]))
+        self.assertEqual(calibration.load_cameras(self.path).names, ['cam1'])
+
+    def test_back_projection_grid(self):
+        for camera in self.cameras:
+            xy = camera.project(self.points)
+            rays = camera.back_project(xy, shape=(480, 640))
+            np.testing.assert_allclose(rays, camera.back_project(xy), atol=1e-5)
+
+            # Every point lies on the ray of its own projection
+            offsets = self.points - camera.O
+            distances = np.linalg.norm(np.cross(offsets, rays), axis=1)
+            self.assertLess(distances.max(), 0.01)
+
+    def test_match_frame(self):
+        rays = [camera.back_project(camera.project(self.points), (480, 640)) for camera in self.cameras]
+        order = np.random.default_rng(1).permutation(len(self.points))
+        rays[1] = rays[1][order]
+
+        points = pipeline.match_frame(self.cameras, rays, tolerance=0.5)
+
+        self.assertEqual(len(points), len(self.points))
+        np.testing.assert_allclose(points, self.points, atol=0.01)
+
+
+class SpatialIndexTests(TestCase):
+
+    def sequential_links(self, previous, current, search_radius):
+        """Greedy linking accepting the pairs one by one, closest first"""
+        distances = np.linalg.norm(previous[:, None, :] - current[None, :, :], axis=2)
+        links = np.full(len(current), -1)
+        for flat in np.argsort(distances, axis=None, kind='stable'):
+            p, c = np.unravel_index(flat, distances.shape)
+            if distances[p, c] > search_radius:
+                break
+            if links[c] == -1 and p not in links:
+                links[c] = p
+        return links
+
+    def test_link_positions(self):
+        rng = np.random.default_rng(0)
+        for trial in range(50):
+            previous = rng.uniform(0, 20, (rng.integers(0, 40), 2))
+            current = rng.uniform(0, 20, (rng.integers(0, 40), 2))
+            if trial % 2:
+                # Integer positions give tied distances
+                previous, current = np.round(previous), np.round(current)
+            with self.subTest(trial=trial):
+                np.testing.assert_array_equal(
+                    pipeline.link_positions(previous, current, 3.0),
+                    self.sequential_links(previous, current, 3.0)
+                )
+
+    def test_ray_candidates(self):
+        rng = np.random.default_rng(0)
+        origin_a, origin_b = np.array([-200.0, 0, -500]), np.array([200.0, 0, -500])
+        points = rng.uniform(-50, 50, (300, 3))
+        rays_a = (points - origin_a) / np.linalg.norm(points - origin_a, axis=1, keepdims=True)
+        rays_b = rng.normal(points - origin_b, 0.5)
+        rays_b /= np.linalg.norm(rays_b, axis=1, keepdims=True)
+
+        a, b, distances = calibration.ray_candidates(origin_a, rays_a, origin_b, rays_b, 1.0)
+
+        dense = calibration.ray_distances(origin_a, rays_a[:, None], origin_b, rays_b[None, :])
+        expected_a, expected_b = np.nonzero(dense <= 1.0)
+        self.assertTrue(len(expected_a))
+        self.assertEqual(sorted(zip(a, b)), sorted(zip(expected_a, expected_b)))
+        np.testing.assert_allclose(distances, dense[a, b])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CheckpointTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        data_dir = override_settings(PTV_DATA_DIR=str(self.folder / 'data'), PTV_CHECKPOINT_SECONDS=0)
+        data_dir.enable()
+        self.addCleanup(data_dir.disable)
+
+        self.images = self.folder / 'images'
+        self.images.mkdir()
+        rng = np.random.default_rng(0)
+        for frame in range(12):
+            image = np.zeros((32, 32), dtype=np.uint8)
+            for x, y in rng.integers(2, 30, (5, 2)):
+                image[y - 1:y + 2, x - 1:x + 2] = 200
+            cv2.imwrite(str(self.images / f'frame_{frame}.png'), image)
+
+        self.parameters = pipeline.get_parameters({'batch_size': 2, 'background_samples': 0})
+        self.experiment = Experiment.objects.create(
+            project=Project.objects.create(name='Project'),
+            name='Run',
+            images_path=str(self.images),
+            used_parameters=self.parameters,
+            cache_key='a' * 64
+        )
+
+    def test_partial_segmentation_resumes(self):
+        sequence = pipeline.open_sequence(str(self.images), self.parameters)
+        iter_segmentation = pipeline.iter_segmentation
+
+        def interrupted(*args):
+            for count, batch in enumerate(iter_segmentation(*args)):
+                if count == 3:
+                    raise RuntimeError("Worker lost")
+                yield batch
+
+        with mock.patch('core.pipeline.iter_segmentation', interrupted):
+            with self.assertRaises(RuntimeError):
+                checkpoints.segment_chunk(sequence, 0, 12, self.parameters, 'k' * 64)
+        self.assertEqual(stage_cache.load_output('partial', 'k' * 64)['next_frame'], 6)
+
+        with mock.patch('core.pipeline.iter_segmentation', wraps=iter_segmentation) as resumed:
+            detections = checkpoints.segment_chunk(sequence, 0, 12, self.parameters, 'k' * 64)
+        self.assertEqual(resumed.call_args.args[1], 6)
+
+        expected = pipeline.segment_chunk(sequence, 0, 12, self.parameters)
+        for column in ('frame', 'x', 'y'):
+            np.testing.assert_array_equal(detections[column], expected[column])
+        self.assertIsNone(stage_cache.load_output('partial', 'k' * 64))
+
+    def test_completed_chunks(self):
+        chunks = [(0, 5), (4, 9), (8, 12)]
+        checkpoint = checkpoints.start_run(self.experiment)
+        for start, end, key in ((0, 5, 'b' * 64), (4, 9, 'c' * 64)):
+            stage_cache.save_output('tracking', key, pipeline.empty_trajectories())
+            checkpoints.record_chunk(self.experiment.id, start, end, key)
+        checkpoints.record_chunk(self.experiment.id, 8, 12, 'd' * 64)
+
+        self.experiment.refresh_from_db()
+        checkpoint = checkpoints.start_run(self.experiment)
+        # The output of the last chunk is not stored
+        self.assertEqual(checkpoints.completed_chunks(checkpoint, chunks), {(0, 5): 'b' * 64, (4, 9): 'c' * 64})
+
+        # Other inputs start from scratch
+        self.experiment.cache_key = 'e' * 64
+        self.assertEqual(checkpoints.completed_chunks(checkpoints.start_run(self.experiment), chunks), {})
+
+    def test_resume_view(self):
+        url = reverse('resume_experiment', args=[self.experiment.id])
+        with mock.patch('core.tasks.test_myptv_task.apply_async') as apply_async:
+            self.assertEqual(self.client.post(url).status_code, 409)
+
+            Experiment.objects.filter(id=self.experiment.id).update(state='ERROR', error_message='Worker lost')
+            response = self.client.post(url)
+
+        self.assertRedirects(response, reverse('experiment_monitoring', args=[self.experiment.id]))
+        self.experiment.refresh_from_db()
+        apply_async.assert_called_once_with(
+            (self.experiment.id,), task_id=self.experiment.celery_task_id, priority=self.experiment.priority
+        )
+        self.assertEqual((self.experiment.state, self.experiment.error_message), ('PENDING', ''))
+        self.assertTrue(self.experiment.celery_task_id)
+
+        # Sent twice, e.g. a double click: queued once
+        with mock.patch('core.tasks.test_myptv_task.apply_async') as apply_async:
+            self.assertEqual(self.client.post(url).status_code, 409)
+        apply_async.assert_not_called()
+
+    def test_merge_delivered_again(self):
+        output = tasks.process_chunk_task.apply(args=(self.experiment.id, 0, 12)).get()
+        Experiment.objects.filter(id=self.experiment.id).update(state='PROCESSING', total_frames=12)
+
+        first = tasks.merge_chunks_task.apply(args=([output], self.experiment.id)).get()
+        self.assertEqual(first['status'], 'COMPLETED')
+        with mock.patch('core.tasks.stage_cache.run_stage') as run_stage:
+            again = tasks.merge_chunks_task.apply(args=([output], self.experiment.id)).get()
+        run_stage.assert_not_called()
+        self.assertEqual(again, first)
+        self.assertEqual(Result.objects.filter(experiment=self.experiment).count(), 1)
+
+        # A Result left by a merge that died before completing is replaced
+        Experiment.objects.filter(id=self.experiment.id).update(state='PROCESSING')
+        Result.objects.filter(experiment=self.experiment).update(data_path='')
+        self.assertEqual(tasks.merge_chunks_task.apply(args=([output], self.experiment.id)).get(), first)
+        self.assertTrue(Result.objects.get(experiment=self.experiment).data_path)
+        self.assertEqual(Experiment.objects.get(id=self.experiment.id).state, 'COMPLETED')
+
+    def test_cancel_during_merge(self):
+        output = tasks.process_chunk_task.apply(args=(self.experiment.id, 0, 12)).get()
+        Experiment.objects.filter(id=self.experiment.id).update(state='PROCESSING', total_frames=12)
+
+        def cancel(store):
+            Experiment.objects.filter(id=self.experiment.id).update(state='CANCELLED')
+
+        with mock.patch('core.tasks.visualization.build_levels', side_effect=cancel):
+            result = tasks.merge_chunks_task.apply(args=([output], self.experiment.id)).get()
+
+        self.assertEqual(result['status'], 'CANCELLED')
+        self.assertEqual(Experiment.objects.get(id=self.experiment.id).state, 'CANCELLED')
+        self.assertFalse(Result.objects.filter(experiment=self.experiment).exists())
+
+    @override_settings(PTV_PROFILE_TASKS=True)
+    def test_chunk_profile(self):
+        output = tasks.process_chunk_task.apply(args=(self.experiment.id, 0, 12)).get()
+
+        profile = output['profile']
+        self.assertEqual(profile['frames'], 12)
+        self.assertEqual(profile['blobs'], profile['positions'])
+        self.assertGreater(profile['blobs'], 0)
+        for stage in ('read', 'segmentation', 'tracking'):
+            self.assertGreaterEqual(profile[f'{stage}_seconds'], 0)
+        self.assertTrue(Path(output['cprofile']).is_file())
+
+    def test_cancelled_segmentation_keeps_partial(self):
+        sequence = pipeline.open_sequence(str(self.images), self.parameters)
+        with self.assertRaises(cancellation.ExperimentCancelled):
+            checkpoints.segment_chunk(sequence, 0, 12, self.parameters, 'k' * 64, aborted=lambda: True)
+        self.assertEqual(stage_cache.load_output('partial', 'k' * 64)['next_frame'], 2)
+
+    def test_cancel_view(self):
+        Experiment.objects.filter(id=self.experiment.id).update(
+            state='PROCESSING', celery_task_id='merge', chunk_task_ids=['chunk-1', 'chunk-2']
+        )
+        url = reverse('cancel_experiment', args=[self.experiment.id])
+        with mock.patch('core.cancellation.events.get_redis') as get_redis, \
+                mock.patch('core.cancellation.current_app.control.revoke') as revoke:
+            response = self.client.post(url)
+
+        self.assertRedirects(response, reverse('experiment_monitoring', args=[self.experiment.id]))
+        revoke.assert_called_once_with(['merge', 'chunk-1', 'chunk-2'])
+        get_redis.return_value.set.assert_called_once_with(
+            cancellation.abort_key(self.experiment.id), 1, ex=mock.ANY
+        )
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.state, 'CANCELLED')
+        self.assertEqual(self.client.post(url).status_code, 409)
+
+    @override_settings(PTV_SCHEDULER_SLOTS=0)
+    def test_cancel_during_setup(self):
+        Experiment.objects.filter(id=self.experiment.id).update(
+            state='PENDING', polled_at=timezone.now(), celery_task_id='task'
+        )
+
+        def cancel(experiment):
+            Experiment.objects.filter(id=experiment.id).update(state='CANCELLED')
+
+        with mock.patch('core.tasks.result_cache.assign_cache_key', side_effect=cancel), \
+                mock.patch('core.tasks.chord') as chord:
+            result = tasks.test_myptv_task.apply(args=(self.experiment.id,), task_id='task').get()
+
+        self.assertEqual(result['status'], 'CANCELLED')
+        chord.assert_not_called()
+        self.experiment.refresh_from_db()
+        self.assertEqual((self.experiment.state, self.experiment.chunk_task_ids), ('CANCELLED', []))
+
+    def test_cancelled_chunk_stops(self):
+        Experiment.objects.filter(id=self.experiment.id).update(state='CANCELLED')
+        with mock.patch('core.tasks._run_chunk_stages') as run_chunk_stages:
+            result = tasks.process_chunk_task.apply(args=(self.experiment.id, 0, 12))
+
+        self.assertEqual(result.state, 'IGNORED')
+        run_chunk_stages.assert_not_called()
+        self.experiment.refresh_from_db()
+        self.assertEqual((self.experiment.state, self.experiment.frames_processed), ('CANCELLED', 0))
+
+
+class ProgressTests(TestCase):
+
+    def setUp(self):
+        self.experiment = Experiment.objects.create(
+            project=Project.objects.create(name='Project'),
+            name='Run',
+            state='PROCESSING',
+            total_frames=50
+        )
+
+    def test_reports_are_coalesced(self):
+        reporter = progress.ProgressReporter(self.experiment.id, (0, 20), frames=19, work=40, interval=3600)
+        with mock.patch('core.progress.events.notify_experiment_changed') as notify:
+            with self.assertNumQueries(0):
+                reporter.set_stage('segmentation')
+                for _ in range(40):
+                    reporter.advance(1)
+            reporter.finish()
+
+        notify.assert_called_once()
+        self.experiment.refresh_from_db()
+        self.assertEqual((self.experiment.frames_processed, self.experiment.progress_stage), (19, 'segmentation'))
+
+    def test_writes_only_changes(self):
+        reporter = progress.ProgressReporter(self.experiment.id, (20, 31), frames=10, work=20, interval=0)
+        with mock.patch('core.progress.events.notify_experiment_changed'):
+            with CaptureQueriesContext(connection) as queries:
+                reporter.advance(5)
+            updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+            self.assertEqual(len(updates), 1)
+            self.assertNotIn('progress_stage', updates[0])
+
+            # Nothing new to write
+            with self.assertNumQueries(0):
+                reporter.advance(0.5)
+
+            # Never complete before finish()
+            reporter.advance(100)
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.frames_processed, 9)
+
+    def test_redelivered_chunk_counts_once(self):
+        def deliver(work, finish):
+            reporter = progress.ProgressReporter(self.experiment.id, (20, 31), frames=10, work=20, interval=0)
+            reporter.advance(work)
+            if finish:
+                reporter.finish()
+
+        with mock.patch('core.progress.events.notify_experiment_changed'):
+            # The worker dies halfway, the chunk is delivered again and completes
+            deliver(10, finish=False)
+            deliver(4, finish=False)
+            self.experiment.refresh_from_db()
+            self.assertEqual(self.experiment.frames_processed, 5)
+            deliver(20, finish=True)
+            # Delivered once more after completing, e.g. the ack was lost
+            deliver(20, finish=True)
+            progress.ProgressReporter(self.experiment.id, (0, 20), frames=20, work=20, interval=0).finish()
+
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.frames_processed, 30)
+        self.assertEqual(self.experiment.checkpoint['counted'], {'20-31': 10, '0-20': 20})
+
+        # A restart counts only the completed chunks again
+        checkpoint = self.experiment.checkpoint
+        self.assertEqual(checkpoints.reset_progress(checkpoint, [(0, 20)], lambda start, end: end - start), 20)
+        self.assertEqual(checkpoint['counted'], {'0-20': 20})
+
+    def test_snapshot_rate(self):
+        self.experiment.processing_start_time = timezone.now() - timedelta(seconds=10)
+        self.experiment.frames_processed = 30
+        self.experiment.frames_at_start = 10
+        self.experiment.progress_stage = 'tracking'
+
+        data = events.experiment_snapshot(self.experiment)['progress']
+        self.assertAlmostEqual(data['fps'], 2.0, places=1)
+        self.assertAlmostEqual(data['eta_seconds'], 10, delta=1)
+        self.assertEqual(data['stage'], 'tracking')
+        self.assertTrue(data['status'].startswith('Tracking: Processed 30/50 frames, 2 frames/s'))
+
+
+@skipUnless(os.environ.get('PTV_DB_STRESS'), "set PTV_DB_STRESS=1 to stress the configured database")
+class DatabaseStressTests(TransactionTestCase):
+    """
+    Concurrent workers writing experiment state, as the chunk tasks do.
+    Meant to run against a local instance of the production database, e.g.
+    PTV_DB_STRESS=1 PTV_DATABASE_URL=postgres://... python manage.py test core.tests.DatabaseStressTests
+    or, for the SQLite fallback, with PTV_SQLITE_TEST_NAME set to a file
+    (the default in-memory test database doesn't lock like a file) and
+    PTV_SQLITE_JOURNAL_MODE=WAL.
+    """
+
+    def test_concurrent_progress_and_checkpoints(self):
+        workers = int(os.environ.get('PTV_DB_STRESS_WORKERS', 16))
+        writes = int(os.environ.get('PTV_DB_STRESS_WRITES', 50))
+        experiment = Experiment.objects.create(project=Project.objects.create(name='Project'), name='Run')
+        errors = []
+
+        def worker(index):
+            try:
+                for write in range(writes):
+                    checkpoints.count_chunk_frames(experiment.id, index * writes + write, index * writes + write + 1, 1)
+                    checkpoints.record_chunk(experiment.id, index * writes + write, index * writes + write + 1, 'k')
+                    Experiment.objects.filter(id=experiment.id).values('state', 'frames_processed').get()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - begin
+        print(f"[DJANGO] {workers * writes * 3} queries of {workers} workers in {elapsed:.2f}s on {connection.vendor}")
+
+        self.assertEqual(errors, [])
+        experiment.refresh_from_db()
+        self.assertEqual(experiment.frames_processed, workers * writes)
+        self.assertEqual(len(experiment.checkpoint['chunks']), workers * writes)
+
+
+class ProfilingTests(TestCase):
+
+    def test_merge_profiles(self):
+        merged = profiling.merge_profiles([
+            {'segmentation_seconds': 1.5, 'frames': 10, 'peak_rss_bytes': 300},
+            {'segmentation_seconds': 0.5, 'tracking_seconds': 0.25, 'frames': 9, 'peak_rss_bytes': 200},
+        ])
+        self.assertEqual(merged, {
+            'segmentation_seconds': 2.0, 'tracking_seconds': 0.25, 'frames': 19, 'peak_rss_bytes': 300
+        })
+
+    def test_peak_memory_of_the_run(self):
+        # A bigger task run before by the same process
+        earlier = np.ones(20_000_000)
+        process_peak = profiling.peak_rss_bytes()
+        del earlier
+
+        if profiling.reset_peak_rss():
+            peak = profiling.RunProfile().as_dict()['peak_rss_bytes']
+            self.assertLess(peak, process_peak - 100 * 2 ** 20)
+
+        # Without a reset, only a peak reached during the run is stored
+        with mock.patch('core.profiling.reset_peak_rss', return_value=False):
+            profile = profiling.RunProfile()
+            self.assertNotIn('peak_rss_bytes', profile.as_dict())
+            with mock.patch('core.profiling.peak_rss_bytes', return_value=profile.peak_before + 1):
+                self.assertEqual(profile.as_dict()['peak_rss_bytes'], profile.peak_before + 1)
+
+    def test_metrics_view(self):
+        project = Project.objects.create(name='Project')
+        for index, profile in enumerate([
+            {'read_seconds': 1.25, 'frames': 10, 'peak_rss_bytes': 2 ** 31},
+            {'read_seconds': 0.5, 'frames': 5, 'blobs': 7, 'peak_rss_bytes': 2 ** 20},
+            {},
+        ]):
+            experiment = Experiment.objects.create(project=project, name=f'Run {index}', state='COMPLETED')
+            Result.objects.create(experiment=experiment, profile=profile)
+        Experiment.objects.create(project=project, name='Queued')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        for line in (
+            'ptv_experiments{state="COMPLETED"} 3',
+            'ptv_experiments{state="PENDING"} 1',
+            'ptv_results_total 3',
+            'ptv_stage_seconds_total{stage="read"} 1.75',
+            'ptv_stage_seconds_total{stage="matching"} 0',
+            'ptv_processed_total{item="frames"} 15',
+            'ptv_processed_total{item="blobs"} 7',
+            'ptv_worker_peak_rss_bytes 2147483648',
+        ):
+            self.assertIn(line, lines)
+
+
+class SchedulerTests(TestCase):
+
+    def setUp(self):
+        self.batch = Project.objects.create(name='Batch')
+        self.sweep = ParameterSweep.objects.create(project=self.batch, name='Sweep', spec={}, max_concurrent=0)
+        self.other = Project.objects.create(name='Other')
+        self.now = timezone.now()
+
+    def queue(self, project, name, minutes_ago, priority=scheduler.PRIORITY_BATCH, **fields):
+        """A waiting experiment whose task just asked for a slot"""
+        return Experiment.objects.create(
+            project=project, name=name, priority=priority, queued_at=self.now - timedelta(minutes=minutes_ago),
+            polled_at=timezone.now(), **fields
+        )
+
+    def test_projects_take_turns(self):
+        for index in range(6):
+            self.queue(self.batch, f'Sweep {index}', 10 - index, sweep=self.sweep)
+        self.queue(self.other, 'Check', 1)
+
+        snapshot = scheduler.queue_snapshot()
+        names = [experiment['name'] for experiment in snapshot['queue']]
+        # Queued last, but its project has nothing running yet
+        self.assertEqual(names[:3], ['Sweep 0', 'Check', 'Sweep 1'])
+        self.assertEqual(snapshot['waiting'], 7)
+
+    @override_settings(PTV_SCHEDULER_SLOTS=2)
+    def test_acquire_slot(self):
+        self.queue(self.batch, 'Running', 20, state='PROCESSING')
+        sweep_run = self.queue(self.batch, 'Sweep', 10, sweep=self.sweep)
+        preview = self.queue(self.batch, 'Preview', 1, priority=scheduler.PRIORITY_INTERACTIVE)
+        check = self.queue(self.other, 'Check', 5)
+        stale = self.queue(self.other, 'Lost', 30)
+        Experiment.objects.filter(id=stale.id).update(polled_at=self.now - timedelta(hours=1))
+
+        # One free slot: interactive runs go first, whatever their project has running
+        self.assertFalse(scheduler.acquire_slot(check.id, check.celery_task_id))
+        self.assertFalse(scheduler.acquire_slot(sweep_run.id, sweep_run.celery_task_id))
+        self.assertTrue(scheduler.acquire_slot(preview.id, preview.celery_task_id))
+        self.assertFalse(scheduler.acquire_slot(check.id, check.celery_task_id))
+
+        # The project limit passes the next slot to the other project
+        Project.objects.filter(id=self.batch.id).update(max_concurrent=1)
+        Experiment.objects.filter(name='Running').update(state='COMPLETED')
+        self.assertFalse(scheduler.acquire_slot(sweep_run.id, sweep_run.celery_task_id))
+        self.assertTrue(scheduler.acquire_slot(check.id, check.celery_task_id))
+        self.assertEqual(Experiment.objects.get(id=check.id).state, 'PROCESSING')
+
+    @override_settings(PTV_SCHEDULER_SLOTS=1)
+    def test_denied_requests_take_no_lock(self):
+        self.queue(self.batch, 'Running', 20, state='PROCESSING')
+        waiting = self.queue(self.other, 'Waiting', 5)
+        with mock.patch.object(Project.objects, 'select_for_update', wraps=Project.objects.select_for_update) as lock:
+            self.assertFalse(scheduler.acquire_slot(waiting.id, waiting.celery_task_id))
+            lock.assert_not_called()
+
+            Experiment.objects.filter(name='Running').update(state='COMPLETED')
+            self.assertTrue(scheduler.acquire_slot(waiting.id, waiting.celery_task_id))
+            lock.assert_called_once()
+
+    @override_settings(PTV_SCHEDULER_SLOTS=0)
+    def test_finished_experiments_get_no_slot(self):
+        for state in ('COMPLETED', 'ERROR', 'CANCELLED'):
+            experiment = self.queue(self.batch, state, 1, state=state)
+            self.assertFalse(scheduler.acquire_slot(experiment.id, experiment.celery_task_id))
+        self.assertFalse(scheduler.acquire_slot(experiment.id + 1, ''))
+        # A retried task of a granted experiment keeps its slot, the task of an earlier submission doesn't
+        running = self.queue(self.batch, 'Running', 1, state='PROCESSING', celery_task_id='current')
+        self.assertTrue(scheduler.acquire_slot(running.id, 'current'))
+        self.assertFalse(scheduler.acquire_slot(running.id, 'stale'))
+        with mock.patch('core.tasks.cancellation.is_aborted', return_value=False), \
+                mock.patch('core.tasks.chord') as chord:
+            result = tasks.test_myptv_task.apply(args=(running.id,), task_id='stale').get()
+        self.assertEqual(result['status'], 'PROCESSING')
+        chord.assert_not_called()
+
+        # The task ends instead of waiting for a slot
+        done = self.queue(self.other, 'Done', 1, state='COMPLETED')
+        with mock.patch('core.tasks.cancellation.is_aborted', return_value=False), \
+                mock.patch('core.tasks.chord') as chord:
+            result = tasks.test_myptv_task.apply(args=(done.id,))
+        self.assertEqual((result.state, result.get()['status']), ('SUCCESS', 'COMPLETED'))
+        chord.assert_not_called()
+        self.assertEqual(Experiment.objects.get(id=done.id).state, 'COMPLETED')
+
+    def test_fair_order_limits(self):
+        now = timezone.now()
+        projects = {
+            1: {'share': 1, 'max_concurrent': 0},
+            2: {'share': 1, 'max_concurrent': 2},
+        }
+
+        def experiment(id, project_id, sweep_id=None, priority=scheduler.PRIORITY_BATCH):
+            return {'id': id, 'project_id': project_id, 'sweep_id': sweep_id, 'priority': priority,
+                    'queued_at': now + timedelta(seconds=id)}
+
+        # Project 1: a sweep limited to one running experiment, then a single run
+        waiting = [experiment(id, 1, sweep_id=7) for id in range(1, 4)] + [experiment(4, 1)]
+        waiting += [experiment(id, 2) for id in range(5, 9)]
+        order = scheduler.fair_order(waiting, {2: 1}, {}, projects, {7: 1}, slots=4)
+        self.assertEqual(
+            [(row['id'], row['granted']) for row in order],
+            [(1, True), (4, True), (5, True), (2, False), (6, False), (3, False), (7, False), (8, False)]
+        )
+
+        # Thousands of experiments held by a sweep limit
+        waiting = [experiment(id, id % 10, sweep_id=100 + id % 10) for id in range(20000)]
+        projects = {project_id: {'share': 1 + project_id % 3, 'max_concurrent': 0} for project_id in range(10)}
+        order = scheduler.fair_order(waiting, {}, {}, projects, dict.fromkeys(range(100, 110), 2), slots=0)
+        self.assertEqual(len(order), 20000)
+        self.assertEqual(sum(row['granted'] for row in order), 20)
+        self.assertTrue(all(row['granted'] for row in order[:20]))
+        # Within a project, experiments keep their queue order
+        self.assertEqual([row['id'] for row in order if row['project_id'] == 3], list(range(3, 20000, 10)))
+
+    @override_settings(PTV_SCHEDULER_SLOTS=1)
+    def test_queue_status_view(self):
+        Experiment.objects.create(
+            project=self.other, name='Done', state='COMPLETED',
+            processing_start_time=self.now - timedelta(minutes=10), processing_end_time=self.now - timedelta(minutes=8)
+        )
+        self.queue(self.batch, 'Running', 20, state='PROCESSING')
+        self.queue(self.batch, 'First', 10)
+        self.queue(self.other, 'Second', 5)
+
+        data = self.client.get(reverse('queue_status')).json()
+        self.assertEqual((data['slots'], data['running'], data['waiting']), (1, 1, 2))
+        self.assertEqual(data['mean_run_seconds'], 120.0)
+        self.assertEqual(
+            [(row['name'], row['position'], row['estimated_wait_seconds']) for row in data['queue']],
+            [('Second', 1, 120.0), ('First', 2, 240.0)]
+        )
+        self.assertContains(self.client.get(reverse('queue')), 'Second')
+
+
+class MetricsTests(TestCase):
+
+    def test_online_stats(self):
+        values = np.random.default_rng(0).normal(5.0, 2.0, 1000)
+        stats = metrics.OnlineStats()
+        for block in np.array_split(values, 7):
+            stats.update(block)
+        stats.update([])
+
+        result = stats.as_dict()
+        self.assertEqual(result['count'], 1000)
+        self.assertAlmostEqual(result['mean'], values.mean())
+        self.assertAlmostEqual(result['std'], values.std())
+        self.assertEqual((result['min'], result['max']), (values.min(), values.max()))
+
+    def test_write_store_statistics(self):
+        # Trajectory 0 moves one unit per frame over frames 0-3, trajectory 1 stands still in frames 1-2
+        trajectories = {
+            'traj_id': np.array([0, 0, 0, 0, 1, 1]),
+            'frame': np.array([0, 1, 2, 3, 1, 2]),
+            'x': np.array([0.0, 1.0, 2.0, 3.0, 20.0, 20.0]),
+            'y': np.array([0.0, 0.0, 0.0, 0.0, 20.0, 20.0]),
+            'z': np.zeros(6),
+        }
+        statistics = metrics.TrajectoryMetrics()
+        with tempfile.TemporaryDirectory() as folder, mock.patch.object(storage, 'METRICS_BLOCK_ROWS', 4):
+            storage.write_store(Path(folder) / 'store', trajectories, metrics=statistics)
+
+        self.assertEqual(statistics.key_metrics(), {
+            'total_particles': 6,
+            'total_trajectories': 2,
+            'mean_particles_per_frame': 1.5,
+            'mean_trajectory_length': 3.0,
+            'mean_speed': 0.6667,
+            'coverage': 0.2222,
+        })
+        result = statistics.statistics()
+        self.assertEqual(result['particles_per_frame']['max'], 2)
+        self.assertEqual(result['trajectory_length']['histogram']['counts'][:3], [0, 1, 1])
+        self.assertEqual(result['velocity']['vx']['max'], 1.0)
+        self.assertEqual(sum(result['velocity']['speed']['histogram']['counts']), 6)
+        self.assertEqual(result['coverage']['occupied_cells'], 2)
+
+    def test_result_view_shows_statistics(self):
+        statistics = metrics.TrajectoryMetrics()
+        statistics.update({
+            'traj_id': np.array([0, 0]), 'frame': np.array([0, 1]),
+            'x': np.array([0.0, 1.0]), 'y': np.zeros(2), 'z': np.zeros(2),
+            'vx': np.ones(2), 'vy': np.zeros(2), 'vz': np.zeros(2),
+        })
+        project = Project.objects.create(name='Project')
+        experiment = Experiment.objects.create(project=project, name='Run', state='COMPLETED')
+        Result.objects.create(experiment=experiment, statistics=statistics.statistics())
+
+        response = self.client.get(reverse('experiment_result', args=[experiment.id]))
+        self.assertContains(response, 'Particles per frame')
+        self.assertContains(response, 'Speed (per frame)')
+
+
+class DownloadTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        data_dir = override_settings(PTV_DATA_DIR=str(self.folder))
+        data_dir.enable()
+        self.addCleanup(data_dir.disable)
+
+        store = storage.write_store(self.folder / 'results' / 'store', {
+            'traj_id': np.repeat(np.arange(10), 20),
+            'frame': np.tile(np.arange(20), 10),
+            'x': np.arange(200.0), 'y': np.arange(200.0), 'z': np.zeros(200),
+        })
+        notes = self.folder / 'notes.txt'
+        notes.write_text('notes')
+        self.project = Project.objects.create(name='My Project')
+        self.experiment = Experiment.objects.create(project=self.project, name='Run', state='COMPLETED')
+        self.result = Result.objects.create(
+            experiment=self.experiment, data_path=str(store), additional_files=[str(notes)]
+        )
+        self.column = (store / 'x.npy').read_bytes()
+
+    def download(self, name, **kwargs):
+        return self.client.get(reverse('download_result_file', args=[self.experiment.id, name]), **kwargs)
+
+    def test_ranges(self):
+        response = self.download('store/x.npy')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), len(self.column))
+        self.assertEqual(b''.join(response.streaming_content), self.column)
+
+        response = self.download('store/x.npy', HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.column)}')
+        self.assertEqual(b''.join(response.streaming_content), self.column[100:200])
+
+        response = self.download('store/x.npy', HTTP_RANGE='bytes=-16')
+        self.assertEqual(b''.join(response.streaming_content), self.column[-16:])
+
+        # A range of another version of the file gets the whole file
+        response = self.download('store/x.npy', HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        self.assertEqual(self.download('store/x.npy', HTTP_RANGE=f'bytes={len(self.column)}-').status_code, 416)
+        self.assertEqual(self.download('store/../x.npy').status_code, 404)
+
+    def test_compressed_and_exported_files(self):
+        response = self.download('store/x.npy', data={'compress': 'gzip'})
+        self.assertIn('exp_', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.column)
+        self.assertEqual(self.download('store/x.npy', data={'compress': 'brotli'}).status_code, 400)
+
+        self.assertEqual(b''.join(self.download('files/notes.txt').streaming_content), b'notes')
+
+    def test_streamed_csv(self):
+        exported = self.folder / 'exported.csv'
+        self.result.get_store().export_text(exported)
+
+        # Streamed from the store without writing the export
+        with mock.patch('core.downloads.STREAM_BLOCK_ROWS', 30):
+            response = self.download('trajectories.csv')
+            self.assertEqual(response['Content-Type'], 'text/csv')
+            self.assertIn('exp_', response['Content-Disposition'])
+            self.assertEqual(b''.join(response.streaming_content), exported.read_bytes())
+            response = self.download('trajectories.csv', data={'compress': 'gzip'})
+            self.assertIn('trajectories.csv.gz', response['Content-Disposition'])
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), exported.read_bytes())
+        self.result.refresh_from_db()
+        self.assertFalse(self.result.txt_file_path)
+        self.assertEqual(self.download('trajectories.csv', data={'compress': 'brotli'}).status_code, 400)
+
+        # An existing export is served as a file, ranges included
+        self.result.txt_file_path = str(exported)
+        self.result.save(update_fields=['txt_file_path'])
+        self.assertIn('trajectories.csv', downloads.result_files(self.result))
+        response = self.download('trajectories.csv', HTTP_RANGE='bytes=0-6')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'traj_id')
+
+    def test_project_archive(self):
+        Experiment.objects.create(project=self.project, name='Queued')
+        for compress in ('', 'deflate'):
+            response = self.client.get(reverse('download_project', args=[self.project.id]), {'compress': compress})
+            self.assertIn('my-project.zip', response['Content-Disposition'])
+            with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+                folder = f'{self.experiment.id}_run'
+                self.assertIn(f'{folder}/files/notes.txt', archive.namelist())
+                self.assertEqual(archive.read(f'{folder}/store/x.npy'), self.column)
+                self.assertEqual(json.loads(archive.read(f'{folder}/experiment.json'))['name'], 'Run')
+
+    def test_async_iteration(self):
+        async def collect():
+            return [block async for block in downloads.aiterate(downloads.iter_zip([('a.txt', b'a' * 10)]))]
+
+        archive = b''.join(asyncio.run(collect()))
+        with zipfile.ZipFile(BytesIO(archive)) as opened:
+            self.assertEqual(opened.read('a.txt'), b'a' * 10)
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        data_dir = override_settings(PTV_DATA_DIR=str(self.folder / 'data'))
+        data_dir.enable()
+        self.addCleanup(data_dir.disable)
+
+    def test_ground_truth_scores_perfectly(self):
+        synthetic.generate(self.folder / 'stereo', particles=20, frames=5, cameras=2, width=128, height=128)
+        truth = synthetic.load_truth(self.folder / 'stereo')
+        self.assertEqual(len(truth['x']), 100)
+        cameras = calibration.load_cameras(str(self.folder / 'stereo' / synthetic.CALIBRATION_FILE))
+        self.assertEqual(cameras.names, ['cam1', 'cam2'])
+
+        scores = synthetic.score_tracking(truth, truth, tolerance=0.1)
+        self.assertEqual(scores['rms_error'], 0.0)
+        for score in benchmark_pipeline.ACCURACY_SCORES:
+            self.assertEqual(scores[score], 1.0)
+
+    def test_pipeline_recovers_trajectories(self):
+        description = synthetic.generate(self.folder / 'single', particles=15, frames=10, width=128, height=128)
+        parameters = pipeline.get_parameters(dict(synthetic.PARAMETERS, chunk_size=4))
+        profile = profiling.RunProfile()
+        trajectories, frames = benchmark_pipeline.run_pipeline(description['images_path'], '', parameters, profile)
+
+        self.assertEqual(frames, 10)
+        scores = synthetic.score_tracking(synthetic.load_truth(self.folder / 'single'), trajectories, tolerance=1.0)
+        self.assertGreater(scores['position_recall'], 0.9)
+        self.assertGreater(scores['link_precision'], 0.9)
+
+    def test_regressions_are_reported(self):
+        arguments = ['--particles', '20', '--frames', '6', '--size', '96x96']
+        call_command('benchmark_pipeline', *arguments, '--save', 'baseline', stdout=StringIO())
+        call_command('benchmark_pipeline', *arguments, '--compare', 'baseline', '--max-slowdown', '0.99', stdout=StringIO())
+
+        path = self.folder / 'data' / 'benchmarks' / 'results' / 'baseline.json'
+        record = json.loads(path.read_text())
+        record['fps'] *= 1000
+        record['accuracy']['link_recall'] = 1.5
+        path.write_text(json.dumps(record))
+        with self.assertRaisesRegex(CommandError, 'frames/s dropped.*link_recall dropped'):
+            call_command('benchmark_pipeline', *arguments, '--compare', 'baseline', stdout=StringIO())
+
+        with self.assertRaisesRegex(CommandError, 'another configuration'):
+            call_command('benchmark_pipeline', *arguments, '--seed', '1', '--compare', 'baseline', stdout=StringIO())
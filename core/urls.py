@@ -8,12 +8,33 @@ urlpatterns = [
     # Project management
     path('project/create/', views.create_project_view, name='create_project_view'),
     path('project/<int:project_id>/', views.project_detail_view, name='project_detail_view'),
+    path('project/<int:project_id>/download/', views.download_project_view, name='download_project'),
     
     # Experiments
     path('project/<int:project_id>/start/', views.start_experiment_view, name='start_experiment'),
     path('experiment/<int:experiment_id>/monitor/', views.experiment_monitoring_view, name='experiment_monitoring'),
     path('experiment/<int:experiment_id>/result/', views.result_view, name='experiment_result'),
+    path('experiment/<int:experiment_id>/resume/', views.resume_experiment_view, name='resume_experiment'),
+    path('experiment/<int:experiment_id>/cancel/', views.cancel_experiment_view, name='cancel_experiment'),
+    path('experiment/<int:experiment_id>/download/<path:name>', views.download_result_file_view, name='download_result_file'),
+    
+    # Parameter sweeps
+    path('project/<int:project_id>/sweep/', views.launch_sweep_view, name='launch_sweep'),
+    path('sweep/<int:sweep_id>/', views.sweep_detail_view, name='sweep_detail'),
+    
+    # Processing queue
+    path('queue/', views.queue_view, name='queue'),
     
     # API endpoints
     path('api/experiment/<int:experiment_id>/status/', views.get_experiment_status_view, name='get_experiment_status'),
+    path('api/experiment/<int:experiment_id>/events/', views.experiment_events_view, name='experiment_events'),
+    path('api/experiments/status/', views.bulk_experiment_status_view, name='bulk_experiment_status'),
+    path('api/queue/', views.queue_status_view, name='queue_status'),
+    path('api/experiments/compare/', views.compare_experiments_view, name='compare_experiments'),
+    path('api/experiment/<int:experiment_id>/trajectories/', views.trajectory_rows_view, name='trajectory_rows'),
+    path('api/experiment/<int:experiment_id>/trajectories/<int:traj_id>/', views.trajectory_detail_view, name='trajectory_detail'),
+    path('api/experiment/<int:experiment_id>/plot/', views.trajectory_plot_view, name='trajectory_plot'),
+    
+    # Prometheus scraping
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
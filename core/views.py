@@ -1,20 +1,85 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_http_methods
-from celery.result import AsyncResult
-from .models import Project, Experiment, Result
-from .tasks import test_myptv_task
+from django.utils import timezone
+from django.utils.text import slugify
+from .models import JSON_KEY_PATTERN, JSONNumber, Project, Experiment, ParameterSweep, PresetParameters, Result
+from .storage import COLUMNS
+from . import cancellation, downloads, events, pipeline, profiling, result_cache, scheduler, status, sweeps, visualization
 import json
+import numpy as np
 
+# Maximum number of rows returned by one page of the JSON trajectory API
+MAX_PAGE_ROWS = 100_000
+
+# Maximum number of experiments of one bulk status request
+MAX_BULK_STATUS = 1000
+
+# Page sizes of the project and experiment lists
+PROJECTS_PER_PAGE = 24
+EXPERIMENTS_PER_PAGE = 50
+
+CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Largest primary key the database columns hold (64-bit signed)
+MAX_ID = 2 ** 63 - 1
+
+# Parameter/metric comparison API
+MAX_COMPARE_ROWS = 1000
+COMPARE_LOOKUPS = ('exact', 'gt', 'gte', 'lt', 'lte')
+
+
+def _keyset_page(queryset, cursor, page_size):
+    """
+    Returns one page of a queryset ordered by (-creation_date, -id) and the
+    cursor of the next page (None on the last page).
+    
+    The page is found by seeking past the last row of the previous one
+    (using the creation_date/id indexes) instead of an OFFSET, so every page
+    costs the same. An invalid cursor gives the first page.
+    """
+    queryset = queryset.order_by('-creation_date', '-id')
+    try:
+        micros, last_id = (int(value) for value in cursor.split('.'))
+        if not 0 <= last_id <= MAX_ID:
+            raise ValueError(f"Cursor ID out of range: {last_id}")
+        created = CURSOR_EPOCH + timedelta(microseconds=micros)
+    except (ValueError, OverflowError):
+        pass
+    else:
+        queryset = queryset.filter(
+            Q(creation_date__lt=created) | Q(creation_date=created, id__lt=last_id)
+        )
+    
+    page = list(queryset[:page_size + 1])
+    if len(page) <= page_size:
+        return page, None
+    
+    page = page[:page_size]
+    last = page[-1]
+    micros = (last.creation_date - CURSOR_EPOCH) // timedelta(microseconds=1)
+    return page, f'{micros}.{last.id}'
 
 
 def index_view(request):
     """
     Main view that displays all projects.
     """
-    projects = Project.objects.all()
+    projects, next_cursor = _keyset_page(
+        Project.objects.annotate(experiment_count=Count('experiments')),
+        request.GET.get('after', ''),
+        PROJECTS_PER_PAGE
+    )
     return render(request, 'core/index.html', {
-        'projects': projects
+        'projects': projects,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after')
     })
 
 
@@ -22,12 +87,21 @@ def project_detail_view(request, project_id):
     """
     Detail view for a project showing its experiments.
     """
-    project = get_object_or_404(Project, id=project_id)
-    experiments = project.experiments.all()
+    project = get_object_or_404(
+        Project.objects.annotate(experiment_count=Count('experiments')),
+        id=project_id
+    )
+    experiments, next_cursor = _keyset_page(
+        Experiment.objects.filter(project=project),
+        request.GET.get('after', ''),
+        EXPERIMENTS_PER_PAGE
+    )
     
     return render(request, 'core/project_detail.html', {
         'project': project,
-        'experiments': experiments
+        'experiments': experiments,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after')
     })
 
 def start_experiment_view(request, project_id):
@@ -37,8 +111,9 @@ def start_experiment_view(request, project_id):
     project = get_object_or_404(Project, id=project_id)
 
     if request.method == 'POST':
-        # Convert used_parameters dict to JSON string
-        parameters_json = json.dumps({
+        # Store every parameter, defaults included, so experiments can be
+        # compared and filtered by them
+        parameters = pipeline.get_parameters({
             'test_mode': True,
             'threshold': 100,
             'min_particle_size': 3
@@ -49,25 +124,31 @@ def start_experiment_view(request, project_id):
             project=project,
             name=request.POST.get('name', f'Experiment {project.experiments.count() + 1}'),
             state='PENDING',  # <--- usa 'state' en vez de 'status'
-            calibration_file='C:/ptv_platform/calibrations/test_calibration.cal',  # <--- renombrado
-            images_path='C:/ptv_platform/experiment_data/images/',
-            used_parameters=parameters_json,
+            calibration_file=request.POST.get('calibration_file') or 'C:/ptv_platform/calibrations/test_calibration.cal',
+            images_path=request.POST.get('images_path') or 'C:/ptv_platform/experiment_data/images/',
+            used_parameters=parameters,
             notes=request.POST.get('notes', '')
         )
 
         print(f"[DJANGO] Experiment created: ID={experiment.id}, Name={experiment.name}")
 
-        # 2. Enqueue the Celery task
-        task = test_myptv_task.delay(experiment.id)
+        # 2. Reuse the result of an identical run unless asked not to
+        result_cache.assign_cache_key(experiment)
+        source = None
+        if not request.POST.get('force_recompute'):
+            source = result_cache.find_reusable_result(experiment)
+        if source is not None:
+            result_cache.reuse_result(experiment, source)
+            events.notify_experiment_changed(experiment)
+            print(f"[DJANGO] Reusing result of experiment {source.experiment_id}")
+            return redirect('experiment_result', experiment_id=experiment.id)
 
-        print(f"[DJANGO] Task enqueued in Celery: Task ID={task.id}")
+        # 3. Queue the experiment: it stays PENDING until the scheduler gives it a slot
+        priority = scheduler.PRIORITY_BATCH if request.POST.get('priority') == 'batch' else scheduler.PRIORITY_INTERACTIVE
+        task = scheduler.submit(experiment, priority)
+        events.notify_experiment_changed(experiment)
 
-        # 3. Save the Celery task ID for monitoring and update state
-        experiment.celery_task_id = task.id
-        experiment.state = 'PROCESSING'
-        experiment.save()
-
-        print(f"[DJANGO] Task ID saved in experiment")
+        print(f"[DJANGO] Task enqueued in Celery: Task ID={task.id}, priority {priority}")
 
         # 4. Redirect to monitoring page
         return redirect('experiment_monitoring', experiment_id=experiment.id)
@@ -78,6 +159,188 @@ def start_experiment_view(request, project_id):
     })
 
 
+def _parse_sweep(project, data):
+    """
+    Builds an unsaved ParameterSweep from form or JSON data.
+    
+    Raises:
+        ValueError: If a field is invalid
+    """
+    spec = data.get('spec') or {}
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"spec is not valid JSON: {e}")
+    
+    preset = None
+    if data.get('preset'):
+        preset = PresetParameters.objects.filter(id=data['preset']).first()
+        if preset is None:
+            raise ValueError(f"Preset {data['preset']} does not exist")
+    
+    mode = str(data.get('mode') or 'GRID').upper()
+    if mode not in dict(ParameterSweep.MODES):
+        raise ValueError(f"Unknown mode: {mode}")
+    
+    try:
+        samples = int(data.get('samples') or 0)
+        seed = int(data['seed']) if data.get('seed') not in (None, '') else None
+        priority = int(data.get('priority') if data.get('priority') not in (None, '') else 5)
+        max_concurrent = int(data.get('max_concurrent') if data.get('max_concurrent') not in (None, '') else 2)
+    except (TypeError, ValueError):
+        raise ValueError("samples, seed, priority and max_concurrent must be integers")
+    if not 0 <= priority <= 9:
+        raise ValueError("priority must be between 0 (highest) and 9")
+    if samples < 0 or max_concurrent < 0:
+        raise ValueError("samples and max_concurrent can't be negative")
+    
+    return ParameterSweep(
+        project=project,
+        preset=preset,
+        name=data.get('name') or f'Sweep {project.sweeps.count() + 1}',
+        mode=mode,
+        spec=spec,
+        samples=samples,
+        seed=seed,
+        priority=priority,
+        max_concurrent=max_concurrent,
+        images_path=data.get('images_path') or 'C:/ptv_platform/experiment_data/images/',
+        calibration_file=data.get('calibration_file') or 'C:/ptv_platform/calibrations/test_calibration.cal'
+    )
+
+
+def launch_sweep_view(request, project_id):
+    """
+    View that launches a parameter sweep over a preset.
+    
+    Accepts the HTML form, or a JSON body (then answers in JSON):
+        {"preset": 1, "mode": "GRID", "spec": {"threshold": [60, 80, 100]},
+         "priority": 5, "max_concurrent": 2, "images_path": ..., "calibration_file": ...}
+    """
+    project = get_object_or_404(Project, id=project_id)
+    is_json = request.content_type == 'application/json'
+    
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body) if is_json else request.POST
+            if not isinstance(data, dict):
+                raise ValueError("The request body must be a JSON object")
+            sweep = _parse_sweep(project, data)
+            pending = sweeps.create_sweep(sweep)
+        except ValueError as e:
+            if is_json:
+                return JsonResponse({'error': str(e)}, status=400)
+            return render(request, 'core/launch_sweep.html', {
+                'project': project,
+                'presets': PresetParameters.objects.all(),
+                'error': str(e),
+                'form': request.POST
+            }, status=400)
+        
+        print(f"[DJANGO] Sweep created: ID={sweep.id}, {sweep.experiments.count()} experiments")
+        
+        # Submit once the experiments are visible to the workers
+        transaction.on_commit(lambda: sweeps.submit_sweep(sweep, pending))
+        
+        if is_json:
+            total = sweep.experiments.count()
+            return JsonResponse({
+                'sweep_id': sweep.id,
+                'experiments': total,
+                'submitted': len(pending),
+                'reused': total - len(pending),
+            }, status=201)
+        return redirect('sweep_detail', sweep_id=sweep.id)
+    
+    return render(request, 'core/launch_sweep.html', {
+        'project': project,
+        'presets': PresetParameters.objects.all(),
+        'form': {}
+    })
+
+
+def sweep_detail_view(request, sweep_id):
+    """
+    Detail view of a parameter sweep showing its experiments.
+    """
+    sweep = get_object_or_404(ParameterSweep.objects.select_related('project', 'preset'), id=sweep_id)
+    experiments = list(sweep.experiments.order_by('id'))
+    swept_keys = list(sweep.spec)
+    rows = [
+        (experiment, [experiment.used_parameters.get(key) for key in swept_keys])
+        for experiment in experiments
+    ]
+    
+    return render(request, 'core/sweep_detail.html', {
+        'sweep': sweep,
+        'swept_keys': swept_keys,
+        'rows': rows,
+        'experiment_ids': ','.join(str(experiment.id) for experiment in experiments)
+    })
+
+
+# States from which an experiment can be resumed
+RESUMABLE_STATES = ('ERROR', 'CANCELLED')
+CANCELLABLE_STATES = ('PENDING', 'PROCESSING')
+
+
+@require_http_methods(["POST"])
+def resume_experiment_view(request, experiment_id):
+    """
+    Re-enqueues an interrupted experiment. Chunks completed before the
+    interruption are not processed again (see core.checkpoints).
+    """
+    # Locked like a cancellation, so a resume sent twice queues the experiment once
+    with transaction.atomic():
+        experiment = get_object_or_404(Experiment.objects.select_for_update(), id=experiment_id)
+        if experiment.state not in RESUMABLE_STATES:
+            return JsonResponse({
+                'error': f'Experiments in state {experiment.state} cannot be resumed'
+            }, status=409)
+        
+        experiment.state = 'PENDING'
+        experiment.error_message = ''
+        experiment.processing_end_time = None
+        experiment.save(update_fields=['state', 'error_message', 'processing_end_time'])
+    cancellation.clear_abort(experiment.id)
+    
+    # Back in the queue, PENDING until the scheduler gives it a slot
+    task = scheduler.submit(experiment)
+    events.notify_experiment_changed(experiment)
+    
+    completed = len(experiment.checkpoint.get('chunks', {}))
+    print(f"[DJANGO] Experiment {experiment.id} resumed ({completed} chunks checkpointed): Task ID={task.id}")
+    
+    return redirect('experiment_monitoring', experiment_id=experiment.id)
+
+
+@require_http_methods(["POST"])
+def cancel_experiment_view(request, experiment_id):
+    """
+    Cancels a queued or running experiment: its tasks are revoked and the
+    running ones stop at their next abort check (see core.cancellation).
+    The work already done is kept for a resume.
+    """
+    with transaction.atomic():
+        experiment = get_object_or_404(Experiment.objects.select_for_update(), id=experiment_id)
+        if experiment.state not in CANCELLABLE_STATES:
+            return JsonResponse({
+                'error': f'Experiments in state {experiment.state} cannot be cancelled'
+            }, status=409)
+        
+        experiment.state = 'CANCELLED'
+        experiment.processing_end_time = timezone.now()
+        experiment.save(update_fields=['state', 'processing_end_time'])
+    
+    cancellation.request_abort(experiment.id)
+    revoked = cancellation.revoke_tasks(experiment)
+    events.notify_experiment_changed(experiment)
+    print(f"[DJANGO] Experiment {experiment.id} cancelled: {len(revoked)} tasks revoked")
+    
+    return redirect('experiment_monitoring', experiment_id=experiment.id)
+
+
 def experiment_monitoring_view(request, experiment_id):
     """
     Monitoring view for experiment progress.
@@ -95,45 +358,469 @@ def get_experiment_status_view(request, experiment_id):
     API endpoint that returns the current experiment status in JSON.
     Used by JavaScript to update the UI in real time.
     """
-    try:
-        experiment = Experiment.objects.get(id=experiment_id)
-        
-        data = {
-            'experiment_id': experiment.id,
-            'name': experiment.name,
-            'status': experiment.state,
-            'status_display': experiment.get_state_display(),
-            'error_message': experiment.error_message,
-        }
-        
-        # Check Celery task state if available
-        if experiment.celery_task_id:
-            task_result = AsyncResult(experiment.celery_task_id)
-            
-            data['celery_state'] = task_result.state
-            data['celery_info'] = str(task_result.info) if task_result.info else None
-            
-            if task_result.state == 'PROGRESS':
-                data['progress'] = task_result.info
-        
-        # Include result info if experiment is completed
-        if experiment.state == 'COMPLETED':
-            try:
-                result = experiment.result
-                data['result'] = {
-                    'id': result.id,
-                    'file_path': result.result_file_path,
-                    'metrics': result.key_metrics
-                }
-            except Result.DoesNotExist:
-                data['result'] = None
-        
-        return JsonResponse(data)
-        
-    except Experiment.DoesNotExist:
+    data = status.get_experiment_statuses([experiment_id]).get(experiment_id)
+    if data is None:
         return JsonResponse({
             'error': 'Experiment not found'
         }, status=404)
+    
+    return JsonResponse(data)
+
+
+@require_http_methods(["GET"])
+def bulk_experiment_status_view(request):
+    """
+    API endpoint that returns the status of many experiments in one request.
+    
+    Query parameters (one of):
+        ids: Comma-separated experiment IDs
+        project: Project ID, for all of its experiments
+    """
+    if request.GET.get('project'):
+        try:
+            project_id = int(request.GET['project'])
+            if not 1 <= project_id <= MAX_ID:
+                raise ValueError(f"Project ID out of range: {project_id}")
+        except ValueError:
+            return JsonResponse({'error': 'project must be an integer'}, status=400)
+        experiment_ids = list(
+            Experiment.objects.filter(project_id=project_id).values_list('id', flat=True)
+        )
+    else:
+        try:
+            experiment_ids = [int(value) for value in request.GET.get('ids', '').split(',') if value]
+            # IDs the database can't hold would fail the query
+            if not all(1 <= experiment_id <= MAX_ID for experiment_id in experiment_ids):
+                raise ValueError("Experiment ID out of range")
+        except ValueError:
+            return JsonResponse({'error': 'ids must be comma-separated integers'}, status=400)
+    
+    if len(experiment_ids) > MAX_BULK_STATUS:
+        return JsonResponse({'error': f'At most {MAX_BULK_STATUS} experiments per request'}, status=400)
+    
+    statuses = status.get_experiment_statuses(experiment_ids)
+    return JsonResponse({
+        'experiments': list(statuses.values()),
+        'missing': [experiment_id for experiment_id in experiment_ids if experiment_id not in statuses],
+    })
+
+
+def queue_view(request):
+    """
+    View of the processing queue: slots in use, experiments waiting per
+    project and their estimated wait.
+    """
+    return render(request, 'core/queue.html', {'queue': scheduler.queue_snapshot()})
+
+
+@require_http_methods(["GET"])
+def queue_status_view(request):
+    """
+    API endpoint that returns the queue depth and estimated waits in JSON
+    (see scheduler.queue_snapshot).
+    """
+    return JsonResponse(scheduler.queue_snapshot())
+
+
+def _parse_value_key(name):
+    """Splits 'param.threshold' / 'metric.total_particles' into (kind, key), or None"""
+    kind, _, key = name.partition('.')
+    if kind not in ('param', 'metric') or not JSON_KEY_PATTERN.match(key):
+        return None
+    return kind, key
+
+
+@require_http_methods(["GET"])
+def compare_experiments_view(request):
+    """
+    API endpoint that compares experiments by parameter and metric values.
+    
+    Filtering and sorting run in the database (see ExperimentQuerySet).
+    
+    Query parameters:
+        project: Project ID (optional)
+        parameters: Comma-separated parameters to return, e.g. threshold,search_radius
+        metrics: Comma-separated result metrics to return, e.g. total_particles
+        param.<key>__<lookup>, metric.<key>__<lookup>: Filters, with lookup one
+            of exact, gt, gte, lt, lte, e.g. param.threshold__gt=80
+        order: Sort key, e.g. -metric.total_particles (default: newest first)
+        limit: Maximum number of experiments (default and maximum MAX_COMPARE_ROWS)
+    """
+    parameters = [key for key in request.GET.get('parameters', '').split(',') if key]
+    metrics = [key for key in request.GET.get('metrics', '').split(',') if key]
+    for key in parameters + metrics:
+        if not JSON_KEY_PATTERN.match(key):
+            return JsonResponse({'error': f'Invalid key: {key}'}, status=400)
+    
+    experiments = Experiment.objects.all()
+    if request.GET.get('project'):
+        try:
+            experiments = experiments.filter(project_id=int(request.GET['project']))
+        except ValueError:
+            return JsonResponse({'error': 'project must be an integer'}, status=400)
+    
+    for name, value in request.GET.items():
+        if '__' not in name:
+            continue
+        target, _, lookup = name.rpartition('__')
+        parsed = _parse_value_key(target)
+        if parsed is None or lookup not in COMPARE_LOOKUPS:
+            return JsonResponse({'error': f'Invalid filter: {name}'}, status=400)
+        try:
+            value = float(value)
+        except ValueError:
+            return JsonResponse({'error': f'{name} must be a number'}, status=400)
+        
+        kind, key = parsed
+        if kind == 'param':
+            experiments = experiments.filter_parameter(key, lookup, value)
+        else:
+            experiments = experiments.filter_metric(key, lookup, value)
+    
+    order = request.GET.get('order', '')
+    if order:
+        parsed = _parse_value_key(order.lstrip('-'))
+        if parsed is None:
+            return JsonResponse({'error': f'Invalid order: {order}'}, status=400)
+        kind, key = parsed
+        if kind == 'param' and key not in parameters:
+            parameters.append(key)
+        if kind == 'metric' and key not in metrics:
+            metrics.append(key)
+        field = F(f'{kind}_{key}')
+        ordering = [field.desc(nulls_last=True) if order.startswith('-') else field.asc(nulls_last=True), '-id']
+    else:
+        ordering = ['-creation_date', '-id']
+    
+    try:
+        limit = _int_param(request.GET, 'limit', MAX_COMPARE_ROWS)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    limit = min(limit, MAX_COMPARE_ROWS)
+    
+    rows = experiments.compare(parameters, metrics).order_by(*ordering)[:limit]
+    return JsonResponse({
+        'parameters': parameters,
+        'metrics': metrics,
+        'experiments': [
+            {
+                'id': row['id'],
+                'name': row['name'],
+                'state': row['state'],
+                'parameters': {key: row[f'param_{key}'] for key in parameters},
+                'metrics': {key: row[f'metric_{key}'] for key in metrics},
+            }
+            for row in rows
+        ]
+    })
+
+
+async def experiment_events_view(request, experiment_id):
+    """
+    Server-Sent Events stream with the progress of an experiment.
+    
+    Pushes the events published by the workers over Redis pub/sub. Needs the
+    ASGI server (ptv_controller.asgi); under WSGI it answers 501 and the
+    monitoring page falls back to polling `get_experiment_status_view`.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Event streaming requires the ASGI server'}, status=501)
+    
+    if not await Experiment.objects.filter(id=experiment_id).aexists():
+        return JsonResponse({'error': 'Experiment not found'}, status=404)
+    
+    response = StreamingHttpResponse(
+        events.stream_experiment_events(experiment_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _get_result(experiment_id):
+    """Returns the Result of a completed experiment, or None"""
+    return Result.objects.filter(
+        experiment_id=experiment_id,
+        experiment__state='COMPLETED'
+    ).first()
+
+
+def _int_param(params, name, default):
+    """Reads an integer query parameter, raising ValueError if malformed"""
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+
+def _parse_trajectory_query(request, store):
+    """
+    Reads the trajectory API filters from the query string.
+    
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    params = request.GET
+    columns = tuple(params.get('columns', ','.join(COLUMNS)).split(','))
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    
+    bbox = None
+    if params.get('bbox'):
+        try:
+            bbox = tuple(float(value) for value in params['bbox'].split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) not in (4, 6):
+            raise ValueError("bbox must be xmin,ymin,xmax,ymax or xmin,ymin,zmin,xmax,ymax,zmax")
+    
+    frame_start = _int_param(params, 'frame_start', store.first_frame)
+    frame_end = _int_param(params, 'frame_end', store.last_frame + 1)
+    first, last = store.frame_rows(frame_start, frame_end)
+    
+    limit = _int_param(params, 'limit', MAX_PAGE_ROWS)
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    
+    return {
+        'columns': columns,
+        'frame_start': frame_start,
+        'frame_end': frame_end,
+        'total': last - first,
+        'first': max(first, _int_param(params, 'cursor', first)),
+        'last': last,
+        'min_length': _int_param(params, 'min_length', None) if params.get('min_length') else None,
+        'bbox': bbox,
+        'limit': min(limit, MAX_PAGE_ROWS),
+    }
+
+
+def _stream_json_rows(experiment_id, store, query):
+    """Generates one JSON page of trajectory rows, block by block"""
+    yield json.dumps({
+        'experiment_id': experiment_id,
+        'columns': query['columns'],
+        'frame_start': query['frame_start'],
+        'frame_end': query['frame_end'],
+        'total': query['total'],
+    })[:-1] + ', "rows": ['
+    
+    separator = ''
+    next_row = query['first']
+    blocks = store.iter_rows(
+        query['first'], query['last'],
+        columns=query['columns'],
+        min_length=query['min_length'],
+        bbox=query['bbox'],
+        limit=query['limit']
+    )
+    for block, next_row in blocks:
+        if len(block[query['columns'][0]]):
+            rows = list(zip(*(block[name].tolist() for name in query['columns'])))
+            yield separator + json.dumps(rows)[1:-1]
+            separator = ', '
+    
+    next_cursor = next_row if next_row < query['last'] else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+
+def _stream_binary_rows(store, query):
+    """Generates the trajectory rows as little-endian float32 records"""
+    blocks = store.iter_rows(
+        query['first'], query['last'],
+        columns=query['columns'],
+        min_length=query['min_length'],
+        bbox=query['bbox']
+    )
+    for block, _ in blocks:
+        yield np.column_stack([block[name] for name in query['columns']]).astype('<f4').tobytes()
+
+
+@require_http_methods(["GET"])
+def trajectory_rows_view(request, experiment_id):
+    """
+    API endpoint that streams the trajectory rows of a completed experiment.
+    
+    Query parameters (all optional):
+        frame_start, frame_end: Frame window [frame_start, frame_end)
+        min_length: Minimum number of points of the trajectories
+        bbox: xmin,ymin,xmax,ymax or xmin,ymin,zmin,xmax,ymax,zmax
+        columns: Comma-separated subset of the stored columns
+        format: 'json' (default) or 'binary'
+        limit, cursor: JSON pagination; pass the returned `next_cursor`
+            as `cursor` to get the next page of the same window
+    
+    JSON pages also give the `total` rows of the frame window, before the
+    min_length and bbox filters.
+    
+    The binary format streams the whole window as float32 records with the
+    columns listed in the X-PTV-Columns header.
+    """
+    result = _get_result(experiment_id)
+    if result is None:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+    
+    store = result.get_store()
+    try:
+        query = _parse_trajectory_query(request, store)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    if request.GET.get('format') == 'binary':
+        response = StreamingHttpResponse(
+            _stream_binary_rows(store, query),
+            content_type='application/octet-stream'
+        )
+        response['X-PTV-Columns'] = ','.join(query['columns'])
+        return response
+    
+    return StreamingHttpResponse(
+        _stream_json_rows(experiment_id, store, query),
+        content_type='application/json'
+    )
+
+
+@require_http_methods(["GET"])
+def trajectory_detail_view(request, experiment_id, traj_id):
+    """
+    API endpoint that returns all the points of one trajectory in JSON.
+    """
+    result = _get_result(experiment_id)
+    if result is None:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+    
+    trajectory = result.get_store().trajectory(traj_id)
+    if not len(trajectory['frame']):
+        return JsonResponse({'error': 'Trajectory not found'}, status=404)
+    
+    return JsonResponse({
+        'experiment_id': experiment_id,
+        'traj_id': traj_id,
+        **{name: values.tolist() for name, values in trajectory.items()}
+    })
+
+
+@require_http_methods(["GET"])
+@cache_control(private=True, max_age=3600)
+def trajectory_plot_view(request, experiment_id):
+    """
+    API endpoint that returns the trajectories to plot for a viewport.
+    
+    The level of detail is chosen so the response stays under
+    visualization.TARGET_POINTS points whatever the size of the result.
+    
+    Query parameters (all optional):
+        bbox: xmin,ymin,xmax,ymax viewport (defaults to the whole result)
+        kind: 'lines' (default) or 'density' for the overview heatmap
+    """
+    result = _get_result(experiment_id)
+    if result is None:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+    
+    store = result.get_store()
+    if request.GET.get('kind') == 'density':
+        return JsonResponse(visualization.get_density(store))
+    
+    bbox = None
+    if request.GET.get('bbox'):
+        try:
+            bbox = tuple(float(value) for value in request.GET['bbox'].split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4:
+            return JsonResponse({'error': 'bbox must be xmin,ymin,xmax,ymax'}, status=400)
+    
+    try:
+        view = visualization.get_view(store, bbox)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(view)
+
+
+@require_http_methods(["GET", "HEAD"])
+def download_result_file_view(request, experiment_id, name):
+    """
+    Downloads a file of the result of a completed experiment.
+    
+    `name` is one of downloads.result_files, or trajectories.csv, which
+    is streamed from the trajectory store when it wasn't exported. Single
+    byte ranges of files are served so downloads can resume; ?compress=gzip
+    or zstd streams the file compressed instead.
+    """
+    result = _get_result(experiment_id)
+    if result is None:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+    
+    filename = f"exp_{experiment_id}_{name.replace('/', '_')}"
+    compression = request.GET.get('compress')
+    if compression and compression not in downloads.available_compressions():
+        return JsonResponse({'error': f'Unsupported compression: {compression}'}, status=400)
+    
+    path = downloads.result_files(result).get(name)
+    if path is None:
+        if name == downloads.CSV_NAME and result.data_path and Path(result.data_path).is_dir():
+            return downloads.csv_response(request, result.get_store(), filename, compression)
+        return JsonResponse({'error': 'File not found'}, status=404)
+    
+    if compression:
+        return downloads.compressed_response(request, path, filename, compression)
+    return downloads.file_response(request, path, filename)
+
+
+@require_http_methods(["GET"])
+def download_project_view(request, project_id):
+    """
+    Streams a zip archive of the results of the completed experiments of a
+    project. ?compress=deflate compresses the files, which are stored as is
+    by default (the binary columns barely shrink).
+    """
+    project = get_object_or_404(Project, id=project_id)
+    return downloads.zip_response(
+        request,
+        downloads.project_entries(project),
+        f"{slugify(project.name) or 'project'}.zip",
+        compress=request.GET.get('compress') == 'deflate'
+    )
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Prometheus metrics: experiments by state and the processing profiles of
+    all results (see core.profiling), added up by the database.
+    """
+    states = dict(Experiment.objects.values_list('state').annotate(count=Count('id')).order_by())
+    profile_keys = [f'{stage}_seconds' for stage in profiling.STAGES] + list(profiling.COUNTERS)
+    totals = Result.objects.aggregate(
+        results=Count('id'),
+        peak_rss_bytes=Max(JSONNumber('profile', 'peak_rss_bytes')),
+        **{key: Sum(JSONNumber('profile', key)) for key in profile_keys}
+    )
+    
+    def metric(name, kind, help_text, samples):
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{labels} {float(value or 0):.15g}' for labels, value in samples]
+        return lines
+    
+    lines = metric('ptv_experiments', 'gauge', 'Experiments by state', [
+        (f'{{state="{state}"}}', states.get(state, 0)) for state, _ in Experiment.STATES
+    ])
+    lines += metric('ptv_results_total', 'counter', 'Stored results', [('', totals['results'])])
+    lines += metric('ptv_stage_seconds_total', 'counter', 'Processing time of the results by stage', [
+        (f'{{stage="{stage}"}}', totals[f'{stage}_seconds']) for stage in profiling.STAGES
+    ])
+    lines += metric('ptv_processed_total', 'counter', 'Items processed by the results', [
+        (f'{{item="{counter}"}}', totals[counter]) for counter in profiling.COUNTERS
+    ])
+    lines += metric('ptv_worker_peak_rss_bytes', 'gauge', 'Highest peak memory of a worker process during a chunk or merge of the results', [
+        ('', totals['peak_rss_bytes'])
+    ])
+    
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 def result_view(request, experiment_id):
@@ -152,10 +839,43 @@ def result_view(request, experiment_id):
     
     return render(request, 'core/result.html', {
         'experiment': experiment,
-        'result': result
+        'result': result,
+        'files': downloads.result_files(result) if result else {},
+        'csv_name': downloads.CSV_NAME,
+        'compressions': downloads.available_compressions(),
+        **_statistics_context(result.statistics if result else {})
     })
 
 
+def _statistics_context(statistics):
+    """Rows of the statistics table and bars of the histograms of Result.statistics"""
+    if not statistics:
+        return {}
+    
+    rows = [('Particles per frame', statistics['particles_per_frame']),
+            ('Trajectory length (frames)', statistics['trajectory_length'])]
+    rows += [(f'Velocity {axis}', statistics['velocity'][axis]) for axis in ('vx', 'vy', 'vz')]
+    rows.append(('Speed', statistics['velocity']['speed']))
+    rows += [(f'Position {axis}', statistics['position'][axis]) for axis in ('x', 'y', 'z')]
+    
+    histograms = []
+    for title, histogram in (('Trajectory length (frames)', statistics['trajectory_length']['histogram']),
+                             ('Speed (per frame)', statistics['velocity']['speed']['histogram'])):
+        edges, counts = histogram['edges'], histogram['counts']
+        # Leave out the empty bins at both ends
+        used = [index for index, count in enumerate(counts) if count]
+        if not used:
+            continue
+        bars = []
+        for index in range(used[0], used[-1] + 1):
+            low, high = edges[index], edges[index + 1]
+            label = f'{low:g}+' if high is None else f'{low:g} - {high:g}'
+            bars.append({'label': label, 'count': counts[index]})
+        histograms.append({'title': title, 'bars': bars, 'max_count': max(counts)})
+    
+    return {'statistics_rows': rows, 'histograms': histograms, 'coverage': statistics['coverage']}
+
+
 def create_project_view(request):
     """
     View for creating a new project.
@@ -0,0 +1,214 @@
+"""
+Levels of detail for plotting trajectories.
+
+When a result is generated, the trajectory store is decimated into a pyramid
+of levels. Level k holds at most TARGET_POINTS * 4**k points: trajectories are
+subsampled with a stride (keeping their first and last points) and, if that
+is not enough, only one trajectory out of m is kept; when uneven trajectory
+lengths still leave too many points, the kept points are strided once more.
+The last level is the
+full data. Zooming in by 2 on both axes shows a quarter of the area, so the
+right level for a viewport is the finest one whose points inside it stay
+under TARGET_POINTS. A level only stores row numbers of the trajectory store,
+sorted by the cell of a coarse spatial grid, so the points of a viewport are
+read from the memory-mapped store without scanning the level.
+
+A 2D density histogram of all points is also stored for overview heatmaps.
+"""
+from pathlib import Path
+import json
+
+import numpy as np
+
+
+# Maximum number of points sent to the browser for one view
+TARGET_POINTS = 20_000
+
+# Cells per axis of the spatial index of every level
+INDEX_GRID = 64
+
+# Bins per axis of the density histogram
+DENSITY_BINS = 256
+
+LOD_DIR = 'lod'
+
+
+def _level_rows(store, budget):
+    """Returns the rows (store order) kept for a level with the given point budget"""
+    lengths = store.trajectory_lengths()
+    total = int(lengths.sum())
+    if total <= budget:
+        return np.arange(total)
+
+    traj_order, traj_offsets = (np.asarray(array) for array in store.trajectory_index())
+    traj_ids = np.repeat(np.arange(len(lengths)), lengths)
+    rank = np.arange(total) - traj_offsets[traj_ids]
+
+    stride = int(np.ceil(total / budget))
+    keep = (rank % stride == 0) | (rank == lengths[traj_ids] - 1)
+
+    kept = int(keep.sum())
+    if kept > budget:
+        keep &= traj_ids % int(np.ceil(kept / budget)) == 0
+
+    # The trajectories left can be the long ones
+    kept_rows = np.flatnonzero(keep)
+    if len(kept_rows) > budget:
+        kept_rows = kept_rows[::int(np.ceil(len(kept_rows) / budget))]
+
+    return np.sort(traj_order[kept_rows])
+
+
+def build_levels(store):
+    """
+    Precomputes the levels of detail and density histogram of a store.
+
+    Args:
+        store (TrajectoryStore): Result to decimate
+
+    Returns:
+        Path: Directory holding the levels
+    """
+    output = store.path / LOD_DIR
+    output.mkdir(exist_ok=True)
+
+    x = np.asarray(store.column('x'))
+    y = np.asarray(store.column('y'))
+    if len(x):
+        bounds = [float(x.min()), float(y.min()), float(x.max()), float(y.max())]
+    else:
+        bounds = [0.0, 0.0, 1.0, 1.0]
+    cell_size = [
+        max(bounds[2] - bounds[0], 1e-9) / INDEX_GRID,
+        max(bounds[3] - bounds[1], 1e-9) / INDEX_GRID,
+    ]
+
+    levels = []
+    budget = TARGET_POINTS
+    while True:
+        rows = _level_rows(store, budget)
+
+        # Sort rows by grid cell to answer viewport queries with slices
+        cells = _cell_index(x[rows], y[rows], bounds, cell_size)
+        order = np.argsort(cells, kind='stable')
+        cell_offsets = np.searchsorted(cells[order], np.arange(INDEX_GRID ** 2 + 1))
+
+        np.save(output / f'level_{len(levels)}_rows.npy', rows[order].astype(np.int64))
+        np.save(output / f'level_{len(levels)}_cells.npy', cell_offsets.astype(np.int64))
+        levels.append({'budget': budget, 'points': len(rows)})
+        if len(rows) == len(store):
+            break
+        budget *= 4
+
+    density, _, _ = np.histogram2d(
+        x, y, bins=DENSITY_BINS,
+        range=[[bounds[0], bounds[2]], [bounds[1], bounds[3]]]
+    )
+    np.save(output / 'density.npy', density.T.astype(np.float32))
+
+    z = np.asarray(store.column('z'))
+    meta = {
+        'bounds': bounds,
+        'cell_size': cell_size,
+        'levels': levels,
+        'has_z': bool(len(z) and np.ptp(z) > 0),
+    }
+    (output / 'meta.json').write_text(json.dumps(meta, indent=2))
+    return output
+
+
+def _cell_index(x, y, bounds, cell_size):
+    col = np.clip(((x - bounds[0]) / cell_size[0]).astype(np.int64), 0, INDEX_GRID - 1)
+    row = np.clip(((y - bounds[1]) / cell_size[1]).astype(np.int64), 0, INDEX_GRID - 1)
+    return row * INDEX_GRID + col
+
+
+def _load_meta(store_path):
+    return json.loads((Path(store_path) / LOD_DIR / 'meta.json').read_text())
+
+
+def _viewport_cells(meta, bbox):
+    """Returns the grid cells overlapping a viewport"""
+    bounds, cell_size = meta['bounds'], meta['cell_size']
+    col_range = [
+        int(np.clip((bbox[i] - bounds[0]) // cell_size[0], 0, INDEX_GRID - 1)) for i in (0, 2)
+    ]
+    row_range = [
+        int(np.clip((bbox[i] - bounds[1]) // cell_size[1], 0, INDEX_GRID - 1)) for i in (1, 3)
+    ]
+    return [
+        row * INDEX_GRID + col
+        for row in range(row_range[0], row_range[1] + 1)
+        for col in range(col_range[0], col_range[1] + 1)
+    ]
+
+
+def get_view(store, bbox=None):
+    """
+    Returns the trajectories to plot for a viewport, at the right level.
+
+    Args:
+        store (TrajectoryStore): Result to plot
+        bbox (tuple): (xmin, ymin, xmax, ymax) viewport, or None for all
+
+    Returns:
+        dict: Plotly-ready line coordinates (trajectories separated by None)
+        and the level used
+
+    Raises:
+        ValueError: If the viewport is inverted or not finite
+    """
+    meta = _load_meta(store.path)
+    bounds = meta['bounds']
+    bbox = bbox or bounds
+    if not np.all(np.isfinite(bbox)) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError("bbox must be finite with xmin <= xmax and ymin <= ymax")
+    cells = np.array(_viewport_cells(meta, bbox))
+    lod_dir = store.path / LOD_DIR
+
+    # Finest level whose points in the viewport cells fit the target
+    for level in range(len(meta['levels']) - 1, -1, -1):
+        cell_offsets = np.load(lod_dir / f'level_{level}_cells.npy', mmap_mode='r')
+        if level == 0 or int((cell_offsets[cells + 1] - cell_offsets[cells]).sum()) <= TARGET_POINTS:
+            break
+
+    level_rows = np.load(lod_dir / f'level_{level}_rows.npy', mmap_mode='r')
+    rows = np.sort(np.concatenate(
+        [level_rows[cell_offsets[cell]:cell_offsets[cell + 1]] for cell in cells]
+    ))
+    axes = ('x', 'y', 'z') if meta['has_z'] else ('x', 'y')
+    data = {name: store.column(name)[rows] for name in ('traj_id', 'frame') + axes}
+
+    inside = (
+        (data['x'] >= bbox[0]) & (data['x'] <= bbox[2]) &
+        (data['y'] >= bbox[1]) & (data['y'] <= bbox[3])
+    )
+    order = np.nonzero(inside)[0]
+    order = order[np.lexsort((data['frame'][order], data['traj_id'][order]))]
+
+    # Break the line between trajectories
+    breaks = np.nonzero(np.diff(data['traj_id'][order]))[0] + 1
+    view = {
+        'level': level,
+        'levels': len(meta['levels']),
+        'points': len(order),
+        'bounds': bounds,
+    }
+    for axis in axes:
+        values = np.round(data[axis][order], 3).astype(object)
+        view[axis] = np.insert(values, breaks, None).tolist()
+    return view
+
+
+def get_density(store):
+    """Returns the density histogram of all points as a Plotly heatmap"""
+    meta = _load_meta(store.path)
+    bounds = meta['bounds']
+    density = np.load(store.path / LOD_DIR / 'density.npy')
+    return {
+        'z': density.tolist(),
+        'x0': bounds[0],
+        'dx': (bounds[2] - bounds[0]) / DENSITY_BINS,
+        'y0': bounds[1],
+        'dy': (bounds[3] - bounds[1]) / DENSITY_BINS,
+    }